@@ -3,12 +3,19 @@ import logging
 from frappe import _
 import json
 import time
-from typing import List, Dict, Any, Generator
+import os
+import hashlib
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Generator, NamedTuple, Optional, Tuple
 from werkzeug.wrappers import Response
 from erpnext_chatgpt.erpnext_chatgpt.tools import (
-    get_tools, get_claude_tools, available_functions, is_write_operation,
-    get_write_tool_metadata, get_tool_by_name, json_serial
+    get_tools, get_claude_tools, call_tool, is_write_operation,
+    get_write_tool_metadata, get_tool_by_name, get_tool_registry, json_serial
 )
+from erpnext_chatgpt.erpnext_chatgpt.retention import load_archived_messages, restore_archived_conversation
+from erpnext_chatgpt.erpnext_chatgpt.storage_codec import CODEC_KEY, decode_json, encode_json, is_encoded, resolve_codec
 
 # Initialize module-level logger with aiassistant namespace
 logger = frappe.logger("aiassistant", allow_site=True)
@@ -37,6 +44,109 @@ def sse_heartbeat() -> str:
     """Generate a heartbeat event to keep connection alive."""
     return ": heartbeat\n\n"
 
+
+class StreamingJsonFieldExtractor:
+    """
+    Incrementally decode one top-level string field from a JSON object that
+    arrives in chunks (e.g. the `message` argument of `final_answer` while the
+    tool-input JSON is still being generated).
+
+    feed() returns the newly decoded characters of the field, so the caller can
+    forward them as they arrive. Each input character is scanned once.
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self.field = field
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._is_key = False
+        self._expect_key = False
+        self._string_chars = []
+        self._last_key = None
+        self._capturing = False
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        output = []
+        buffer = self._buffer
+
+        while self._pos < len(buffer):
+            char = buffer[self._pos]
+
+            if self._in_string:
+                if char == '\\':
+                    # Wait for the full escape sequence before decoding it
+                    if self._pos + 1 >= len(buffer):
+                        break
+                    code = buffer[self._pos + 1]
+                    if code == 'u':
+                        if self._pos + 6 > len(buffer):
+                            break
+                        decoded = self._decode_unicode(buffer[self._pos + 2:self._pos + 6])
+                        self._pos += 6
+                    else:
+                        decoded = self._ESCAPES.get(code, code)
+                        self._pos += 2
+                    self._emit(decoded, output)
+                    continue
+                if char == '"':
+                    self._in_string = False
+                    if self._is_key:
+                        self._last_key = "".join(self._string_chars)
+                    self._capturing = False
+                    self._pos += 1
+                    continue
+                self._emit(char, output)
+                self._pos += 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._is_key = self._depth == 1 and self._expect_key
+                self._string_chars = []
+                self._capturing = (
+                    self._depth == 1 and not self._is_key and self._last_key == self.field
+                )
+            elif char in '{[':
+                self._depth += 1
+                self._expect_key = char == '{' and self._depth == 1
+            elif char in '}]':
+                self._depth -= 1
+            elif char == ',' and self._depth == 1:
+                self._expect_key = True
+            elif char == ':' and self._depth == 1:
+                self._expect_key = False
+            self._pos += 1
+
+        return "".join(output)
+
+    def _emit(self, decoded: str, output: list):
+        if self._is_key:
+            self._string_chars.append(decoded)
+        elif self._capturing and decoded:
+            output.append(decoded)
+
+    def _decode_unicode(self, hex_digits: str) -> str:
+        try:
+            code_point = int(hex_digits, 16)
+        except ValueError:
+            return ""
+        if 0xD800 <= code_point <= 0xDBFF:
+            # High surrogate - hold it until the low half arrives
+            self._high_surrogate = code_point
+            return ""
+        if 0xDC00 <= code_point <= 0xDFFF and self._high_surrogate is not None:
+            combined = 0x10000 + (self._high_surrogate - 0xD800) * 0x400 + (code_point - 0xDC00)
+            self._high_surrogate = None
+            return chr(combined)
+        self._high_surrogate = None
+        return chr(code_point)
+
 # Default system prompt for agentic tool-only workflow
 # Note: Tool definitions are passed separately via the tools parameter.
 # This prompt focuses on workflow guidance, decision boundaries, and behavior.
@@ -71,6 +181,7 @@ When users mention customers, suppliers, items, or other entities by informal/pa
 - ALWAYS call `lookup_entity(entity_type, search_term)` first
 - Use `best_match.id` in subsequent queries
 - Example: "swissski" → lookup_entity("customer", "swissski") → "Swiss-Ski"
+- Several entities in one request: resolve them together with `lookup_entities(lookups=[...])` and use `best_matches[entity_type][search_term]`
 
 ### Step 3: Query Data
 Use resolved entity names in document queries.
@@ -216,17 +327,115 @@ def auto_link_document_ids(text):
     return result
 
 
-def get_system_instructions():
+# =============================================================================
+# Settings Snapshot
+# =============================================================================
+
+# Versioned so a deploy that changes AISettings never unpickles a stale shape
+AI_SETTINGS_CACHE_KEY = "erpnext_chatgpt:ai_settings:v3"
+
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+
+# Smart defaults for max_tokens based on model context windows
+# These are conservative limits for conversation context management
+MODEL_TOKEN_DEFAULTS = {
+    # Claude models (200K context window - use 150K for safety)
+    "claude-opus-4-20250514": 150000,
+    "claude-sonnet-4-20250514": 150000,
+    "claude-3-5-sonnet-20241022": 150000,
+    "claude-3-5-haiku-20241022": 150000,
+    # GPT-4 models (128K context window - use 100K for safety)
+    "gpt-4o": 100000,
+    "gpt-4-turbo": 100000,
+    # GPT-4 mini (128K but use less for cost efficiency)
+    "gpt-4o-mini": 80000,
+    # Reasoning models (vary, use conservative defaults)
+    "o3-mini": 80000,
+    "o4-mini": 80000,
+}
+
+
+class AISettings(NamedTuple):
+    """Immutable snapshot of OpenAI Settings (without the API key)."""
+    provider: str
+    model: str
+    max_tokens: int
+    system_instructions: str
+    disable_token_streaming: bool
+    http_max_connections: int
+    http_keepalive_connections: int
+    storage_codec: str
+    archive_after_days: int
+    delete_after_days: int
+
+
+def _normalize_provider(provider: Optional[str]) -> str:
+    """Normalize the configured API provider, defaulting to anthropic."""
+    # Handle None or empty string
+    if not provider:
+        logger.debug("No provider set, defaulting to anthropic")
+        return "anthropic"
+
+    # Normalize the value (lowercase, strip whitespace)
+    provider = provider.strip().lower()
+
+    # Validate provider
+    if provider not in ("anthropic", "openai"):
+        logger.warning(f"Unknown provider '{provider}', defaulting to anthropic")
+        return "anthropic"
+
+    return provider
+
+
+def _load_ai_settings() -> AISettings:
+    """Read OpenAI Settings from the database in a single query."""
+    values = frappe.db.get_singles_dict("OpenAI Settings")
+
+    # Parse model name (strip description in parentheses)
+    # e.g., "claude-sonnet-4-20250514 (Recommended - Fast & Capable)" -> "claude-sonnet-4-20250514"
+    model_raw = values.get("model")
+    model = model_raw.split(" (")[0].strip() if model_raw else DEFAULT_MODEL
+
+    max_tokens = values.get("max_tokens") or MODEL_TOKEN_DEFAULTS.get(model, 100000)
+
+    return AISettings(
+        provider=_normalize_provider(values.get("api_provider")),
+        model=model,
+        max_tokens=int(max_tokens),
+        system_instructions=values.get("system_instructions") or "",
+        disable_token_streaming=bool(int(values.get("disable_token_streaming") or 0)),
+        http_max_connections=int(values.get("http_max_connections") or DEFAULT_HTTP_MAX_CONNECTIONS),
+        http_keepalive_connections=int(values.get("http_keepalive_connections") or DEFAULT_HTTP_KEEPALIVE_CONNECTIONS),
+        storage_codec=values.get("storage_codec") or "",
+        archive_after_days=int(values.get("archive_after_days") or 0),
+        delete_after_days=int(values.get("delete_after_days") or 0)
+    )
+
+
+def get_ai_settings() -> AISettings:
+    """
+    Get the settings snapshot. Cached in frappe.cache (and per request in frappe.local)
+    until OpenAI Settings is saved.
+    """
+    return frappe.cache().get_value(AI_SETTINGS_CACHE_KEY, generator=_load_ai_settings)
+
+
+def clear_ai_settings_cache():
+    """Drop the cached settings snapshot (called on settings save)."""
+    frappe.cache().delete_value(AI_SETTINGS_CACHE_KEY)
+
+
+def get_system_instructions(settings: AISettings = None):
     """Get system instructions with current date and user context."""
+    settings = settings or get_ai_settings()
     current_user = frappe.session.user
-    user_full_name = frappe.get_value("User", current_user, "full_name") or current_user
+    user_full_name = frappe.utils.get_fullname(current_user)
     user_roles = frappe.get_roles(current_user)
     company = frappe.defaults.get_user_default("company") or frappe.defaults.get_global_default("company")
     current_datetime = frappe.utils.now()
 
     # Get custom system instructions from settings
-    custom_instructions = frappe.db.get_single_value("OpenAI Settings", "system_instructions")
-
+    custom_instructions = settings.system_instructions
     # If no custom instructions are set, use the default agentic prompt
     if not custom_instructions or custom_instructions.strip() == "":
         custom_instructions = DEFAULT_SYSTEM_PROMPT
@@ -262,40 +471,10 @@ def get_system_instructions():
 
     return system_instructions
 
-def get_model_settings():
+def get_model_settings(settings: AISettings = None):
     """Get model and max_tokens from settings with smart defaults."""
-    model_raw = frappe.db.get_single_value("OpenAI Settings", "model")
-    max_tokens = frappe.db.get_single_value("OpenAI Settings", "max_tokens")
-
-    # Parse model name (strip description in parentheses)
-    # e.g., "claude-sonnet-4-20250514 (Recommended - Fast & Capable)" -> "claude-sonnet-4-20250514"
-    if model_raw:
-        model = model_raw.split(" (")[0].strip()
-    else:
-        model = "claude-sonnet-4-20250514"
-
-    # Smart defaults for max_tokens based on model context windows
-    # These are conservative limits for conversation context management
-    model_token_defaults = {
-        # Claude models (200K context window - use 150K for safety)
-        "claude-opus-4-20250514": 150000,
-        "claude-sonnet-4-20250514": 150000,
-        "claude-3-5-sonnet-20241022": 150000,
-        "claude-3-5-haiku-20241022": 150000,
-        # GPT-4 models (128K context window - use 100K for safety)
-        "gpt-4o": 100000,
-        "gpt-4-turbo": 100000,
-        # GPT-4 mini (128K but use less for cost efficiency)
-        "gpt-4o-mini": 80000,
-        # Reasoning models (vary, use conservative defaults)
-        "o3-mini": 80000,
-        "o4-mini": 80000,
-    }
-
-    if not max_tokens:
-        max_tokens = model_token_defaults.get(model, 100000)
-
-    return model, int(max_tokens)
+    settings = settings or get_ai_settings()
+    return settings.model, settings.max_tokens
 
 
 def get_model_output_limit(model: str) -> int:
@@ -321,55 +500,131 @@ def get_model_output_limit(model: str) -> int:
     # Default to 4096 for safety
     return output_limits.get(model, 4096)
 
-def get_openai_client():
-    """Get the OpenAI client with the API key from settings."""
-    # Use get_password() for Password fieldtype to decrypt the value
-    settings = frappe.get_single("OpenAI Settings")
-    api_key = settings.get_password("api_key")
-    if not api_key:
-        frappe.throw(_("OpenAI API key is not set in OpenAI Settings."))
+# =============================================================================
+# Provider Client Pool
+# =============================================================================
+
+# Per-process pool of SDK clients: (site, provider, api key hash, base url) -> client.
+# Each client keeps its own httpx connection pool alive between requests. Workers of a
+# bench serve several sites, so every key includes the site: a client built with one
+# site's API key is never handed to another site.
+_client_pool = {}
+# (site, provider) -> pool key of the client built from the current settings
+_client_pool_current = {}
+# site -> CLIENT_POOL_VERSION_KEY value the site's clients were built under
+_client_pool_versions = {}
+_client_pool_lock = threading.Lock()
+
+# Bumped in Redis (per site) on OpenAI Settings save so every worker drops that site's clients
+CLIENT_POOL_VERSION_KEY = "erpnext_chatgpt:client_pool_version"
+
+DEFAULT_HTTP_MAX_CONNECTIONS = 20
+DEFAULT_HTTP_KEEPALIVE_CONNECTIONS = 10
+
+
+def _drop_site_clients(site):
+    """Remove the pooled clients of one site. Caller holds _client_pool_lock."""
+    for pool_key in [key for key in _client_pool if key[0] == site]:
+        del _client_pool[pool_key]
+    for current_key in [key for key in _client_pool_current if key[0] == site]:
+        del _client_pool_current[current_key]
+
+
+def invalidate_client_pool():
+    """Drop the site's pooled provider clients in all worker processes (called on settings save)."""
+    frappe.cache().set_value(CLIENT_POOL_VERSION_KEY, frappe.generate_hash(length=10))
+    with _client_pool_lock:
+        _drop_site_clients(frappe.local.site)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 
-    # Import OpenAI
-    from openai import OpenAI
+def _build_provider_client(provider: str, api_key: str, base_url: Optional[str], settings: AISettings):
+    """Create an SDK client with a keep-alive connection pool sized from settings."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_keepalive_connections
+    )
+    http2 = _http2_available()
+
+    if provider == "anthropic":
+        from anthropic import Anthropic, DefaultHttpxClient
+        return Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=DefaultHttpxClient(limits=limits, http2=http2)
+        )
 
-    # Simple initialization - OpenAI SDK v1.x only needs api_key
     # Don't pass any proxy-related parameters
-    return OpenAI(api_key=api_key)
+    from openai import OpenAI, DefaultHttpxClient
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=DefaultHttpxClient(limits=limits, http2=http2)
+    )
 
 
-def get_anthropic_client():
-    """Get the Anthropic client with the API key from settings."""
+def get_pooled_client(provider: str):
+    """
+    Get the SDK client for a provider from the per-process pool, building it on first use.
+    Settings are only read (and the API key decrypted) when the site has no current client.
+    """
+    site = frappe.local.site
+    version = frappe.cache().get_value(CLIENT_POOL_VERSION_KEY)
+
+    with _client_pool_lock:
+        if _client_pool_versions.get(site) != version:
+            _drop_site_clients(site)
+            _client_pool_versions[site] = version
+
+        pool_key = _client_pool_current.get((site, provider))
+        if pool_key in _client_pool:
+            return _client_pool[pool_key]
+
     # Use get_password() for Password fieldtype to decrypt the value
-    settings = frappe.get_single("OpenAI Settings")
-    api_key = settings.get_password("api_key")
+    api_key = frappe.get_single("OpenAI Settings").get_password("api_key", raise_exception=False)
     if not api_key:
-        frappe.throw(_("Anthropic API key is not set in OpenAI Settings."))
+        label = "Anthropic" if provider == "anthropic" else "OpenAI"
+        frappe.throw(_("{0} API key is not set in OpenAI Settings.").format(label))
 
-    # Import Anthropic
-    from anthropic import Anthropic
+    base_url = os.environ.get("ANTHROPIC_BASE_URL" if provider == "anthropic" else "OPENAI_BASE_URL")
+    pool_key = (site, provider, hashlib.sha256(api_key.encode()).hexdigest()[:16], base_url)
 
-    return Anthropic(api_key=api_key)
+    with _client_pool_lock:
+        client = _client_pool.get(pool_key)
+        if client is None:
+            client = _build_provider_client(provider, api_key, base_url, get_ai_settings())
+            _client_pool[pool_key] = client
+            logger.debug(f"Created pooled {provider} client (base_url={base_url or 'default'})")
+        _client_pool_current[(site, provider)] = pool_key
 
+    return client
 
-def get_api_provider():
-    """Get the configured API provider (openai or anthropic)."""
-    provider = frappe.db.get_single_value("OpenAI Settings", "api_provider")
-    logger.debug(f"API Provider from settings: '{provider}'")
 
-    # Handle None or empty string
-    if not provider:
-        logger.debug("No provider set, defaulting to anthropic")
-        return "anthropic"
+def get_openai_client():
+    """Get the pooled OpenAI client for the API key in settings."""
+    return get_pooled_client("openai")
 
-    # Normalize the value (lowercase, strip whitespace)
-    provider = provider.strip().lower()
 
-    # Validate provider
-    if provider not in ("anthropic", "openai"):
-        logger.warning(f"Unknown provider '{provider}', defaulting to anthropic")
-        return "anthropic"
+def get_anthropic_client():
+    """Get the pooled Anthropic client for the API key in settings."""
+    return get_pooled_client("anthropic")
 
-    return provider
+
+def get_api_provider(settings: AISettings = None):
+    """Get the configured API provider (openai or anthropic)."""
+    settings = settings or get_ai_settings()
+    logger.debug(f"API Provider from settings: '{settings.provider}'")
+    return settings.provider
 
 
 def analyze_tool_result(function_name, result_str):
@@ -397,6 +652,15 @@ def analyze_tool_result(function_name, result_str):
     if function_name == 'lookup_entity' and not result.get('best_match'):
         return True, f"No entity match found for '{result.get('search_term', 'unknown')}'. Try broader search terms."
 
+    if function_name == 'lookup_entities':
+        unresolved = [
+            f"{term} ({entity_type})"
+            for entity_type, matches in (result.get('best_matches') or {}).items()
+            for term, match in matches.items() if not match
+        ]
+        if unresolved:
+            return True, f"No entity match found for: {', '.join(unresolved)}. Try broader search terms for these."
+
     return False, None
 
 
@@ -517,6 +781,11 @@ def extract_fetched_entities(function_name, response_data):
             'id_field': 'id',
             'label_field': 'name'
         },
+        'lookup_entities': {
+            'key': 'results',
+            'id_field': 'id',
+            'label_field': 'name'
+        },
         'list_delivery_notes': {
             'key': 'delivery_notes',
             'doctype': 'Delivery Note',
@@ -632,6 +901,17 @@ def extract_fetched_entities(function_name, response_data):
                 })
             return entities
 
+        if function_name == 'lookup_entities':
+            for result in response_data.get('results') or []:
+                best_match = result.get('best_match')
+                if best_match and best_match.get('id'):
+                    entities.append({
+                        'id': best_match.get('id'),
+                        'doctype': result.get('doctype', 'Unknown'),
+                        'label': best_match.get('name') or best_match.get('id')
+                    })
+            return entities
+
         # Get the data to process
         data_key = mapping.get('key')
         if data_key:
@@ -662,6 +942,116 @@ def extract_fetched_entities(function_name, response_data):
     return entities
 
 
+# =============================================================================
+# Parallel Tool Execution
+# =============================================================================
+
+# Upper bound on concurrently running read tools (each holds its own DB connection)
+MAX_PARALLEL_TOOL_WORKERS = 4
+
+# Tools that never touch the database - cheaper to run inline than in a worker
+INLINE_TOOLS = {'think', 'final_answer'}
+
+
+def _call_tool_in_site_context(site: str, sites_path: str, user: str, function_name: str, function_args: Dict[str, Any]):
+    """
+    Run a tool function inside a worker thread.
+    frappe.local is thread-local, so each worker initialises its own site
+    context and DB connection and tears them down afterwards.
+    """
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        return call_tool(function_name, function_args)
+    finally:
+        frappe.destroy()
+
+
+def run_read_tools(calls: List[Tuple[str, Dict[str, Any]]], wait_timeout: float = None) -> Generator[Optional[Tuple[int, Any, Optional[Exception]]], None, None]:
+    """
+    Execute independent read-only tool calls, in parallel where it pays off.
+
+    Yields (index, function_response, error) for each call as it finishes, where
+    index is the position in `calls`. If wait_timeout is set, yields None whenever
+    that many seconds pass without a call finishing (used for SSE heartbeats).
+
+    :param calls: List of (function_name, function_args) tuples; must not contain write tools
+    :param wait_timeout: Optional seconds to wait before yielding a None tick
+    """
+    inline_calls = []
+    pooled_calls = []
+    for index, (function_name, function_args) in enumerate(calls):
+        if function_name in INLINE_TOOLS:
+            inline_calls.append(index)
+        else:
+            pooled_calls.append(index)
+
+    # A single DB-bound call gains nothing from a worker thread
+    if len(pooled_calls) <= 1:
+        inline_calls = sorted(inline_calls + pooled_calls)
+        pooled_calls = []
+
+    def run_inline():
+        for index in inline_calls:
+            function_name, function_args = calls[index]
+            try:
+                yield index, call_tool(function_name, function_args), None
+            except Exception as e:
+                yield index, None, e
+
+    if not pooled_calls:
+        yield from run_inline()
+        return
+
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+    user = frappe.session.user
+
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_TOOL_WORKERS, len(pooled_calls))) as executor:
+        # Submit DB-bound calls first so they overlap with the inline ones
+        pending = {
+            executor.submit(_call_tool_in_site_context, site, sites_path, user, *calls[index]): index
+            for index in pooled_calls
+        }
+        yield from run_inline()
+
+        while pending:
+            done, _not_done = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None
+                continue
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield index, future.result(), None
+                except Exception as e:
+                    yield index, None, e
+
+
+def execute_read_tools(calls: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    Execute read-only tool calls and return (function_response, error) tuples
+    in the same order as `calls`.
+    """
+    outcomes = [(None, None)] * len(calls)
+    for index, function_response, error in run_read_tools(calls):
+        outcomes[index] = (function_response, error)
+    return outcomes
+
+
+def first_write_tool_index(function_names: List[str]) -> int:
+    """
+    Return the position of the first write tool in a batch of tool calls,
+    or len(function_names) if there is none. Calls before it can run in parallel;
+    the write tool itself keeps the serial confirmation path.
+    """
+    for index, function_name in enumerate(function_names):
+        if is_write_operation(function_name):
+            return index
+    return len(function_names)
+
+
 def handle_tool_calls(tool_calls: List[Any], conversation: List[Dict[str, Any]], tool_usage_log: List[Dict[str, Any]], session_doc=None) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
     """
     Handle the tool calls by executing the corresponding functions and appending the results to the conversation.
@@ -674,15 +1064,22 @@ def handle_tool_calls(tool_calls: List[Any], conversation: List[Dict[str, Any]],
     :param session_doc: Optional session document for storing pending confirmations
     :return: Tuple of (updated conversation, tool usage log, pending_confirmation or None)
     """
+    allowed_functions = get_tool_registry().functions
+    parsed_calls = []
     for tool_call in tool_calls:
         function_name = tool_call.function.name
-        function_to_call = available_functions.get(function_name)
-        if not function_to_call:
+        if function_name not in allowed_functions:
             frappe.log_error(f"Function {function_name} not found.", "OpenAI Tool Error")
             raise ValueError(f"Function {function_name} not found.")
+        parsed_calls.append((tool_call, function_name, json.loads(tool_call.function.arguments)))
 
-        function_args = json.loads(tool_call.function.arguments)
+    # Read tools ahead of the first write tool are independent - run them in parallel
+    write_index = first_write_tool_index([function_name for _, function_name, _ in parsed_calls])
+    read_outcomes = execute_read_tools([
+        (function_name, function_args) for _, function_name, function_args in parsed_calls[:write_index]
+    ])
 
+    for position, (tool_call, function_name, function_args) in enumerate(parsed_calls):
         # Check if this is a write operation that requires user confirmation
         if is_write_operation(function_name):
             write_metadata = get_write_tool_metadata(function_name)
@@ -694,14 +1091,14 @@ def handle_tool_calls(tool_calls: List[Any], conversation: List[Dict[str, Any]],
                 'tool_name': function_name,
                 'parameters': function_args,
                 'confirmation_message': write_metadata.get('confirmation_message', f'Execute {function_name}'),
-                'conversation_state': conversation.copy(),
+                'conversation_delta': conversation_delta(session_doc, conversation),
                 'tool_usage_log': tool_usage_log.copy(),
                 'created_at': frappe.utils.now()
             }
 
             # Save pending confirmation to session document if provided
             if session_doc:
-                session_doc.pending_confirmation = json.dumps(pending_confirmation, default=json_serial)
+                session_doc.pending_confirmation = dump_conversation_json(pending_confirmation)
                 session_doc.save(ignore_permissions=False)
                 frappe.db.commit()
                 logger.debug(f"Saved pending confirmation to session {session_doc.name}")
@@ -718,7 +1115,9 @@ def handle_tool_calls(tool_calls: List[Any], conversation: List[Dict[str, Any]],
         }
 
         try:
-            function_response = function_to_call(**function_args)
+            function_response, error = read_outcomes[position]
+            if error:
+                raise error
 
             # Initialize response_data for entity extraction
             response_data = {}
@@ -799,16 +1198,158 @@ def handle_tool_calls(tool_calls: List[Any], conversation: List[Dict[str, Any]],
         })
     return conversation, tool_usage_log, None  # No pending confirmation for read operations
 
-def estimate_token_count(messages: List[Dict[str, Any]]) -> int:
+# =============================================================================
+# Token Accounting
+# =============================================================================
+
+# Per-message overhead (role, separators) on top of the content tokens
+TOKENS_PER_MESSAGE = {"openai": 4, "anthropic": 3}
+
+# Claude has no public local tokenizer; its counts run above cl100k_base by roughly this factor
+CLAUDE_TIKTOKEN_CALIBRATION = 1.15
+
+# Characters per token when tiktoken is not installed
+CHARS_PER_TOKEN = {"openai": 4.0, "anthropic": 3.5}
+
+_tiktoken_encodings = {}
+
+
+def _get_tiktoken_encoding(encoding_name: str):
+    """Load a tiktoken encoding once per process, or None if tiktoken is not installed."""
+    if encoding_name not in _tiktoken_encodings:
+        try:
+            import tiktoken
+            _tiktoken_encodings[encoding_name] = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            _tiktoken_encodings[encoding_name] = None
+    return _tiktoken_encodings[encoding_name]
+
+
+def _encoding_name_for_model(model: str) -> str:
+    """GPT-4o and the o-series use o200k_base; older GPT-4 and Claude (calibrated) use cl100k_base."""
+    if model and (model.startswith("gpt-4o") or re.match(r"o\d", model)):
+        return "o200k_base"
+    return "cl100k_base"
+
+
+def count_text_tokens(text: str, provider: str = "anthropic", model: str = None) -> int:
+    """Count the tokens of a text with a local tokenizer where available, calibrated per provider."""
+    if not text:
+        return 0
+
+    encoding = _get_tiktoken_encoding(_encoding_name_for_model(model if provider == "openai" else None))
+    if encoding is None:
+        return int(len(text) / CHARS_PER_TOKEN.get(provider, 4.0)) + 1
+
+    tokens = len(encoding.encode(text, disallowed_special=()))
+    if provider == "anthropic":
+        tokens = int(tokens * CLAUDE_TIKTOKEN_CALIBRATION)
+    return tokens
+
+
+def _message_text_for_count(message: Dict[str, Any]) -> str:
+    """Flatten everything in a message that is sent to the model into one string."""
+    parts = []
+    content = message.get("content")
+
+    if isinstance(content, str):
+        parts.append(content)
+    elif isinstance(content, list):
+        for block in content:
+            if not isinstance(block, dict):
+                parts.append(str(block))
+            elif block.get("type") == "text":
+                parts.append(block.get("text", ""))
+            elif block.get("type") == "tool_use":
+                parts.append(block.get("name", ""))
+                parts.append(json.dumps(block.get("input") or {}, default=json_serial))
+            elif block.get("type") == "tool_result":
+                result = block.get("content")
+                if isinstance(result, list):
+                    parts.extend(item.get("text", "") for item in result if isinstance(item, dict))
+                elif result is not None:
+                    parts.append(str(result))
+            else:
+                parts.append(json.dumps(block, default=json_serial))
+    elif content is not None:
+        parts.append(str(content))
+
+    # OpenAI assistant tool calls
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function") or {}
+        parts.append(function.get("name") or "")
+        parts.append(function.get("arguments") or "")
+
+    return "\n".join(parts)
+
+
+def token_calibration(provider: str, model: str = None) -> str:
+    """
+    Which counting a token count was made with (provider and tokenizer), so counts
+    stored with a message are only reused while the same counting applies.
+    """
+    encoding_name = _encoding_name_for_model(model if provider == "openai" else None)
+    tokenizer = encoding_name if _get_tiktoken_encoding(encoding_name) is not None else "chars"
+    return f"{provider}:{tokenizer}"
+
+
+def count_message_tokens(message: Dict[str, Any], provider: str = "anthropic", model: str = None) -> int:
+    """
+    Token count of one message, stored on the message itself (token_count and
+    token_calibration) and in its AI Conversation Message row, so each message is
+    tokenized once: when it is created, or when the provider's counting changed.
+    Messages must not be changed in place after they were counted; change a copy
+    made with copy_message instead.
+    """
+    calibration = token_calibration(provider, model)
+    if message.get("token_calibration") == calibration and message.get("token_count") is not None:
+        return message["token_count"]
+
+    count = TOKENS_PER_MESSAGE.get(provider, 4) + count_text_tokens(_message_text_for_count(message), provider, model)
+    message["token_count"] = count
+    message["token_calibration"] = calibration
+    return count
+
+
+# Keys of conversation messages that only this app uses; to_api_messages drops them
+LOCAL_MESSAGE_KEYS = frozenset({"seq", "token_count", "token_calibration", "content_display", "tool_usage"})
+
+
+def copy_message(message: Dict[str, Any], **changes) -> Dict[str, Any]:
+    """Copy of a message with some keys changed, without its (now stale) token count."""
+    copy = {key: value for key, value in message.items() if key not in ("token_count", "token_calibration")}
+    copy.update(changes)
+    return copy
+
+
+def to_api_messages(conversation: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The conversation as sent to the model: messages without LOCAL_MESSAGE_KEYS."""
+    return [
+        {key: value for key, value in message.items() if key not in LOCAL_MESSAGE_KEYS}
+        if LOCAL_MESSAGE_KEYS.intersection(message) else message
+        for message in conversation
+    ]
+
+
+def estimate_token_count(messages: List[Dict[str, Any]], provider: str = None, model: str = None) -> int:
     """
-    Estimate the token count for a list of messages.
-    This is a rough estimation; OpenAI provides more accurate token counting in their own libraries.
+    Count the tokens of a list of messages.
+    Uses the cached per-message counts, so repeated calls only tokenize new messages.
     """
-    tokens_per_message = 4  # Average tokens per message (considering metadata)
-    tokens_per_word = 1.5   # Average tokens per word (this may vary)
+    if provider is None:
+        settings = get_ai_settings()
+        provider, model = settings.provider, settings.model
+    return sum(count_message_tokens(message, provider, model) for message in messages)
+
+def is_stored_message(message: Dict[str, Any]) -> bool:
+    """Whether extract_messages_for_storage keeps a conversation message."""
+    role = message.get("role")
+    if role == "user":
+        # The compaction summary lives in AI Conversation.compacted_context, not in the message history
+        return not is_compaction_summary(message)
+    # Only assistant messages that have content (final answers), not those that are just tool_calls
+    return role == "assistant" and bool(message.get("content")) and not message.get("tool_calls")
 
-    return sum(tokens_per_message + int(len(str(message.get("content", "")).split()) * tokens_per_word)
-               for message in messages if message.get("content") is not None)
 
 def extract_messages_for_storage(conversation: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
@@ -817,101 +1358,855 @@ def extract_messages_for_storage(conversation: List[Dict[str, Any]]) -> List[Dic
     """
     messages_to_save = []
     for m in conversation:
-        role = m.get("role")
-        if role == "user":
-            messages_to_save.append({"role": "user", "content": m.get("content", "")})
-        elif role == "assistant" and m.get("content") and not m.get("tool_calls"):
-            # Only save assistant messages that have content (final answers)
-            # Skip assistant messages that are just tool_calls
-            messages_to_save.append({
+        if not is_stored_message(m):
+            continue
+        if m.get("role") == "user":
+            message = {"role": "user", "content": m.get("content", "")}
+        else:
+            message = {
                 "role": "assistant",
                 "content": m.get("content", ""),
                 "content_display": m.get("content_display"),
                 "tool_usage": m.get("tool_usage")
-            })
+            }
+        if m.get("token_calibration"):
+            message["token_count"] = m.get("token_count")
+            message["token_calibration"] = m["token_calibration"]
+        messages_to_save.append(message)
     return messages_to_save
 
 
-def trim_conversation_to_token_limit(conversation: List[Dict[str, Any]], token_limit: int = None) -> List[Dict[str, Any]]:
+# =============================================================================
+# Message Log
+# =============================================================================
+
+# One row per stored user/assistant message, appended as the conversation grows
+MESSAGE_DOCTYPE = "AI Conversation Message"
+
+# Columns written by append_conversation_messages, in build_message_rows order
+MESSAGE_ROW_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "conversation", "seq", "role", "content", "content_blocks", "content_display", "tool_usage", "tool_summary",
+    "token_count", "token_calibration"
+]
+
+# Messages per get_conversation page; the frontend loads earlier pages on demand
+HISTORY_PAGE_SIZE = 30
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Entity chips kept per message in tool_summary
+TOOL_SUMMARY_MAX_ENTITIES = 20
+
+# Rows re-encoded per batch by migrate_conversation_storage
+STORAGE_MIGRATION_BATCH_SIZE = 500
+
+
+def dump_conversation_json(value, codec: str = None) -> Optional[str]:
     """
-    Trim the conversation so that its total token count does not exceed the specified limit.
-    Keeps the most recent messages and trims older ones.
+    JSON text for a large conversation column (tool usage, content blocks, pending and
+    continuation states), compressed with the storage codec of OpenAI Settings.
     """
-    if token_limit is None:
-        _, token_limit = get_model_settings()
-    while estimate_token_count(conversation) > token_limit and len(conversation) > 1:
-        # Remove the oldest non-system message
-        for i, message in enumerate(conversation):
-            if message.get("role") != "system":
-                del conversation[i]
-                break
-    return conversation
+    if codec is None:
+        codec = get_ai_settings().storage_codec
+    return encode_json(value, codec, default=json_serial)
 
-def handle_claude_tool_calls(tool_blocks, conversation, tool_usage_log, session_doc=None):
+
+def _message_from_row(row) -> Dict[str, Any]:
     """
-    Handle Claude tool calls by executing the corresponding functions.
-    Returns (conversation, tool_usage_log, pending_confirmation)
+    Stored message dict (the extract_messages_for_storage shape) of an AI Conversation
+    Message row, tagged with its seq so store_conversation_messages never stores it again.
     """
-    tool_results = []
-
-    for tool_block in tool_blocks:
-        function_name = tool_block.name
-        tool_use_id = tool_block.id
-        function_args = tool_block.input or {}
+    message = {"seq": row["seq"], "role": row["role"], "content": decode_json(row.get("content_blocks")) or row["content"] or ""}
+    if row.get("token_calibration"):
+        message["token_count"] = row.get("token_count")
+        message["token_calibration"] = row["token_calibration"]
+    if row["role"] == "assistant":
+        message["content_display"] = row.get("content_display")
+        message["tool_usage"] = decode_json(row.get("tool_usage"))
+    return message
 
-        function_to_call = available_functions.get(function_name)
-        if not function_to_call:
-            frappe.log_error(f"Function {function_name} not found.", "Claude Tool Error")
-            raise ValueError(f"Function {function_name} not found.")
 
-        # Check if this is a write operation that requires user confirmation
-        if is_write_operation(function_name):
-            write_metadata = get_write_tool_metadata(function_name)
-            logger.debug(f"Write operation detected: {function_name}, requiring confirmation")
+def load_stored_messages(conversation_name: str, after_seq: int = 0, last: int = None, until_seq: int = None) -> List[Dict[str, Any]]:
+    """
+    Stored messages of a conversation in order.
 
-            pending_confirmation = {
-                'tool_call_id': tool_use_id,
-                'tool_name': function_name,
-                'parameters': function_args,
-                'confirmation_message': write_metadata.get('confirmation_message', f'Execute {function_name}'),
-                'conversation_state': conversation.copy(),
-                'tool_usage_log': tool_usage_log.copy(),
-                'created_at': frappe.utils.now()
-            }
+    :param after_seq: Only messages after this sequence number (e.g. the compacted prefix)
+    :param last: Only the newest `last` messages
+    :param until_seq: Only messages up to this sequence number
+    """
+    filters = [["conversation", "=", conversation_name], ["seq", ">", after_seq]]
+    if until_seq is not None:
+        filters.append(["seq", "<=", until_seq])
+
+    rows = frappe.db.get_all(
+        MESSAGE_DOCTYPE,
+        filters=filters,
+        fields=["seq", "role", "content", "content_blocks", "content_display", "tool_usage", "token_count", "token_calibration"],
+        order_by="seq desc" if last else "seq asc",
+        limit_page_length=last or 0
+    )
+    if last:
+        rows.reverse()
+    return [_message_from_row(row) for row in rows]
 
-            if session_doc:
-                session_doc.pending_confirmation = json.dumps(pending_confirmation, default=json_serial)
-                session_doc.save(ignore_permissions=False)
-                frappe.db.commit()
 
-            return conversation, tool_usage_log, pending_confirmation
+def summarize_tool_usage(tool_usage: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    What the chat needs to render a message's tool usage toggle without the log itself:
+    query and thinking counts plus the deduplicated entity chips.
+    """
+    if not tool_usage:
+        return None
 
-        # Log the tool usage
-        tool_usage_entry = {
-            "tool_name": function_name,
-            "parameters": function_args,
-            "timestamp": frappe.utils.now(),
-            "is_thinking": function_name == "think"
-        }
+    entities = {}
+    for entry in tool_usage:
+        if entry.get("is_thinking"):
+            continue
+        for entity in entry.get("fetched_entities") or []:
+            entities.setdefault((entity.get("doctype"), entity.get("id")), entity)
 
-        try:
-            function_response = function_to_call(**function_args)
+    thinking_count = sum(1 for entry in tool_usage if entry.get("is_thinking"))
+    return {
+        "tool_count": len(tool_usage) - thinking_count,
+        "thinking_count": thinking_count,
+        "fetched_entities": list(entities.values())[:TOOL_SUMMARY_MAX_ENTITIES]
+    }
 
-            # Parse response for summary
-            response_data = {}
-            try:
-                response_data = json.loads(function_response)
-                if isinstance(response_data, dict):
-                    if 'delivery_notes' in response_data:
-                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['delivery_notes'])} delivery notes"
-                    elif 'invoices' in response_data:
-                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['invoices'])} invoices"
-                    elif 'total_count' in response_data:
-                        tool_usage_entry['result_summary'] = f"Found {response_data.get('total_count', 0)} records"
-                    else:
-                        tool_usage_entry['result_summary'] = "Data retrieved successfully"
-            except:
-                tool_usage_entry['result_summary'] = "Query executed"
+
+def build_message_rows(conversation_name: str, owner: str, messages: List[Dict[str, Any]], start_seq: int, timestamp=None) -> List[tuple]:
+    """Row values for frappe.db.bulk_insert, in MESSAGE_ROW_FIELDS order."""
+    timestamp = timestamp or frappe.utils.now()
+    codec = get_ai_settings().storage_codec
+    rows = []
+    for offset, message in enumerate(messages):
+        content = message.get("content") or ""
+        tool_usage = message.get("tool_usage")
+        tool_summary = summarize_tool_usage(tool_usage)
+        rows.append((
+            frappe.generate_hash(length=12), timestamp, timestamp, owner, owner,
+            conversation_name, start_seq + offset, message.get("role"),
+            content if isinstance(content, str) else "",
+            None if isinstance(content, str) else dump_conversation_json(content, codec),
+            message.get("content_display"),
+            dump_conversation_json(tool_usage, codec) if tool_usage else None,
+            json.dumps(tool_summary, default=json_serial) if tool_summary else None,
+            message.get("token_count"),
+            message.get("token_calibration")
+        ))
+    return rows
+
+
+def encode_history_cursor(seq: int) -> str:
+    """Opaque cursor for the messages before `seq`."""
+    return base64.urlsafe_b64encode(f"seq:{seq}".encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Sequence number encoded by encode_history_cursor, None for no cursor."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, seq = base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+        if prefix != "seq":
+            raise ValueError(prefix)
+        return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        frappe.throw(_("Invalid history cursor"))
+
+
+def load_message_page(conversation_name: str, cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    The newest `limit` stored messages before `cursor`, oldest first, plus the cursor of
+    the page before them. Rows come from the (conversation, seq) index and tool usage is
+    replaced by its tool_summary, so the cost depends on the page size, not the history.
+    """
+    limit = _history_page_limit(limit)
+    # Claude tool_use/tool_result rows are not shown in the chat, so they must not use up the page
+    filters = [["conversation", "=", conversation_name], ["content_blocks", "is", "not set"]]
+    before_seq = decode_history_cursor(cursor)
+    if before_seq is not None:
+        filters.append(["seq", "<", before_seq])
+
+    # One extra row tells whether an earlier page exists
+    rows = frappe.db.get_all(
+        MESSAGE_DOCTYPE,
+        filters=filters,
+        fields=["seq", "role", "content", "content_display", "tool_summary"],
+        order_by="seq desc",
+        limit_page_length=limit + 1
+    )
+    return _history_page(rows, limit)
+
+
+def load_archived_message_page(session_doc, cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> Dict[str, Any]:
+    """load_message_page for a conversation in cold storage, read from its archive file."""
+    limit = _history_page_limit(limit)
+    before_seq = decode_history_cursor(cursor)
+    messages = [
+        message for message in load_archived_messages(session_doc)
+        if before_seq is None or message["seq"] < before_seq
+    ]
+    rows = [
+        {**message, "tool_summary": summarize_tool_usage(message.get("tool_usage"))}
+        for message in reversed(messages[-(limit + 1):])
+    ]
+    return _history_page(rows, limit)
+
+
+def _history_page_limit(limit) -> int:
+    return min(max(frappe.utils.cint(limit) or HISTORY_PAGE_SIZE, 1), HISTORY_MAX_PAGE_SIZE)
+
+
+def _history_page(rows: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    """Page response of up to `limit` + 1 message rows, newest first."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = []
+    for row in rows:
+        message = {"seq": row["seq"], "role": row["role"], "content": row["content"] or ""}
+        if row["role"] == "assistant":
+            tool_summary = row.get("tool_summary")
+            message["content_display"] = row.get("content_display")
+            message["tool_summary"] = json.loads(tool_summary) if isinstance(tool_summary, str) and tool_summary else tool_summary
+        messages.append(message)
+
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "next_cursor": encode_history_cursor(rows[0]["seq"]) if has_more else None
+    }
+
+
+def append_conversation_messages(session_doc, messages: List[Dict[str, Any]]) -> int:
+    """
+    Append stored messages to a conversation in one INSERT and advance its counters.
+    Earlier rows are never rewritten, so the cost only depends on the new messages.
+
+    The conversation row is locked and its message_count re-read first, so overlapping
+    requests (a second tab, a confirmation during a stream) number their messages one
+    after the other; the unique (conversation, seq) index rejects anything else.
+
+    :return: seq of the first appended message
+    """
+    if not messages:
+        return (session_doc.message_count or 0) + 1
+
+    # Held until the caller commits, right after saving the session
+    message_count = frappe.db.sql(
+        "SELECT message_count FROM `tabAI Conversation` WHERE name = %s FOR UPDATE",
+        session_doc.name
+    )
+    start_seq = frappe.utils.cint(message_count[0][0] if message_count else session_doc.message_count) + 1
+
+    # Stored with each row, and added to the session's running total
+    settings = get_ai_settings()
+    new_tokens = sum(count_message_tokens(message, settings.provider, settings.model) for message in messages)
+
+    now = frappe.utils.now()
+    frappe.db.bulk_insert(
+        MESSAGE_DOCTYPE,
+        MESSAGE_ROW_FIELDS,
+        build_message_rows(session_doc.name, session_doc.owner, messages, start_seq, now)
+    )
+    session_doc.message_count = start_seq + len(messages) - 1
+    session_doc.last_message_at = now
+    session_doc.token_total = (session_doc.token_total or 0) + new_tokens
+    return start_seq
+
+
+def _stored_overlap(stored_tail: List[Dict[str, Any]], messages: List[Dict[str, Any]]) -> int:
+    """
+    Number of leading `messages` that are already the newest stored messages, matched by
+    role and content. Only used for paused states saved before messages carried their seq.
+    """
+    def key(message):
+        return message.get("role"), message.get("content") or ""
+
+    stored_keys = [key(message) for message in stored_tail]
+    message_keys = [key(message) for message in messages]
+    for length in range(min(len(stored_keys), len(message_keys)), 0, -1):
+        if stored_keys[-length:] == message_keys[:length]:
+            return length
+    return 0
+
+
+def _tag_stored_messages(session_doc, conversation: List[Dict[str, Any]]):
+    """
+    Tag the stored messages of a paused working conversation saved before messages
+    carried their seq, by matching them once against the newest stored rows.
+    """
+    untagged = [message for message in conversation if is_stored_message(message) and "seq" not in message]
+    if not untagged or not session_doc.message_count:
+        return
+
+    overlap = _stored_overlap(
+        load_stored_messages(session_doc.name, last=len(untagged)),
+        extract_messages_for_storage(untagged)
+    )
+    first_seq = session_doc.message_count - overlap + 1
+    for offset, message in enumerate(untagged[:overlap]):
+        message["seq"] = first_seq + offset
+
+
+def store_conversation_messages(session_doc, conversation: List[Dict[str, Any]]):
+    """
+    Append the messages of the working conversation that are not stored yet.
+
+    Messages loaded from the log carry their seq, and appended messages are tagged with
+    theirs, so calling this several times in a turn, or on a conversation restored from
+    a pending confirmation, stores nothing twice - even a repeated question or answer
+    is stored as a message of its own.
+    """
+    new_messages = [message for message in conversation if is_stored_message(message) and "seq" not in message]
+    if not new_messages:
+        return
+
+    start_seq = append_conversation_messages(session_doc, extract_messages_for_storage(new_messages))
+    for offset, message in enumerate(new_messages):
+        message["seq"] = start_seq + offset
+
+
+def conversation_delta(session_doc, conversation: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Describe a paused working conversation relative to the message log, for pending
+    confirmations and continuation states: the stored messages it spans (first_seq to
+    base_seq, from the seqs they carry) and the messages after them that are not stored,
+    e.g. the new user message and the in-flight tool calls and results of the turn. The
+    system prompt and compaction summary are not kept; restore_conversation rebuilds them.
+    """
+    stored_indexes = [index for index, message in enumerate(conversation) if message.get("seq")]
+    if stored_indexes:
+        base_seq = conversation[stored_indexes[-1]]["seq"]
+        first_seq = conversation[stored_indexes[0]]["seq"]
+    else:
+        base_seq = (session_doc.message_count or 0) if session_doc else 0
+        first_seq = base_seq + 1
+
+    if stored_indexes:
+        suffix_start = stored_indexes[-1] + 1
+    else:
+        # Nothing stored in the working conversation: keep everything after the system prompt and summary
+        suffix_start = next(
+            (index for index, message in enumerate(conversation)
+             if message.get("role") != "system" and not is_compaction_summary(message)),
+            len(conversation)
+        )
+
+    return {
+        "base_seq": base_seq,
+        "first_seq": first_seq,
+        "summary": any(is_compaction_summary(message) for message in conversation[:suffix_start]),
+        "messages": conversation[suffix_start:]
+    }
+
+
+def restore_conversation(session_doc, delta: Dict[str, Any], settings: AISettings = None) -> List[Dict[str, Any]]:
+    """
+    Rebuild a working conversation from a conversation_delta: the system prompt, the
+    compaction summary, the stored messages it spans and its unsaved messages.
+    """
+    compacted = _load_compacted_context(session_doc)
+    compacted_count = compacted["message_count"] if compacted else 0
+    first_seq = delta.get("first_seq", 1)
+    base_seq = delta.get("base_seq", 0)
+
+    # Messages compacted since the pause are covered by the summary instead
+    after_seq = max(first_seq - 1, compacted_count)
+    conversation = [{"role": "system", "content": get_system_instructions(settings)}]
+    if compacted and (delta.get("summary") or after_seq > first_seq - 1):
+        conversation.append(_compaction_summary_message(compacted["summary"]))
+    if base_seq > after_seq:
+        conversation.extend(load_stored_messages(session_doc.name, after_seq=after_seq, until_seq=base_seq))
+    return conversation + list(delta.get("messages") or [])
+
+
+def load_paused_conversation(session_doc, state: Dict[str, Any], legacy_key: str = "conversation") -> List[Dict[str, Any]]:
+    """
+    Working conversation of a pending confirmation or continuation state. States saved
+    before delta encoding carry the whole conversation under `legacy_key`.
+    """
+    if isinstance(state.get("conversation_delta"), dict):
+        return restore_conversation(session_doc, state["conversation_delta"])
+
+    conversation = state.get(legacy_key) or []
+    _tag_stored_messages(session_doc, conversation)
+    return conversation
+
+
+def save_continuation_state(session_doc, conversation: List[Dict[str, Any]], tool_usage_log: List[Dict[str, Any]], iteration: int):
+    """
+    Store the turn's messages and set the continuation state continue_from_limit resumes
+    from. The caller saves the session.
+    """
+    store_conversation_messages(session_doc, conversation)
+    session_doc.continuation_state = dump_conversation_json({
+        "conversation_delta": conversation_delta(session_doc, conversation),
+        "tool_usage_log": tool_usage_log,
+        "iteration": iteration,
+        "created_at": frappe.utils.now()
+    })
+
+
+# Large JSON columns written through dump_conversation_json
+STORAGE_CODEC_COLUMNS = (
+    (MESSAGE_DOCTYPE, ("tool_usage", "content_blocks")),
+    ("AI Conversation", ("pending_confirmation", "continuation_state")),
+)
+
+
+def _reencode_stored_json(text: Optional[str], codec: str) -> Optional[str]:
+    """A stored JSON column re-encoded for `codec`, or None if it needs no rewrite."""
+    if not text:
+        return None
+
+    stored = json.loads(text) if isinstance(text, str) else text
+    current = stored[CODEC_KEY] if is_encoded(stored) else ""
+    if current == (resolve_codec(codec) or ""):
+        return None
+
+    encoded = dump_conversation_json(decode_json(stored), codec)
+    return encoded if encoded != text else None
+
+
+def migrate_conversation_storage(batch_size: int = STORAGE_MIGRATION_BATCH_SIZE) -> int:
+    """
+    Background job: re-encode the large JSON columns of existing conversations with the
+    storage codec of OpenAI Settings, so enabling, changing or disabling compression also
+    applies to stored data. Enqueued when the setting changes and safe to re-run:
+        bench --site <site> execute erpnext_chatgpt.erpnext_chatgpt.api.migrate_conversation_storage
+
+    :return: Number of rows rewritten
+    """
+    codec = get_ai_settings().storage_codec
+    rewritten = 0
+
+    for doctype, fields in STORAGE_CODEC_COLUMNS:
+        last_name = ""
+        while True:
+            rows = frappe.db.get_all(
+                doctype,
+                filters={"name": [">", last_name]},
+                or_filters=[[doctype, field, "is", "set"] for field in fields],
+                fields=["name", *fields],
+                order_by="name asc",
+                limit_page_length=batch_size
+            )
+            if not rows:
+                break
+
+            for row in rows:
+                changes = {}
+                for field in fields:
+                    try:
+                        encoded = _reencode_stored_json(row[field], codec)
+                    except ValueError as e:
+                        logger.warning(f"Skipping unreadable {field} of {doctype} {row['name']}: {e}")
+                        continue
+                    if encoded is not None:
+                        changes[field] = encoded
+
+                if changes:
+                    frappe.db.set_value(doctype, row["name"], changes, update_modified=False)
+                    rewritten += 1
+
+            frappe.db.commit()
+            last_name = rows[-1]["name"]
+
+    logger.info(f"Re-encoded {rewritten} conversation rows with storage codec '{codec or 'none'}'")
+    return rewritten
+
+
+def _group_conversation_turns(conversation: List[Dict[str, Any]]) -> List[List[int]]:
+    """
+    Split a conversation into turns (lists of message indexes). A turn starts at a system
+    message or a plain-text user message; assistant tool calls and their tool results
+    always fall into the same turn, so dropping whole turns never orphans a tool result.
+    """
+    turns = []
+    for index, message in enumerate(conversation):
+        role = message.get("role")
+        starts_turn = role == "system" or (role == "user" and isinstance(message.get("content"), str))
+        if starts_turn or not turns:
+            turns.append([index])
+        else:
+            turns[-1].append(index)
+    return turns
+
+
+def _compact_tool_result_message(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Return a copy of a message with large tool results shortened, or None if it has none.
+    Tool call ids are kept, so the tool_use/tool_result pairing stays valid.
+    """
+    def shorten(text: str) -> str:
+        return (
+            f"{text[:TOOL_RESULT_COMPACT_CHARS]}\n"
+            f"[Compacted: {len(text) - TOOL_RESULT_COMPACT_CHARS} more characters omitted. "
+            f"Call the tool again if the full data is needed.]"
+        )
+
+    content = message.get("content")
+
+    # OpenAI tool message
+    if message.get("role") == "tool" and isinstance(content, str) and len(content) > TOOL_RESULT_COMPACT_CHARS:
+        return copy_message(message, content=shorten(content))
+
+    # Claude tool_result blocks
+    if isinstance(content, list):
+        changed = False
+        blocks = []
+        for block in content:
+            if (isinstance(block, dict) and block.get("type") == "tool_result"
+                    and isinstance(block.get("content"), str) and len(block["content"]) > TOOL_RESULT_COMPACT_CHARS):
+                blocks.append(dict(block, content=shorten(block["content"])))
+                changed = True
+            else:
+                blocks.append(block)
+        if changed:
+            return copy_message(message, content=blocks)
+
+    return None
+
+
+def trim_conversation_to_token_limit(conversation: List[Dict[str, Any]], token_limit: int = None, settings: AISettings = None) -> List[Dict[str, Any]]:
+    """
+    Trim the conversation so that its total token count does not exceed the specified limit.
+
+    Counts every message once and keeps a running total, so trimming is O(n):
+    1. Shorten large tool results in earlier turns
+    2. Drop the oldest whole turns (never splitting a tool_use from its tool_result)
+    3. As a last resort, shorten large tool results in the current turn
+    System messages and the current turn are never dropped.
+    """
+    settings = settings or get_ai_settings()
+    if token_limit is None:
+        token_limit = settings.max_tokens
+
+    def count(message):
+        return count_message_tokens(message, settings.provider, settings.model)
+
+    messages = list(conversation)
+    counts = [count(message) for message in messages]
+    total = sum(counts)
+    if total <= token_limit:
+        return conversation
+
+    turns = _group_conversation_turns(messages)
+    earlier_turns = [turn for turn in turns[:-1] if messages[turn[0]].get("role") != "system"]
+
+    def compact_turns(turn_list):
+        nonlocal total
+        for turn in turn_list:
+            for index in turn:
+                if total <= token_limit:
+                    return
+                compacted = _compact_tool_result_message(messages[index])
+                if compacted:
+                    new_count = count(compacted)
+                    total += new_count - counts[index]
+                    messages[index], counts[index] = compacted, new_count
+
+    compact_turns(earlier_turns)
+
+    dropped = set()
+    for turn in earlier_turns:
+        if total <= token_limit:
+            break
+        for index in turn:
+            total -= counts[index]
+            dropped.add(index)
+
+    if total > token_limit:
+        compact_turns(turns[-1:])
+
+    logger.debug(f"Trimmed conversation to {total} tokens (limit {token_limit}, dropped {len(dropped)} messages)")
+    conversation[:] = [message for index, message in enumerate(messages) if index not in dropped]
+    return conversation
+
+
+# =============================================================================
+# History Compaction
+# =============================================================================
+
+# Prefix of the user message that carries the compacted summary of earlier turns
+COMPACTION_MARKER = "[Conversation summary]"
+# Compact the stored history when it uses more than this share of the context budget...
+COMPACTION_TRIGGER_RATIO = 0.5
+# ...down to this share, leaving room for the tool results of the new question
+COMPACTION_TARGET_RATIO = 0.25
+# Most recent stored messages that are always kept verbatim
+COMPACTION_KEEP_RECENT_MESSAGES = 4
+COMPACTION_MAX_SUMMARY_CHARS = 8000
+# Tool results longer than this are shortened when trimming
+TOOL_RESULT_COMPACT_CHARS = 2000
+
+CONTEXT_BREADCRUMB_PATTERN = re.compile(r'<!-- CONTEXT: (.*?) -->', re.DOTALL)
+
+
+def is_compaction_summary(message: Dict[str, Any]) -> bool:
+    """Check whether a message is the compacted summary of earlier turns."""
+    content = message.get("content")
+    return message.get("role") == "user" and isinstance(content, str) and content.startswith(COMPACTION_MARKER)
+
+
+def _load_compacted_context(session_doc) -> Optional[Dict[str, Any]]:
+    """Parse AI Conversation.compacted_context ({"summary", "message_count"}), or None."""
+    if not session_doc or not session_doc.get("compacted_context"):
+        return None
+    try:
+        compacted = json.loads(session_doc.compacted_context)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(compacted, dict) or not compacted.get("summary"):
+        return None
+    return compacted
+
+
+def _summarize_stored_message(message: Dict[str, Any]) -> Optional[str]:
+    """
+    Deterministic one-line extract of a stored user or assistant message, or None for
+    Claude tool_use/tool_result messages (list content): the tool calls they made are
+    already in the CONTEXT breadcrumbs of the final answer.
+    """
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        return None
+    if message.get("role") == "user":
+        return f"- User asked: {truncate_text(content, 300)}"
+
+    breadcrumbs = CONTEXT_BREADCRUMB_PATTERN.findall(content)
+    answer = message.get("content_display") or CONTEXT_BREADCRUMB_PATTERN.sub("", content)
+    line = f"- Assistant answered: {truncate_text(answer.strip(), 500)}"
+    if breadcrumbs:
+        line += f"\n  <!-- CONTEXT: {' | '.join(breadcrumbs)} -->"
+    return line
+
+
+def truncate_text(text: str, limit: int) -> str:
+    """Shorten text to limit characters on a single line."""
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def build_compaction_summary(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+    """
+    Extend the compacted summary with the given stored messages, keeping the newest
+    lines when it grows past COMPACTION_MAX_SUMMARY_CHARS.
+    """
+    lines = previous_summary.split("\n") if previous_summary else []
+    lines.extend(line for line in map(_summarize_stored_message, messages) if line)
+
+    while lines and sum(len(line) + 1 for line in lines) > COMPACTION_MAX_SUMMARY_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def _compaction_summary_message(summary: str) -> Dict[str, Any]:
+    return {
+        "role": "user",
+        "content": (
+            f"{COMPACTION_MARKER}: Earlier messages of this conversation were compacted. "
+            f"Key facts and the tool calls used (CONTEXT) so far:\n{summary}"
+        )
+    }
+
+
+def stored_token_total(session_doc, messages: List[Dict[str, Any]], settings: AISettings = None) -> int:
+    """
+    Token total of the loaded stored messages, from the counts stored with them. Messages
+    stored before counts were kept, or counted for another provider or tokenizer, are
+    counted again and their rows updated, so that happens once per message.
+    """
+    settings = settings or get_ai_settings()
+    calibration = token_calibration(settings.provider, settings.model)
+
+    total = 0
+    for message in messages:
+        stale = message.get("token_calibration") != calibration or message.get("token_count") is None
+        total += count_message_tokens(message, settings.provider, settings.model)
+        if stale and message.get("seq"):
+            frappe.db.sql("""
+                UPDATE `tabAI Conversation Message`
+                SET token_count = %(token_count)s, token_calibration = %(calibration)s
+                WHERE conversation = %(conversation)s AND seq = %(seq)s
+            """, {
+                "token_count": message["token_count"],
+                "calibration": calibration,
+                "conversation": session_doc.name,
+                "seq": message["seq"]
+            })
+    return total
+
+
+def load_conversation_history(session_doc) -> List[Dict[str, Any]]:
+    """
+    Load the stored messages for the agentic loop, replacing the compacted prefix
+    (computed once, stored on the session) with its summary message. A conversation in
+    cold storage is moved back to the message log first. Sets the session's running
+    token_total to the tokens of the loaded messages.
+    """
+    if session_doc.archive_file:
+        restore_archived_conversation(session_doc)
+
+    compacted = _load_compacted_context(session_doc)
+    stored_messages = load_stored_messages(
+        session_doc.name,
+        after_seq=compacted["message_count"] if compacted else 0
+    ) if session_doc.message_count else []
+    session_doc.token_total = stored_token_total(session_doc, stored_messages)
+
+    if not compacted:
+        return stored_messages
+
+    return [_compaction_summary_message(compacted["summary"])] + stored_messages
+
+
+def compact_conversation_history(session_doc, conversation: List[Dict[str, Any]], token_limit: int, settings: AISettings = None) -> List[Dict[str, Any]]:
+    """
+    Fold the oldest stored turns into the compacted summary when the history grows past
+    COMPACTION_TRIGGER_RATIO of the token budget. Call on the conversation loaded with
+    load_conversation_history plus the new user message, before the agentic loop.
+
+    Only whole user/assistant exchanges are compacted. The summary and the number of
+    stored messages it covers are saved on the session, so the work is done once.
+    """
+    settings = settings or get_ai_settings()
+
+    def count(message):
+        return count_message_tokens(message, settings.provider, settings.model)
+
+    history_start = next((i for i, m in enumerate(conversation) if m.get("role") != "system"), len(conversation))
+    if history_start < len(conversation) and is_compaction_summary(conversation[history_start]):
+        history_start += 1
+
+    # Stored messages that may be compacted; the new user message and the most recent
+    # exchanges stay verbatim
+    candidates = conversation[history_start:-1][:-COMPACTION_KEEP_RECENT_MESSAGES or None]
+    if not candidates:
+        return conversation
+
+    # Stored messages are in the session's running total; only the rest is counted here
+    if session_doc and session_doc.get("token_total") is not None:
+        total = session_doc.token_total + sum(count(message) for message in conversation if not message.get("seq"))
+    else:
+        total = sum(count(message) for message in conversation)
+    if total <= token_limit * COMPACTION_TRIGGER_RATIO:
+        return conversation
+
+    target = token_limit * COMPACTION_TARGET_RATIO
+    covered = 0
+    removed_tokens = 0
+    for index, message in enumerate(candidates):
+        removed_tokens += count(message)
+        # Only cut after a final assistant answer (string content), never after a Claude
+        # tool_use or OpenAI tool_calls turn: the kept history starts with a user question
+        # and no tool_result loses its tool_use
+        if (message.get("role") == "assistant" and isinstance(message.get("content"), str)
+                and message.get("content") and not message.get("tool_calls")):
+            covered = index + 1
+            if total - removed_tokens <= target:
+                break
+
+    if not covered:
+        return conversation
+
+    compacted = _load_compacted_context(session_doc) or {"summary": "", "message_count": 0}
+    summary = build_compaction_summary(compacted["summary"], candidates[:covered])
+    message_count = candidates[covered - 1].get("seq") or compacted["message_count"] + covered
+
+    if session_doc:
+        if session_doc.get("token_total") is not None:
+            session_doc.token_total -= sum(count(message) for message in candidates[:covered] if message.get("seq"))
+        session_doc.compacted_context = json.dumps({
+            "summary": summary,
+            "message_count": message_count,
+            "updated_at": frappe.utils.now()
+        })
+
+    logger.debug(f"Compacted {covered} messages into the conversation summary ({message_count} total)")
+
+    system_messages = conversation[:next((i for i, m in enumerate(conversation) if m.get("role") != "system"), len(conversation))]
+    conversation[:] = system_messages + [_compaction_summary_message(summary)] + conversation[history_start + covered:]
+    return conversation
+
+
+def handle_claude_tool_calls(tool_blocks, conversation, tool_usage_log, session_doc=None):
+    """
+    Handle Claude tool calls by executing the corresponding functions.
+    Returns (conversation, tool_usage_log, pending_confirmation)
+    """
+    tool_results = []
+    allowed_functions = get_tool_registry().functions
+
+    for tool_block in tool_blocks:
+        if tool_block.name not in allowed_functions:
+            frappe.log_error(f"Function {tool_block.name} not found.", "Claude Tool Error")
+            raise ValueError(f"Function {tool_block.name} not found.")
+
+    # Read tools ahead of the first write tool are independent - run them in parallel
+    write_index = first_write_tool_index([tool_block.name for tool_block in tool_blocks])
+    read_outcomes = execute_read_tools([
+        (tool_block.name, tool_block.input or {}) for tool_block in tool_blocks[:write_index]
+    ])
+
+    for position, tool_block in enumerate(tool_blocks):
+        function_name = tool_block.name
+        tool_use_id = tool_block.id
+        function_args = tool_block.input or {}
+
+        # Check if this is a write operation that requires user confirmation
+        if is_write_operation(function_name):
+            write_metadata = get_write_tool_metadata(function_name)
+            logger.debug(f"Write operation detected: {function_name}, requiring confirmation")
+
+            pending_confirmation = {
+                'tool_call_id': tool_use_id,
+                'tool_name': function_name,
+                'parameters': function_args,
+                'confirmation_message': write_metadata.get('confirmation_message', f'Execute {function_name}'),
+                'conversation_delta': conversation_delta(session_doc, conversation),
+                'tool_usage_log': tool_usage_log.copy(),
+                'created_at': frappe.utils.now()
+            }
+
+            if session_doc:
+                session_doc.pending_confirmation = dump_conversation_json(pending_confirmation)
+                session_doc.save(ignore_permissions=False)
+                frappe.db.commit()
+
+            return conversation, tool_usage_log, pending_confirmation
+
+        # Log the tool usage
+        tool_usage_entry = {
+            "tool_name": function_name,
+            "parameters": function_args,
+            "timestamp": frappe.utils.now(),
+            "is_thinking": function_name == "think"
+        }
+
+        try:
+            function_response, error = read_outcomes[position]
+            if error:
+                raise error
+
+            # Parse response for summary
+            response_data = {}
+            try:
+                response_data = json.loads(function_response)
+                if isinstance(response_data, dict):
+                    if 'delivery_notes' in response_data:
+                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['delivery_notes'])} delivery notes"
+                    elif 'invoices' in response_data:
+                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['invoices'])} invoices"
+                    elif 'total_count' in response_data:
+                        tool_usage_entry['result_summary'] = f"Found {response_data.get('total_count', 0)} records"
+                    else:
+                        tool_usage_entry['result_summary'] = "Data retrieved successfully"
+            except:
+                tool_usage_entry['result_summary'] = "Query executed"
 
             tool_usage_entry['status'] = 'success'
             tool_usage_entry['fetched_entities'] = extract_fetched_entities(function_name, response_data if isinstance(response_data, dict) else {})
@@ -953,48 +2248,564 @@ def handle_claude_tool_calls(tool_blocks, conversation, tool_usage_log, session_
     return conversation, tool_usage_log, None
 
 
-def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usage_log, session_doc, max_tokens):
+# =============================================================================
+# Prompt Caching (Anthropic)
+# =============================================================================
+
+# Cache breakpoint for the static request prefix (tools -> system -> messages)
+CLAUDE_CACHE_CONTROL = {"type": "ephemeral"}
+
+# Usage counters accumulated on AI Conversation.token_usage
+CLAUDE_USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens')
+
+
+def get_cached_claude_tools() -> List[Dict[str, Any]]:
+    """Get the Claude tool schemas with a cache breakpoint after the last tool."""
+    tools = get_claude_tools()
+    if not tools:
+        return tools
+    return tools[:-1] + [dict(tools[-1], cache_control=CLAUDE_CACHE_CONTROL)]
+
+
+def get_cached_claude_system(system_prompt: str) -> List[Dict[str, Any]]:
+    """Wrap the system prompt in a text block with a cache breakpoint."""
+    return [{"type": "text", "text": system_prompt, "cache_control": CLAUDE_CACHE_CONTROL}]
+
+
+def add_conversation_cache_breakpoint(conversation: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Run the Claude agentic loop until final_answer is called or max iterations reached.
+    Return a copy of the conversation with a cache breakpoint on its last content block,
+    so the whole prefix up to the latest turn is cached for the next iteration.
+    The stored conversation is not modified - breakpoints must not accumulate in history.
     """
-    tools = get_claude_tools()
-    max_iterations = 15
-    iteration = 0
-    output_limit = get_model_output_limit(model)
+    conversation = to_api_messages(conversation)
+    if not conversation:
+        return conversation
+
+    last_message = conversation[-1]
+    content = last_message.get("content")
+
+    if isinstance(content, str) and content:
+        blocks = [{"type": "text", "text": content, "cache_control": CLAUDE_CACHE_CONTROL}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        blocks = content[:-1] + [dict(content[-1], cache_control=CLAUDE_CACHE_CONTROL)]
+    else:
+        return conversation
+
+    return conversation[:-1] + [dict(last_message, content=blocks)]
+
+
+def record_claude_usage(session_doc, response, iteration: int):
+    """
+    Add the token usage of a Claude response, including cache reads and writes,
+    to the session totals. Persisted with the next session save.
+    """
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return
+
+    logger.debug(
+        f"Claude usage (iteration {iteration}): input={usage.input_tokens}, output={usage.output_tokens}, "
+        f"cache_read={getattr(usage, 'cache_read_input_tokens', 0) or 0}, "
+        f"cache_write={getattr(usage, 'cache_creation_input_tokens', 0) or 0}"
+    )
+
+    if not session_doc:
+        return
+
+    try:
+        totals = json.loads(session_doc.token_usage) if session_doc.get("token_usage") else {}
+    except (json.JSONDecodeError, TypeError):
+        totals = {}
+
+    for field in CLAUDE_USAGE_FIELDS:
+        totals[field] = totals.get(field, 0) + (getattr(usage, field, 0) or 0)
+    totals['requests'] = totals.get('requests', 0) + 1
+
+    session_doc.token_usage = json.dumps(totals)
+
+
+def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usage_log, session_doc, max_tokens, settings: AISettings = None):
+    """
+    Run the Claude agentic loop until final_answer is called or max iterations reached.
+    """
+    tools = get_cached_claude_tools()
+    system = get_cached_claude_system(system_prompt)
+    max_iterations = 15
+    iteration = 0
+    output_limit = get_model_output_limit(model)
+
+    while iteration < max_iterations:
+        iteration += 1
+
+        try:
+            response = client.messages.create(
+                model=model,
+                max_tokens=output_limit,
+                system=system,
+                messages=add_conversation_cache_breakpoint(conversation),
+                tools=tools,
+                tool_choice={"type": "any"}  # Force tool use
+            )
+        except Exception as e:
+            logger.error(f"Claude API error: {str(e)}")
+            raise
+
+        record_claude_usage(session_doc, response, iteration)
+
+        logger.debug(f"Claude Response (iteration {iteration}): stop_reason={response.stop_reason}")
+
+        # Process the response content
+        tool_blocks = [block for block in response.content if block.type == "tool_use"]
+        text_blocks = [block for block in response.content if block.type == "text"]
+
+        if not tool_blocks:
+            # No tool calls - shouldn't happen with tool_choice=any
+            logger.warning("No tool calls returned despite tool_choice=any")
+            text_content = " ".join([b.text for b in text_blocks]) if text_blocks else "No response generated."
+            return {
+                "role": "assistant",
+                "content": text_content,
+                "tool_usage": tool_usage_log,
+                "iterations": iteration,
+                "session_id": session_doc.name if session_doc else None
+            }
+
+        # Check for final_answer
+        for tool_block in tool_blocks:
+            if tool_block.name == "final_answer":
+                try:
+                    final_args = tool_block.input or {}
+                    logger.debug(f"Final answer received after {iteration} iterations")
+
+                    message = final_args.get("message", "")
+                    message = auto_link_document_ids(message)
+
+                    # Build context summary
+                    context_parts = []
+                    for tool_entry in tool_usage_log:
+                        tool_name = tool_entry.get("tool_name", "")
+                        params = tool_entry.get("parameters", {})
+                        if params and tool_name not in ["final_answer", "think"]:
+                            param_str = ", ".join(f"{k}={v}" for k, v in params.items() if v is not None)
+                            context_parts.append(f"{tool_name}({param_str})")
+
+                    if context_parts:
+                        context_note = "\n\n<!-- CONTEXT: " + " | ".join(context_parts) + " -->"
+                        message_with_context = message + context_note
+                    else:
+                        message_with_context = message
+
+                    # Add assistant response
+                    assistant_message = {
+                        "role": "assistant",
+                        "content": message_with_context,
+                        "content_display": message,
+                        "tool_usage": tool_usage_log
+                    }
+                    conversation.append(assistant_message)
+
+                    # Save conversation
+                    if session_doc:
+                        store_conversation_messages(session_doc, conversation)
+                        session_doc.model_used = model
+                        session_doc.save(ignore_permissions=False)
+                        frappe.db.commit()
+
+                    return {
+                        "role": "assistant",
+                        "content": message_with_context,
+                        "content_display": message,
+                        "tool_usage": tool_usage_log,
+                        "summary": final_args.get("summary"),
+                        "iterations": iteration,
+                        "session_id": session_doc.name if session_doc else None
+                    }
+                except Exception as e:
+                    logger.error(f"Failed to parse final_answer: {e}")
+                    return {
+                        "role": "assistant",
+                        "content": "I encountered an error formatting my response.",
+                        "tool_usage": tool_usage_log,
+                        "error": str(e),
+                        "session_id": session_doc.name if session_doc else None
+                    }
+
+        # No final_answer yet - add assistant message with tool calls and handle them
+        # Build assistant message content
+        assistant_content = []
+        for block in text_blocks:
+            assistant_content.append({"type": "text", "text": block.text})
+        for block in tool_blocks:
+            assistant_content.append({
+                "type": "tool_use",
+                "id": block.id,
+                "name": block.name,
+                "input": block.input
+            })
+
+        conversation.append({
+            "role": "assistant",
+            "content": assistant_content
+        })
+
+        # Handle tool calls
+        conversation, tool_usage_log, pending_confirmation = handle_claude_tool_calls(
+            tool_blocks, conversation, tool_usage_log, session_doc
+        )
+
+        if pending_confirmation:
+            return {
+                "status": "pending_confirmation",
+                "pending_confirmation": pending_confirmation,
+                "tool_usage": tool_usage_log,
+                "session_id": session_doc.name if session_doc else None
+            }
+
+        # Check for recovery hints and inject context
+        for entry in tool_usage_log[-len(tool_blocks):]:
+            if entry.get('recovery_hint'):
+                conversation = inject_recovery_context(conversation, entry['recovery_hint'], "anthropic")
+                break  # Only inject one hint per iteration
+
+        logger.debug(f"Handled {len(tool_blocks)} tool calls, continuing to iteration {iteration + 1}")
+
+    # Max iterations reached - ask user if they want to continue
+    logger.warning(f"Hit max iterations ({max_iterations}) without final_answer")
+
+    # Build progress summary for user
+    tools_called = [t.get('tool_name') for t in tool_usage_log if t.get('tool_name') != 'think']
+    thinking_steps = len([t for t in tool_usage_log if t.get('is_thinking')])
+
+    progress_summary = {
+        "iterations_used": iteration,
+        "max_iterations": max_iterations,
+        "tools_called": tools_called,
+        "thinking_steps": thinking_steps,
+        "total_tool_calls": len(tool_usage_log)
+    }
+
+    # Save conversation state for potential continuation
+    if session_doc:
+        # Store the current conversation state for continuation
+        save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
+        session_doc.model_used = model
+        session_doc.save(ignore_permissions=False)
+        frappe.db.commit()
+
+    return {
+        "status": "limit_reached",
+        "progress_summary": progress_summary,
+        "tool_usage": tool_usage_log,
+        "message": f"I've made {len(tools_called)} tool calls across {iteration} iterations but haven't finished yet. Would you like me to continue?",
+        "session_id": session_doc.name if session_doc else None
+    }
+
+
+def is_token_streaming_enabled(settings: AISettings = None) -> bool:
+    """Check whether provider responses should be streamed token by token."""
+    settings = settings or get_ai_settings()
+    return not settings.disable_token_streaming
+
+
+def stream_claude_message(client, iteration: int, announced_tool_ids: set, **request_kwargs) -> Generator[str, None, Any]:
+    """
+    Call the Claude Messages API in streaming mode and yield SSE events while the
+    response is generated:
+    - tool_start as soon as a tool_use block's name is known
+    - answer_delta with the incremental text of final_answer.message
+
+    Use with `yield from`; the generator returns the final Message, which has the
+    same shape as the result of client.messages.create().
+
+    :param announced_tool_ids: Set that collects tool_use ids already announced via tool_start
+    """
+    answer_extractors = {}
+
+    with client.messages.stream(**request_kwargs) as stream:
+        for event in stream:
+            if event.type == "content_block_start" and event.content_block.type == "tool_use":
+                block = event.content_block
+                if block.name == "final_answer":
+                    answer_extractors[event.index] = StreamingJsonFieldExtractor("message")
+                else:
+                    announced_tool_ids.add(block.id)
+                    yield sse_event("tool_start", {
+                        "tool_name": block.name,
+                        "parameters": {},
+                        "iteration": iteration,
+                        "is_thinking": block.name == "think"
+                    })
+
+            elif event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+                extractor = answer_extractors.get(event.index)
+                if extractor:
+                    text = extractor.feed(event.delta.partial_json)
+                    if text:
+                        yield sse_event("answer_delta", {"text": text, "iteration": iteration})
+
+        return stream.get_final_message()
+
+
+def stream_tool_calls(calls: List[Tuple[str, str, Dict[str, Any]]], iteration: int, announced_tool_ids: set, heartbeat_interval: float) -> Generator[str, None, Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[Tuple[str, str, Dict[str, Any]]]]]:
+    """
+    Execute the tool calls of one model turn, yielding tool_start, tool_complete
+    and heartbeat SSE events. Provider-neutral: the streaming loops convert the
+    results into their own message format.
+
+    Read tools ahead of the first write tool run in parallel. The write tool itself
+    is not executed; it is returned so the caller can take the confirmation path.
+
+    Use with `yield from`; the generator returns (results, tool_usage_entries, write_call):
+    - results: [{"call_id", "tool_name", "content", "is_error"}] in the original call order
+    - tool_usage_entries: tool usage log entries in the original call order
+    - write_call: (call_id, function_name, function_args) of the write tool, or None
+
+    :param calls: List of (call_id, function_name, function_args) tuples
+    :param announced_tool_ids: Call ids whose tool_start was already sent while streaming
+    """
+    last_heartbeat = time.time()
+    allowed_functions = get_tool_registry().functions
+    results_by_position = {}
+    entries_by_position = {}
+
+    write_index = first_write_tool_index([function_name for _, function_name, _ in calls])
+    read_calls = []
+
+    for position, (call_id, function_name, function_args) in enumerate(calls[:write_index]):
+        # Yield tool_start event (unless it was already sent while streaming)
+        if call_id not in announced_tool_ids:
+            yield sse_event("tool_start", {
+                "tool_name": function_name,
+                "parameters": function_args,
+                "iteration": iteration,
+                "is_thinking": function_name == "think"
+            })
+
+        if function_name not in allowed_functions:
+            error_msg = f"Function {function_name} not found."
+            logger.error(error_msg)
+            results_by_position[position] = {
+                "call_id": call_id,
+                "tool_name": function_name,
+                "content": f"Error: {error_msg}",
+                "is_error": True
+            }
+            yield sse_event("tool_complete", {
+                "tool_name": function_name,
+                "status": "error",
+                "error": error_msg
+            })
+            continue
+
+        read_calls.append(position)
+
+    # Execute the read tools, sending heartbeats while workers are busy
+    outcomes = run_read_tools(
+        [(calls[position][1], calls[position][2]) for position in read_calls],
+        wait_timeout=heartbeat_interval
+    )
+    for outcome in outcomes:
+        # Check for heartbeat
+        if time.time() - last_heartbeat > heartbeat_interval:
+            yield sse_heartbeat()
+            last_heartbeat = time.time()
+
+        if outcome is None:
+            continue
+
+        index, function_response, error = outcome
+        position = read_calls[index]
+        call_id, function_name, function_args = calls[position]
+
+        tool_usage_entry = {
+            "tool_name": function_name,
+            "parameters": function_args,
+            "timestamp": frappe.utils.now(),
+            "is_thinking": function_name == "think"
+        }
+
+        try:
+            if error:
+                raise error
+
+            # Parse response for summary
+            response_data = {}
+            try:
+                response_data = json.loads(function_response)
+                if isinstance(response_data, dict):
+                    if 'delivery_notes' in response_data:
+                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['delivery_notes'])} delivery notes"
+                    elif 'invoices' in response_data:
+                        tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['invoices'])} invoices"
+                    elif 'total_count' in response_data:
+                        tool_usage_entry['result_summary'] = f"Found {response_data.get('total_count', 0)} records"
+                    else:
+                        tool_usage_entry['result_summary'] = "Data retrieved successfully"
+            except:
+                tool_usage_entry['result_summary'] = "Query executed"
+
+            tool_usage_entry['status'] = 'success'
+            tool_usage_entry['fetched_entities'] = extract_fetched_entities(function_name, response_data if isinstance(response_data, dict) else {})
+
+            results_by_position[position] = {
+                "call_id": call_id,
+                "tool_name": function_name,
+                "content": str(function_response),
+                "is_error": False
+            }
+
+            # Check for recovery hints
+            needs_recovery, hint = analyze_tool_result(function_name, function_response)
+            if needs_recovery and hint:
+                tool_usage_entry['recovery_hint'] = hint
+
+            yield sse_event("tool_complete", {
+                "tool_name": function_name,
+                "status": "success",
+                "result_summary": tool_usage_entry.get('result_summary'),
+                "is_thinking": function_name == "think"
+            })
+
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error executing {function_name}: {error_msg}")
+            tool_usage_entry['status'] = 'error'
+            tool_usage_entry['error'] = error_msg
+
+            results_by_position[position] = {
+                "call_id": call_id,
+                "tool_name": function_name,
+                "content": f"Error: {error_msg}",
+                "is_error": True
+            }
+
+            yield sse_event("tool_complete", {
+                "tool_name": function_name,
+                "status": "error",
+                "error": error_msg
+            })
+
+        entries_by_position[position] = tool_usage_entry
+
+    results = [results_by_position[position] for position in sorted(results_by_position)]
+    tool_usage_entries = [entries_by_position[position] for position in sorted(entries_by_position)]
+
+    write_call = None
+    if write_index < len(calls):
+        write_call = calls[write_index]
+        call_id, function_name, function_args = write_call
+        if call_id not in announced_tool_ids:
+            yield sse_event("tool_start", {
+                "tool_name": function_name,
+                "parameters": function_args,
+                "iteration": iteration,
+                "is_thinking": False
+            })
+
+    return results, tool_usage_entries, write_call
+
+
+def save_pending_confirmation(write_call: Tuple[str, str, Dict[str, Any]], conversation: List[Dict[str, Any]], tool_usage_log: List[Dict[str, Any]], session_doc=None) -> Dict[str, Any]:
+    """
+    Build the pending confirmation for a write tool call and store it on the session.
+
+    :param write_call: (call_id, function_name, function_args) of the write tool
+    :return: The pending confirmation data
+    """
+    call_id, function_name, function_args = write_call
+    write_metadata = get_write_tool_metadata(function_name)
+    logger.debug(f"Write operation detected: {function_name}, requiring confirmation")
+
+    pending_confirmation = {
+        'tool_call_id': call_id,
+        'tool_name': function_name,
+        'parameters': function_args,
+        'confirmation_message': write_metadata.get('confirmation_message', f'Execute {function_name}'),
+        'conversation_delta': conversation_delta(session_doc, conversation),
+        'tool_usage_log': tool_usage_log.copy(),
+        'created_at': frappe.utils.now()
+    }
+
+    if session_doc:
+        session_doc.pending_confirmation = dump_conversation_json(pending_confirmation)
+        session_doc.save(ignore_permissions=False)
+        frappe.db.commit()
+
+    return pending_confirmation
+
+
+def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation, tool_usage_log, session_doc, max_tokens, settings: AISettings = None) -> Generator[str, None, None]:
+    """
+    Run the Claude agentic loop as a generator that yields SSE events.
+    This allows real-time streaming of progress to the client.
+    """
+    tools = get_cached_claude_tools()
+    system = get_cached_claude_system(system_prompt)
+    max_iterations = 15
+    iteration = 0
+    output_limit = get_model_output_limit(model)
+    heartbeat_interval = 15  # seconds
+    stream_tokens = is_token_streaming_enabled(settings)
+
+    # Yield connected event
+    yield sse_event("connected", {
+        "session_id": session_doc.name if session_doc else None,
+        "model": model,
+        "max_iterations": max_iterations
+    })
 
     while iteration < max_iterations:
         iteration += 1
 
+        # Yield iteration start event
+        yield sse_event("iteration_start", {
+            "iteration": iteration,
+            "max_iterations": max_iterations,
+            "tools_called_so_far": len(tool_usage_log)
+        })
+
+        # Tool blocks already announced with tool_start while the response streamed in
+        announced_tool_ids = set()
+
         try:
-            response = client.messages.create(
+            request_kwargs = dict(
                 model=model,
                 max_tokens=output_limit,
-                system=system_prompt,
-                messages=conversation,
+                system=system,
+                messages=add_conversation_cache_breakpoint(conversation),
                 tools=tools,
-                tool_choice={"type": "any"}  # Force tool use
+                tool_choice={"type": "any"}
             )
+            if stream_tokens:
+                response = yield from stream_claude_message(
+                    client, iteration, announced_tool_ids, **request_kwargs
+                )
+            else:
+                response = client.messages.create(**request_kwargs)
         except Exception as e:
             logger.error(f"Claude API error: {str(e)}")
-            raise
+            yield sse_event("error", {"error": str(e), "iteration": iteration})
+            return
+
+        record_claude_usage(session_doc, response, iteration)
 
         logger.debug(f"Claude Response (iteration {iteration}): stop_reason={response.stop_reason}")
 
-        # Process the response content
         tool_blocks = [block for block in response.content if block.type == "tool_use"]
         text_blocks = [block for block in response.content if block.type == "text"]
 
         if not tool_blocks:
-            # No tool calls - shouldn't happen with tool_choice=any
             logger.warning("No tool calls returned despite tool_choice=any")
             text_content = " ".join([b.text for b in text_blocks]) if text_blocks else "No response generated."
-            return {
+            yield sse_event("final_answer", {
                 "role": "assistant",
                 "content": text_content,
                 "tool_usage": tool_usage_log,
                 "iterations": iteration,
                 "session_id": session_doc.name if session_doc else None
-            }
+            })
+            return
 
         # Check for final_answer
         for tool_block in tool_blocks:
@@ -1032,13 +2843,12 @@ def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usa
 
                     # Save conversation
                     if session_doc:
-                        messages_to_save = extract_messages_for_storage(conversation)
-                        session_doc.messages = json.dumps(messages_to_save)
+                        store_conversation_messages(session_doc, conversation)
                         session_doc.model_used = model
                         session_doc.save(ignore_permissions=False)
                         frappe.db.commit()
 
-                    return {
+                    yield sse_event("final_answer", {
                         "role": "assistant",
                         "content": message_with_context,
                         "content_display": message,
@@ -1046,19 +2856,19 @@ def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usa
                         "summary": final_args.get("summary"),
                         "iterations": iteration,
                         "session_id": session_doc.name if session_doc else None
-                    }
+                    })
+                    return
+
                 except Exception as e:
                     logger.error(f"Failed to parse final_answer: {e}")
-                    return {
-                        "role": "assistant",
-                        "content": "I encountered an error formatting my response.",
-                        "tool_usage": tool_usage_log,
+                    yield sse_event("error", {
                         "error": str(e),
+                        "tool_usage": tool_usage_log,
                         "session_id": session_doc.name if session_doc else None
-                    }
+                    })
+                    return
 
         # No final_answer yet - add assistant message with tool calls and handle them
-        # Build assistant message content
         assistant_content = []
         for block in text_blocks:
             assistant_content.append({"type": "text", "text": block.text})
@@ -1075,31 +2885,60 @@ def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usa
             "content": assistant_content
         })
 
-        # Handle tool calls
-        conversation, tool_usage_log, pending_confirmation = handle_claude_tool_calls(
-            tool_blocks, conversation, tool_usage_log, session_doc
+        # Handle tool calls with streaming events
+        calls = [(tool_block.id, tool_block.name, tool_block.input or {}) for tool_block in tool_blocks]
+        results, tool_usage_entries, write_call = yield from stream_tool_calls(
+            calls, iteration, announced_tool_ids, heartbeat_interval
         )
+        tool_usage_log.extend(tool_usage_entries)
 
-        if pending_confirmation:
-            return {
+        # Collect all tool results to append as a single message (Claude API requirement)
+        tool_results = []
+        for result in results:
+            tool_result = {
+                "type": "tool_result",
+                "tool_use_id": result["call_id"],
+                "content": result["content"]
+            }
+            if result["is_error"]:
+                tool_result["is_error"] = True
+            tool_results.append(tool_result)
+
+        # Write tools keep the serial confirmation path
+        if write_call:
+            pending_confirmation = save_pending_confirmation(write_call, conversation, tool_usage_log, session_doc)
+            yield sse_event("pending_confirmation", {
                 "status": "pending_confirmation",
                 "pending_confirmation": pending_confirmation,
                 "tool_usage": tool_usage_log,
                 "session_id": session_doc.name if session_doc else None
-            }
+            })
+            return
+
+        # Add all tool results to conversation as a single message
+        if tool_results:
+            conversation.append({
+                "role": "user",
+                "content": tool_results
+            })
 
         # Check for recovery hints and inject context
         for entry in tool_usage_log[-len(tool_blocks):]:
             if entry.get('recovery_hint'):
                 conversation = inject_recovery_context(conversation, entry['recovery_hint'], "anthropic")
-                break  # Only inject one hint per iteration
+                break
+
+        # Save checkpoint state after each iteration
+        if session_doc:
+            save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
+            session_doc.save(ignore_permissions=False)
+            frappe.db.commit()
 
         logger.debug(f"Handled {len(tool_blocks)} tool calls, continuing to iteration {iteration + 1}")
 
-    # Max iterations reached - ask user if they want to continue
+    # Max iterations reached
     logger.warning(f"Hit max iterations ({max_iterations}) without final_answer")
 
-    # Build progress summary for user
     tools_called = [t.get('tool_name') for t in tool_usage_log if t.get('tool_name') != 'think']
     thinking_steps = len([t for t in tool_usage_log if t.get('is_thinking')])
 
@@ -1111,42 +2950,97 @@ def run_claude_agentic_loop(client, model, system_prompt, conversation, tool_usa
         "total_tool_calls": len(tool_usage_log)
     }
 
-    # Save conversation state for potential continuation
+    # Save continuation state
     if session_doc:
-        # Store the current conversation state for continuation
-        continuation_state = {
-            "conversation": conversation,
-            "tool_usage_log": tool_usage_log,
-            "iteration": iteration,
-            "created_at": frappe.utils.now()
-        }
-        session_doc.continuation_state = json.dumps(continuation_state, default=json_serial)
-        messages_to_save = extract_messages_for_storage(conversation)
-        session_doc.messages = json.dumps(messages_to_save)
+        save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
         session_doc.model_used = model
         session_doc.save(ignore_permissions=False)
         frappe.db.commit()
 
-    return {
+    yield sse_event("limit_reached", {
         "status": "limit_reached",
         "progress_summary": progress_summary,
         "tool_usage": tool_usage_log,
         "message": f"I've made {len(tools_called)} tool calls across {iteration} iterations but haven't finished yet. Would you like me to continue?",
         "session_id": session_doc.name if session_doc else None
+    })
+
+
+def stream_openai_message(client, iteration: int, announced_tool_ids: set, **request_kwargs) -> Generator[str, None, Dict[str, Any]]:
+    """
+    Call the OpenAI Chat Completions API in streaming mode and yield SSE events while
+    the response is generated:
+    - tool_start as soon as a tool call's function name is known
+    - answer_delta with the incremental text of final_answer.message
+
+    Use with `yield from`; the generator returns the assembled assistant message as a
+    dict in the same shape as ChatCompletionMessage.model_dump().
+
+    :param announced_tool_ids: Set that collects tool call ids already announced via tool_start
+    """
+    content_parts = []
+    tool_calls_by_index = {}
+    answer_extractors = {}
+
+    for chunk in client.chat.completions.create(stream=True, **request_kwargs):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+
+        if delta.content:
+            content_parts.append(delta.content)
+
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls_by_index.setdefault(tool_call_delta.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+
+            function_delta = tool_call_delta.function
+            if not function_delta:
+                continue
+
+            if function_delta.name:
+                tool_call["function"]["name"] += function_delta.name
+                if function_delta.name == "final_answer":
+                    answer_extractors[tool_call_delta.index] = StreamingJsonFieldExtractor("message")
+                elif tool_call["id"]:
+                    announced_tool_ids.add(tool_call["id"])
+                    yield sse_event("tool_start", {
+                        "tool_name": tool_call["function"]["name"],
+                        "parameters": {},
+                        "iteration": iteration,
+                        "is_thinking": tool_call["function"]["name"] == "think"
+                    })
+
+            if function_delta.arguments:
+                tool_call["function"]["arguments"] += function_delta.arguments
+                extractor = answer_extractors.get(tool_call_delta.index)
+                if extractor:
+                    text = extractor.feed(function_delta.arguments)
+                    if text:
+                        yield sse_event("answer_delta", {"text": text, "iteration": iteration})
+
+    return {
+        "role": "assistant",
+        "content": "".join(content_parts) or None,
+        "tool_calls": [tool_calls_by_index[index] for index in sorted(tool_calls_by_index)] or None
     }
 
 
-def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation, tool_usage_log, session_doc, max_tokens) -> Generator[str, None, None]:
+def run_openai_agentic_loop_streaming(client, model, conversation, tool_usage_log, session_doc, max_tokens, settings: AISettings = None) -> Generator[str, None, None]:
     """
-    Run the Claude agentic loop as a generator that yields SSE events.
-    This allows real-time streaming of progress to the client.
+    Run the OpenAI agentic loop as a generator that yields SSE events.
+    Emits the same event sequence as run_claude_agentic_loop_streaming.
     """
-    tools = get_claude_tools()
+    tools = get_tools()
     max_iterations = 15
     iteration = 0
-    output_limit = get_model_output_limit(model)
-    last_heartbeat = time.time()
     heartbeat_interval = 15  # seconds
+    stream_tokens = is_token_streaming_enabled(settings)
 
     # Yield connected event
     yield sse_event("connected", {
@@ -1165,31 +3059,37 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
             "tools_called_so_far": len(tool_usage_log)
         })
 
+        # Tool calls already announced with tool_start while the response streamed in
+        announced_tool_ids = set()
+
         try:
-            response = client.messages.create(
+            request_kwargs = dict(
                 model=model,
-                max_tokens=output_limit,
-                system=system_prompt,
-                messages=conversation,
+                messages=to_api_messages(conversation),
                 tools=tools,
-                tool_choice={"type": "any"}
+                tool_choice="required"
             )
+            if stream_tokens:
+                response_message = yield from stream_openai_message(
+                    client, iteration, announced_tool_ids, **request_kwargs
+                )
+            else:
+                response = client.chat.completions.create(**request_kwargs)
+                response_message = response.choices[0].message.model_dump()
         except Exception as e:
-            logger.error(f"Claude API error: {str(e)}")
+            logger.error(f"OpenAI API error: {str(e)}")
             yield sse_event("error", {"error": str(e), "iteration": iteration})
             return
 
-        logger.debug(f"Claude Response (iteration {iteration}): stop_reason={response.stop_reason}")
+        logger.debug(f"OpenAI Response (iteration {iteration}): {response_message}")
 
-        tool_blocks = [block for block in response.content if block.type == "tool_use"]
-        text_blocks = [block for block in response.content if block.type == "text"]
+        tool_calls = response_message.get("tool_calls") or []
 
-        if not tool_blocks:
-            logger.warning("No tool calls returned despite tool_choice=any")
-            text_content = " ".join([b.text for b in text_blocks]) if text_blocks else "No response generated."
+        if not tool_calls:
+            logger.warning("No tool calls returned despite tool_choice=required")
             yield sse_event("final_answer", {
                 "role": "assistant",
-                "content": text_content,
+                "content": response_message.get("content") or "No response generated.",
                 "tool_usage": tool_usage_log,
                 "iterations": iteration,
                 "session_id": session_doc.name if session_doc else None
@@ -1197,10 +3097,10 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
             return
 
         # Check for final_answer
-        for tool_block in tool_blocks:
-            if tool_block.name == "final_answer":
+        for tool_call in tool_calls:
+            if tool_call["function"]["name"] == "final_answer":
                 try:
-                    final_args = tool_block.input or {}
+                    final_args = json.loads(tool_call["function"]["arguments"] or "{}")
                     logger.debug(f"Final answer received after {iteration} iterations")
 
                     message = final_args.get("message", "")
@@ -1211,7 +3111,7 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
                     for tool_entry in tool_usage_log:
                         tool_name = tool_entry.get("tool_name", "")
                         params = tool_entry.get("parameters", {})
-                        if params and tool_name not in ["final_answer", "think"]:
+                        if params and tool_name != "final_answer":
                             param_str = ", ".join(f"{k}={v}" for k, v in params.items() if v is not None)
                             context_parts.append(f"{tool_name}({param_str})")
 
@@ -1232,8 +3132,7 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
 
                     # Save conversation
                     if session_doc:
-                        messages_to_save = extract_messages_for_storage(conversation)
-                        session_doc.messages = json.dumps(messages_to_save)
+                        store_conversation_messages(session_doc, conversation)
                         session_doc.model_used = model
                         session_doc.save(ignore_permissions=False)
                         frappe.db.commit()
@@ -1259,188 +3158,59 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
                     return
 
         # No final_answer yet - add assistant message with tool calls and handle them
-        assistant_content = []
-        for block in text_blocks:
-            assistant_content.append({"type": "text", "text": block.text})
-        for block in tool_blocks:
-            assistant_content.append({
-                "type": "tool_use",
-                "id": block.id,
-                "name": block.name,
-                "input": block.input
-            })
+        conversation.append(response_message)
 
-        conversation.append({
-            "role": "assistant",
-            "content": assistant_content
-        })
+        calls = []
+        for tool_call in tool_calls:
+            try:
+                function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+            except json.JSONDecodeError:
+                logger.error(f"Invalid arguments for {tool_call['function']['name']}: {tool_call['function']['arguments']}")
+                function_args = {}
+            calls.append((tool_call["id"], tool_call["function"]["name"], function_args))
 
         # Handle tool calls with streaming events
-        # Collect all tool results to append as a single message (Claude API requirement)
-        tool_results = []
-
-        for tool_block in tool_blocks:
-            function_name = tool_block.name
-            tool_use_id = tool_block.id
-            function_args = tool_block.input or {}
+        results, tool_usage_entries, write_call = yield from stream_tool_calls(
+            calls, iteration, announced_tool_ids, heartbeat_interval
+        )
+        tool_usage_log.extend(tool_usage_entries)
 
-            # Yield tool_start event
-            yield sse_event("tool_start", {
-                "tool_name": function_name,
-                "parameters": function_args,
-                "iteration": iteration,
-                "is_thinking": function_name == "think"
+        # Every tool call needs a matching tool message before the next request
+        for result in results:
+            conversation.append({
+                "tool_call_id": result["call_id"],
+                "role": "tool",
+                "name": result["tool_name"],
+                "content": result["content"],
             })
 
-            # Check for heartbeat
-            if time.time() - last_heartbeat > heartbeat_interval:
-                yield sse_heartbeat()
-                last_heartbeat = time.time()
-
-            function_to_call = available_functions.get(function_name)
-            if not function_to_call:
-                error_msg = f"Function {function_name} not found."
-                logger.error(error_msg)
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tool_use_id,
-                    "content": f"Error: {error_msg}",
-                    "is_error": True
-                })
-                yield sse_event("tool_complete", {
-                    "tool_name": function_name,
-                    "status": "error",
-                    "error": error_msg
-                })
-                continue
-
-            # Check if this is a write operation that requires user confirmation
-            if is_write_operation(function_name):
-                write_metadata = get_write_tool_metadata(function_name)
-                logger.debug(f"Write operation detected: {function_name}, requiring confirmation")
-
-                pending_confirmation = {
-                    'tool_call_id': tool_use_id,
-                    'tool_name': function_name,
-                    'parameters': function_args,
-                    'confirmation_message': write_metadata.get('confirmation_message', f'Execute {function_name}'),
-                    'conversation_state': conversation.copy(),
-                    'tool_usage_log': tool_usage_log.copy(),
-                    'created_at': frappe.utils.now()
-                }
-
-                if session_doc:
-                    session_doc.pending_confirmation = json.dumps(pending_confirmation, default=json_serial)
-                    session_doc.save(ignore_permissions=False)
-                    frappe.db.commit()
-
-                yield sse_event("pending_confirmation", {
-                    "status": "pending_confirmation",
-                    "pending_confirmation": pending_confirmation,
-                    "tool_usage": tool_usage_log,
-                    "session_id": session_doc.name if session_doc else None
-                })
-                return
-
-            # Execute the tool
-            tool_usage_entry = {
-                "tool_name": function_name,
-                "parameters": function_args,
-                "timestamp": frappe.utils.now(),
-                "is_thinking": function_name == "think"
-            }
-
-            try:
-                function_response = function_to_call(**function_args)
-
-                # Parse response for summary
-                response_data = {}
-                try:
-                    response_data = json.loads(function_response)
-                    if isinstance(response_data, dict):
-                        if 'delivery_notes' in response_data:
-                            tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['delivery_notes'])} delivery notes"
-                        elif 'invoices' in response_data:
-                            tool_usage_entry['result_summary'] = f"Retrieved {len(response_data['invoices'])} invoices"
-                        elif 'total_count' in response_data:
-                            tool_usage_entry['result_summary'] = f"Found {response_data.get('total_count', 0)} records"
-                        else:
-                            tool_usage_entry['result_summary'] = "Data retrieved successfully"
-                except:
-                    tool_usage_entry['result_summary'] = "Query executed"
-
-                tool_usage_entry['status'] = 'success'
-                tool_usage_entry['fetched_entities'] = extract_fetched_entities(function_name, response_data if isinstance(response_data, dict) else {})
-
-                # Collect tool result (will be added to conversation after loop)
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tool_use_id,
-                    "content": str(function_response)
-                })
-
-                # Check for recovery hints
-                needs_recovery, hint = analyze_tool_result(function_name, function_response)
-                if needs_recovery and hint:
-                    tool_usage_entry['recovery_hint'] = hint
-
-                yield sse_event("tool_complete", {
-                    "tool_name": function_name,
-                    "status": "success",
-                    "result_summary": tool_usage_entry.get('result_summary'),
-                    "is_thinking": function_name == "think"
-                })
-
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Error executing {function_name}: {error_msg}")
-                tool_usage_entry['status'] = 'error'
-                tool_usage_entry['error'] = error_msg
-
-                # Collect error result
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tool_use_id,
-                    "content": f"Error: {error_msg}",
-                    "is_error": True
-                })
-
-                yield sse_event("tool_complete", {
-                    "tool_name": function_name,
-                    "status": "error",
-                    "error": error_msg
-                })
-
-            tool_usage_log.append(tool_usage_entry)
-
-        # Add all tool results to conversation as a single message
-        if tool_results:
-            conversation.append({
-                "role": "user",
-                "content": tool_results
+        # Write tools keep the serial confirmation path
+        if write_call:
+            pending_confirmation = save_pending_confirmation(write_call, conversation, tool_usage_log, session_doc)
+            yield sse_event("pending_confirmation", {
+                "status": "pending_confirmation",
+                "pending_confirmation": pending_confirmation,
+                "tool_usage": tool_usage_log,
+                "session_id": session_doc.name if session_doc else None
             })
+            return
 
         # Check for recovery hints and inject context
-        for entry in tool_usage_log[-len(tool_blocks):]:
+        for entry in tool_usage_entries:
             if entry.get('recovery_hint'):
-                conversation = inject_recovery_context(conversation, entry['recovery_hint'], "anthropic")
+                conversation = inject_recovery_context(conversation, entry['recovery_hint'], "openai")
                 break
 
+        # Trim conversation if needed
+        conversation = trim_conversation_to_token_limit(conversation, max_tokens)
+
         # Save checkpoint state after each iteration
         if session_doc:
-            continuation_state = {
-                "conversation": conversation,
-                "tool_usage_log": tool_usage_log,
-                "iteration": iteration,
-                "created_at": frappe.utils.now()
-            }
-            session_doc.continuation_state = json.dumps(continuation_state, default=json_serial)
-            messages_to_save = extract_messages_for_storage(conversation)
-            session_doc.messages = json.dumps(messages_to_save)
+            save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
             session_doc.save(ignore_permissions=False)
             frappe.db.commit()
 
-        logger.debug(f"Handled {len(tool_blocks)} tool calls, continuing to iteration {iteration + 1}")
+        logger.debug(f"Handled {len(tool_calls)} tool calls, continuing to iteration {iteration + 1}")
 
     # Max iterations reached
     logger.warning(f"Hit max iterations ({max_iterations}) without final_answer")
@@ -1458,15 +3228,7 @@ def run_claude_agentic_loop_streaming(client, model, system_prompt, conversation
 
     # Save continuation state
     if session_doc:
-        continuation_state = {
-            "conversation": conversation,
-            "tool_usage_log": tool_usage_log,
-            "iteration": iteration,
-            "created_at": frappe.utils.now()
-        }
-        session_doc.continuation_state = json.dumps(continuation_state, default=json_serial)
-        messages_to_save = extract_messages_for_storage(conversation)
-        session_doc.messages = json.dumps(messages_to_save)
+        save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
         session_doc.model_used = model
         session_doc.save(ignore_permissions=False)
         frappe.db.commit()
@@ -1495,7 +3257,8 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
             return {"error": "session_id and message are required", "tool_usage": []}
 
         # Check which provider to use
-        provider = get_api_provider()
+        settings = get_ai_settings()
+        provider = settings.provider
         tool_usage_log = []
 
         # Load conversation from database
@@ -1506,8 +3269,8 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
             if session_doc.owner != frappe.session.user and "System Manager" not in frappe.get_roles():
                 frappe.throw("You don't have permission to access this conversation")
 
-            # Load existing messages
-            conversation = json.loads(session_doc.messages) if session_doc.messages else []
+            # Load existing messages (with the compacted prefix replaced by its summary)
+            conversation = load_conversation_history(session_doc)
 
             # Add the new user message
             conversation.append({"role": "user", "content": message})
@@ -1521,13 +3284,14 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
 
         # Add system instructions as the initial message if not present
         if not conversation or conversation[0].get("role") != "system":
-            conversation.insert(0, {"role": "system", "content": get_system_instructions()})
+            conversation.insert(0, {"role": "system", "content": get_system_instructions(settings)})
 
         # Get model settings
-        model, max_tokens = get_model_settings()
+        model, max_tokens = get_model_settings(settings)
 
-        # Trim conversation to stay within the token limit
-        conversation = trim_conversation_to_token_limit(conversation, max_tokens)
+        # Compact older turns into a summary, then trim to stay within the token limit
+        conversation = compact_conversation_history(session_doc, conversation, max_tokens, settings)
+        conversation = trim_conversation_to_token_limit(conversation, max_tokens, settings)
 
         logger.info(f"[ROUTING] Provider='{provider}', Model='{model}', routing to {'Claude' if provider == 'anthropic' else 'OpenAI'}")
 
@@ -1547,11 +3311,11 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
                     claude_messages.append(msg)
 
             if not system_prompt:
-                system_prompt = get_system_instructions()
+                system_prompt = get_system_instructions(settings)
 
             return run_claude_agentic_loop(
                 client, model, system_prompt, claude_messages,
-                tool_usage_log, session_doc, max_tokens
+                tool_usage_log, session_doc, max_tokens, settings
             )
 
         # Default: Use OpenAI
@@ -1570,7 +3334,7 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
             # The AI MUST call a tool - it cannot respond with just text
             response = client.chat.completions.create(
                 model=model,
-                messages=conversation,
+                messages=to_api_messages(conversation),
                 tools=tools,
                 tool_choice="required"
             )
@@ -1628,8 +3392,7 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
                         if session_doc:
                             # Only save user messages and assistant final responses
                             # Skip system messages, tool calls, and tool responses to save space
-                            messages_to_save = extract_messages_for_storage(conversation)
-                            session_doc.messages = json.dumps(messages_to_save)
+                            store_conversation_messages(session_doc, conversation)
                             session_doc.model_used = model
                             session_doc.save(ignore_permissions=False)
                             frappe.db.commit()
@@ -1692,15 +3455,7 @@ def ask_openai_question(session_id: str, message: str) -> Dict[str, Any]:
 
         # Save conversation state for potential continuation
         if session_doc:
-            continuation_state = {
-                "conversation": conversation,
-                "tool_usage_log": tool_usage_log,
-                "iteration": iteration,
-                "created_at": frappe.utils.now()
-            }
-            session_doc.continuation_state = json.dumps(continuation_state, default=json_serial)
-            messages_to_save = extract_messages_for_storage(conversation)
-            session_doc.messages = json.dumps(messages_to_save)
+            save_continuation_state(session_doc, conversation, tool_usage_log, iteration)
             session_doc.model_used = model
             session_doc.save(ignore_permissions=False)
             frappe.db.commit()
@@ -1737,7 +3492,8 @@ def ask_openai_question_stream(session_id: str, message: str, csrf_token: str =
                 return
 
             # Check which provider to use
-            provider = get_api_provider()
+            settings = get_ai_settings()
+            provider = settings.provider
             tool_usage_log = []
 
             # Load conversation from database
@@ -1749,8 +3505,8 @@ def ask_openai_question_stream(session_id: str, message: str, csrf_token: str =
                     yield sse_event("error", {"error": "You don't have permission to access this conversation"})
                     return
 
-                # Load existing messages
-                conversation = json.loads(session_doc.messages) if session_doc.messages else []
+                # Load existing messages (with the compacted prefix replaced by its summary)
+                conversation = load_conversation_history(session_doc)
 
                 # Add the new user message
                 conversation.append({"role": "user", "content": message})
@@ -1765,13 +3521,14 @@ def ask_openai_question_stream(session_id: str, message: str, csrf_token: str =
 
             # Add system instructions as the initial message if not present
             if not conversation or conversation[0].get("role") != "system":
-                conversation.insert(0, {"role": "system", "content": get_system_instructions()})
+                conversation.insert(0, {"role": "system", "content": get_system_instructions(settings)})
 
             # Get model settings
-            model, max_tokens = get_model_settings()
+            model, max_tokens = get_model_settings(settings)
 
-            # Trim conversation to stay within the token limit
-            conversation = trim_conversation_to_token_limit(conversation, max_tokens)
+            # Compact older turns into a summary, then trim to stay within the token limit
+            conversation = compact_conversation_history(session_doc, conversation, max_tokens, settings)
+            conversation = trim_conversation_to_token_limit(conversation, max_tokens, settings)
 
             logger.info(f"[SSE ROUTING] Provider='{provider}', Model='{model}'")
 
@@ -1791,38 +3548,22 @@ def ask_openai_question_stream(session_id: str, message: str, csrf_token: str =
                         claude_messages.append(msg)
 
                 if not system_prompt:
-                    system_prompt = get_system_instructions()
+                    system_prompt = get_system_instructions(settings)
 
                 # Use the streaming generator
                 yield from run_claude_agentic_loop_streaming(
                     client, model, system_prompt, claude_messages,
-                    tool_usage_log, session_doc, max_tokens
+                    tool_usage_log, session_doc, max_tokens, settings
                 )
 
             else:
-                # OpenAI doesn't have streaming agentic loop yet
-                # Fall back to non-streaming and yield events manually
-                yield sse_event("connected", {
-                    "session_id": session_id,
-                    "model": model,
-                    "fallback": True
-                })
-
-                try:
-                    # Call the existing non-streaming function
-                    result = ask_openai_question(session_id, message)
-
-                    if result.get("status") == "pending_confirmation":
-                        yield sse_event("pending_confirmation", result)
-                    elif result.get("status") == "limit_reached":
-                        yield sse_event("limit_reached", result)
-                    elif result.get("error"):
-                        yield sse_event("error", {"error": result.get("error")})
-                    else:
-                        yield sse_event("final_answer", result)
+                # Use OpenAI with streaming
+                client = get_openai_client()
 
-                except Exception as e:
-                    yield sse_event("error", {"error": str(e)})
+                yield from run_openai_agentic_loop_streaming(
+                    client, model, conversation,
+                    tool_usage_log, session_doc, max_tokens, settings
+                )
 
         except Exception as e:
             logger.error(f"SSE stream error: {str(e)}")
@@ -1906,13 +3647,13 @@ def test_connection() -> Dict[str, Any]:
     """
     try:
         # Get settings
-        settings = frappe.get_single("OpenAI Settings")
-        api_key = settings.get_password("api_key")
+        api_key = frappe.get_single("OpenAI Settings").get_password("api_key")
         if not api_key:
             return {"success": False, "message": _("API key is not set. Please enter an API key first.")}
 
-        provider = get_api_provider()
-        model, _max_tokens = get_model_settings()
+        settings = get_ai_settings()
+        provider = settings.provider
+        model, _max_tokens = get_model_settings(settings)
 
         if provider == "anthropic":
             # Test Anthropic/Claude connection
@@ -1986,7 +3727,6 @@ def create_conversation(title: str = None) -> Dict[str, Any]:
             "doctype": "AI Conversation",
             "title": title or "New Conversation",
             "status": "Active",
-            "messages": json.dumps([]),
             "message_count": 0,
             "model_used": model
         })
@@ -2049,11 +3789,17 @@ def list_conversations(status: str = "Active", limit: int = 20, offset: int = 0)
 
 
 @frappe.whitelist()
-def get_conversation(session_id: str) -> Dict[str, Any]:
+def get_conversation(session_id: str, cursor: str = None, limit: int = HISTORY_PAGE_SIZE) -> Dict[str, Any]:
     """
-    Get full conversation history by session ID.
+    Get a conversation by session ID with one page of its history.
+
+    Returns the newest `limit` messages; pass the returned `next_cursor` back as `cursor`
+    to get the page before them. Assistant messages carry a `tool_summary` instead of
+    their tool usage log, which get_message_tool_usage returns on demand.
 
     :param session_id: The conversation session ID
+    :param cursor: Opaque cursor from a previous page, None for the newest messages
+    :param limit: Messages per page (at most HISTORY_MAX_PAGE_SIZE)
     :return: Dictionary with conversation details and messages
     """
     try:
@@ -2063,17 +3809,18 @@ def get_conversation(session_id: str) -> Dict[str, Any]:
         if doc.owner != frappe.session.user and "System Manager" not in frappe.get_roles():
             frappe.throw("You don't have permission to access this conversation")
 
-        raw_messages = json.loads(doc.messages) if doc.messages else []
-
-        # Filter to only return user and assistant messages (no tool responses)
-        messages = extract_messages_for_storage(raw_messages)
+        # Stored user and assistant messages (tool traffic is never stored)
+        if doc.archive_file:
+            page = load_archived_message_page(doc, cursor, limit)
+        else:
+            page = load_message_page(doc.name, cursor, limit)
 
         # Check for continuation state (limit reached)
         continuation_state = None
         if doc.continuation_state:
             try:
-                continuation_state = json.loads(doc.continuation_state)
-            except json.JSONDecodeError:
+                continuation_state = decode_json(doc.continuation_state)
+            except ValueError:
                 continuation_state = None
 
         return {
@@ -2081,7 +3828,9 @@ def get_conversation(session_id: str) -> Dict[str, Any]:
             "session_id": doc.name,
             "title": doc.title,
             "status": doc.status,
-            "messages": messages,
+            "messages": page["messages"],
+            "has_more": page["has_more"],
+            "next_cursor": page["next_cursor"],
             "message_count": doc.message_count,
             "last_message_at": str(doc.last_message_at) if doc.last_message_at else None,
             "model_used": doc.model_used,
@@ -2095,6 +3844,43 @@ def get_conversation(session_id: str) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
 
 
+@frappe.whitelist()
+def get_message_tool_usage(session_id: str, seq: int) -> Dict[str, Any]:
+    """
+    Get the full tool usage log of one stored message, for the data access and
+    reasoning details the chat expands on demand.
+
+    :param session_id: The conversation session ID
+    :param seq: Sequence number of the message (from get_conversation)
+    :return: Dictionary with the message's tool usage entries
+    """
+    try:
+        conversation = frappe.db.get_value("AI Conversation", session_id, ["owner", "archive_file"], as_dict=True)
+        if conversation is None:
+            return {"success": False, "error": "Conversation not found"}
+
+        if conversation.owner != frappe.session.user and "System Manager" not in frappe.get_roles():
+            frappe.throw("You don't have permission to access this conversation")
+
+        if conversation.archive_file:
+            tool_usage = next(
+                (message.get("tool_usage") for message in load_archived_messages(conversation)
+                 if message["seq"] == frappe.utils.cint(seq)),
+                None
+            )
+        else:
+            tool_usage = decode_json(frappe.db.get_value(
+                MESSAGE_DOCTYPE,
+                {"conversation": session_id, "seq": frappe.utils.cint(seq)},
+                "tool_usage"
+            ))
+
+        return {"success": True, "seq": frappe.utils.cint(seq), "tool_usage": tool_usage or []}
+    except Exception as e:
+        frappe.log_error(message=str(e), title="Get Message Tool Usage Error")
+        return {"success": False, "error": str(e)}
+
+
 @frappe.whitelist()
 def update_conversation_title(session_id: str, title: str) -> Dict[str, Any]:
     """
@@ -2199,15 +3985,13 @@ def get_debug_data(session_id: str) -> Dict[str, Any]:
             "model": settings.model,
             "max_tokens": settings.max_tokens,
             "has_api_key": bool(settings.api_key),
-            "has_system_instructions": bool(settings.system_instructions)
+            "has_system_instructions": bool(settings.system_instructions),
+            "tools_hash": get_tool_registry().hash,
+            "tool_count": len(get_tool_registry().names)
         }
 
-        # Parse messages
-        messages = []
-        try:
-            messages = json.loads(doc.messages) if doc.messages else []
-        except json.JSONDecodeError as e:
-            messages = {"parse_error": str(e), "raw_length": len(doc.messages) if doc.messages else 0}
+        # Stored messages
+        messages = load_archived_messages(doc) if doc.archive_file else load_stored_messages(doc.name)
 
         # Extract tool usage from all messages
         tool_usage_summary = []
@@ -2220,12 +4004,20 @@ def get_debug_data(session_id: str) -> Dict[str, Any]:
                         "tools": [t.get('tool_name') for t in msg['tool_usage']]
                     })
 
+        # Parse token usage totals (includes prompt cache reads/writes for Claude)
+        token_usage = None
+        if doc.get("token_usage"):
+            try:
+                token_usage = json.loads(doc.token_usage)
+            except json.JSONDecodeError:
+                token_usage = {"parse_error": "Could not parse token usage"}
+
         # Get pending confirmation if any
         pending = None
         if doc.pending_confirmation:
             try:
-                pending = json.loads(doc.pending_confirmation)
-            except json.JSONDecodeError:
+                pending = decode_json(doc.pending_confirmation)
+            except ValueError:
                 pending = {"parse_error": "Could not parse pending confirmation"}
 
         return {
@@ -2242,6 +4034,7 @@ def get_debug_data(session_id: str) -> Dict[str, Any]:
             },
             "messages": messages,
             "tool_usage_summary": tool_usage_summary,
+            "token_usage": token_usage,
             "pending_confirmation": pending,
             "settings": settings_info,
             "system_info": {
@@ -2289,12 +4082,12 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
             return {"error": "No continuation state found", "tool_usage": []}
 
         try:
-            continuation_state = json.loads(session_doc.continuation_state)
-        except json.JSONDecodeError:
+            continuation_state = decode_json(session_doc.continuation_state)
+        except ValueError:
             return {"error": "Invalid continuation state data", "tool_usage": []}
 
         # Validate continuation_state structure
-        if not isinstance(continuation_state.get('conversation'), list):
+        if not isinstance(continuation_state.get('conversation_delta'), dict) and not isinstance(continuation_state.get('conversation'), list):
             return {"error": "Invalid continuation state: missing conversation", "tool_usage": []}
         if not isinstance(continuation_state.get('tool_usage_log'), list):
             continuation_state['tool_usage_log'] = []  # Default to empty list
@@ -2321,7 +4114,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
             }
 
         # action == "continue" - resume the agentic loop
-        conversation = continuation_state.get('conversation', [])
+        conversation = load_paused_conversation(session_doc, continuation_state)
         tool_usage_log = continuation_state.get('tool_usage_log', [])
         previous_iteration = continuation_state.get('iteration', 0)
 
@@ -2331,8 +4124,9 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
         frappe.db.commit()
 
         # Get provider and continue with appropriate loop
-        provider = get_api_provider()
-        model, max_tokens = get_model_settings()
+        settings = get_ai_settings()
+        provider = settings.provider
+        model, max_tokens = get_model_settings(settings)
 
         if provider == "anthropic":
             client = get_anthropic_client()
@@ -2347,7 +4141,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
                     claude_messages.append(msg)
 
             if not system_prompt:
-                system_prompt = get_system_instructions()
+                system_prompt = get_system_instructions(settings)
 
             # Add a continuation hint
             claude_messages.append({
@@ -2357,7 +4151,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
 
             return run_claude_agentic_loop(
                 client, model, system_prompt, claude_messages,
-                tool_usage_log, session_doc, max_tokens
+                tool_usage_log, session_doc, max_tokens, settings
             )
         else:
             # OpenAI continuation
@@ -2379,7 +4173,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
 
                 response = client.chat.completions.create(
                     model=model,
-                    messages=conversation,
+                    messages=to_api_messages(conversation),
                     tools=tools,
                     tool_choice="required"
                 )
@@ -2422,8 +4216,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
                             }
                             conversation.append(assistant_message)
 
-                            messages_to_save = extract_messages_for_storage(conversation)
-                            session_doc.messages = json.dumps(messages_to_save)
+                            store_conversation_messages(session_doc, conversation)
                             session_doc.model_used = model
                             session_doc.save(ignore_permissions=False)
                             frappe.db.commit()
@@ -2474,15 +4267,7 @@ def continue_from_limit(session_id: str, action: str = "continue") -> Dict[str,
                 "total_tool_calls": len(tool_usage_log)
             }
 
-            continuation_state = {
-                "conversation": conversation,
-                "tool_usage_log": tool_usage_log,
-                "iteration": previous_iteration + iteration,
-                "created_at": frappe.utils.now()
-            }
-            session_doc.continuation_state = json.dumps(continuation_state, default=json_serial)
-            messages_to_save = extract_messages_for_storage(conversation)
-            session_doc.messages = json.dumps(messages_to_save)
+            save_continuation_state(session_doc, conversation, tool_usage_log, previous_iteration + iteration)
             session_doc.model_used = model
             session_doc.save(ignore_permissions=False)
             frappe.db.commit()
@@ -2534,10 +4319,10 @@ def confirm_write_operation(session_id: str, action: str, user_message: str = No
         if not session_doc.pending_confirmation:
             return {"error": "No pending confirmation found for this session", "tool_usage": []}
 
-        pending = json.loads(session_doc.pending_confirmation)
+        pending = decode_json(session_doc.pending_confirmation)
         tool_name = pending.get('tool_name')
         tool_args = pending.get('parameters', {})
-        conversation = pending.get('conversation_state', [])
+        conversation = load_paused_conversation(session_doc, pending, legacy_key='conversation_state')
         tool_usage_log = pending.get('tool_usage_log', [])
         tool_call_id = pending.get('tool_call_id')
 
@@ -2548,7 +4333,7 @@ def confirm_write_operation(session_id: str, action: str, user_message: str = No
 
         if action == "accept":
             # Execute the write operation
-            function_to_call = available_functions.get(tool_name)
+            function_to_call = get_tool_registry().functions.get(tool_name)
             if not function_to_call:
                 return {"error": f"Function {tool_name} not found", "tool_usage": tool_usage_log}
 
@@ -2710,12 +4495,13 @@ def _continue_agentic_loop(session_doc, conversation: List[Dict[str, Any]], tool
     """
     try:
         client = get_openai_client()
-        model, max_tokens = get_model_settings()
+        settings = get_ai_settings()
+        model, max_tokens = get_model_settings(settings)
         tools = get_tools()
 
         # Add system instructions if not present
         if not conversation or conversation[0].get("role") != "system":
-            conversation.insert(0, {"role": "system", "content": get_system_instructions()})
+            conversation.insert(0, {"role": "system", "content": get_system_instructions(settings)})
 
         # Trim conversation
         conversation = trim_conversation_to_token_limit(conversation, max_tokens)
@@ -2728,7 +4514,7 @@ def _continue_agentic_loop(session_doc, conversation: List[Dict[str, Any]], tool
 
             response = client.chat.completions.create(
                 model=model,
-                messages=conversation,
+                messages=to_api_messages(conversation),
                 tools=tools,
                 tool_choice="required"
             )
@@ -2779,8 +4565,7 @@ def _continue_agentic_loop(session_doc, conversation: List[Dict[str, Any]], tool
                         conversation.append(assistant_message)
 
                         # Save conversation
-                        messages_to_save = extract_messages_for_storage(conversation)
-                        session_doc.messages = json.dumps(messages_to_save)
+                        store_conversation_messages(session_doc, conversation)
                         session_doc.model_used = model
                         session_doc.save(ignore_permissions=False)
                         frappe.db.commit()
@@ -2831,8 +4616,7 @@ def _continue_agentic_loop(session_doc, conversation: List[Dict[str, Any]], tool
             "tool_usage": tool_usage_log
         })
 
-        messages_to_save = extract_messages_for_storage(conversation)
-        session_doc.messages = json.dumps(messages_to_save)
+        store_conversation_messages(session_doc, conversation)
         session_doc.model_used = model
         session_doc.save(ignore_permissions=False)
         frappe.db.commit()
@@ -2870,7 +4654,7 @@ def get_pending_confirmation(session_id: str) -> Dict[str, Any]:
             frappe.throw("You don't have permission to access this conversation")
 
         if session_doc.pending_confirmation:
-            pending = json.loads(session_doc.pending_confirmation)
+            pending = decode_json(session_doc.pending_confirmation)
             return {
                 "pending_confirmation": {
                     "tool_name": pending.get('tool_name'),
@@ -0,0 +1,435 @@
+"""
+Micro-benchmarks for hot paths of the AI assistant.
+
+Run on a bench:
+    bench --site <site> execute erpnext_chatgpt.erpnext_chatgpt.benchmarks.benchmark_entity_scoring
+    bench --site <site> execute erpnext_chatgpt.erpnext_chatgpt.benchmarks.benchmark_delivery_note_serials
+    bench --site <site> execute erpnext_chatgpt.erpnext_chatgpt.benchmarks.benchmark_storage_codec
+
+Benchmarks that do not touch the database can also run without a site:
+    python -m erpnext_chatgpt.erpnext_chatgpt.benchmarks
+"""
+import json
+import os
+import random
+import string
+import time
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+
+import frappe
+
+from erpnext_chatgpt.erpnext_chatgpt import entity_scoring, storage_codec
+
+
+def _timed(function, repeat):
+    """Best wall time of `repeat` runs, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _print_table(title, header, rows):
+    print(title)
+    print("  ".join(f"{column:>14}" for column in header))
+    for row in rows:
+        print("  ".join(f"{value:>14}" for value in row))
+
+
+# =============================================================================
+# Entity Scoring
+# =============================================================================
+
+def _legacy_score_candidates(search_term, labels, ids):
+    """The per-candidate Stage 2 scorer lookup_entity used before batching (reference only)."""
+    search_lower = search_term.lower().replace(' ', '').replace('-', '')
+    scores = []
+    for label, entity_id in zip(labels, ids):
+        name_value = (label or entity_id or '').lower()
+        name_compact = name_value.replace(' ', '').replace('-', '')
+
+        candidate_scores = []
+        if search_term.lower() == name_value:
+            candidate_scores.append(100)
+        if search_lower in name_compact:
+            candidate_scores.append(95)
+        elif name_compact in search_lower:
+            candidate_scores.append(90)
+        if search_lower in name_compact or name_compact.startswith(search_lower):
+            candidate_scores.append(88)
+        candidate_scores.append(int(SequenceMatcher(None, search_lower, name_compact).ratio() * 100))
+        id_lower = (entity_id or '').lower().replace(' ', '').replace('-', '')
+        if search_lower in id_lower or id_lower in search_lower:
+            candidate_scores.append(85)
+
+        scores.append(max(candidate_scores))
+    return scores
+
+
+def _synthetic_entities(count, seed=42):
+    """Company-like names with IDs, deterministic for a given seed."""
+    rng = random.Random(seed)
+    suffixes = ['AG', 'GmbH', 'SA', 'Sarl', 'Ltd', 'Verband', 'Holding', '']
+    labels, ids = [], []
+    for i in range(count):
+        words = [
+            ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))).capitalize()
+            for _ in range(rng.randint(1, 3))
+        ]
+        labels.append(' '.join(words + [rng.choice(suffixes)]).strip())
+        ids.append(f"CUST-{i:06d}")
+    return labels, ids
+
+
+def check_scoring_parity(size=10000, search_terms=("swissski verband", "jonh smith", "Иванов", "東京")):
+    """
+    Compare the numpy and pure-Python fuzzy scores (both set-based trigram cosine) on
+    the same candidates. Hashing can merge two trigrams into one bucket, so a few
+    scores may differ; more than a handful of mismatches points at a divergence of the paths.
+
+    :return: {"compared", "mismatches", "max_difference"}
+    """
+    if entity_scoring.np is None:
+        print("Scoring parity: numpy is not installed, nothing to compare")
+        return None
+
+    labels, _ = _synthetic_entities(size)
+    labels += ["John Smith", "Jonh Smyth", "Иванов Иван", "Петров", "東京株式会社", "Müller AG"]
+    normalized_labels = [entity_scoring.normalize_entity_text(label) for label in labels]
+
+    compared = mismatches = max_difference = 0
+    for search_term in search_terms:
+        search = entity_scoring.normalize_entity_text(search_term)
+        numpy_scores = entity_scoring._fuzzy_scores_numpy(search, normalized_labels).tolist()
+        python_scores = entity_scoring._fuzzy_scores_python(search, normalized_labels)
+        differences = [abs(a - b) for a, b in zip(numpy_scores, python_scores)]
+        compared += len(differences)
+        mismatches += sum(1 for difference in differences if difference)
+        max_difference = max(max_difference, max(differences))
+
+    print(f"Scoring parity: {mismatches} of {compared} scores differ, by at most {max_difference}")
+    return {"compared": compared, "mismatches": mismatches, "max_difference": max_difference}
+
+
+def benchmark_entity_scoring(sizes=(1000, 10000, 100000), repeat=3, search_term="swissski verband"):
+    """
+    Compare the legacy per-candidate SequenceMatcher scorer with the batched scorer
+    (raw labels, and labels pre-normalized as the trigram index stores them).
+    """
+    rows = []
+    results = []
+    for size in sizes:
+        labels, ids = _synthetic_entities(size)
+        normalized_labels = [entity_scoring.normalize_entity_text(label) for label in labels]
+
+        legacy_ms = _timed(lambda: _legacy_score_candidates(search_term, labels, ids), repeat)
+        batched_ms = _timed(lambda: entity_scoring.score_candidates(search_term, labels, ids), repeat)
+        prenormalized_ms = _timed(
+            lambda: entity_scoring.score_candidates(search_term, normalized_labels, normalized=True),
+            repeat
+        )
+
+        results.append({
+            "candidates": size,
+            "legacy_ms": round(legacy_ms, 2),
+            "batched_ms": round(batched_ms, 2),
+            "prenormalized_ms": round(prenormalized_ms, 2),
+            "speedup": round(legacy_ms / prenormalized_ms, 1) if prenormalized_ms else None
+        })
+        rows.append((size, f"{legacy_ms:.1f}", f"{batched_ms:.1f}", f"{prenormalized_ms:.1f}",
+                     f"{legacy_ms / prenormalized_ms:.1f}x" if prenormalized_ms else "-"))
+
+    backend = "numpy" if entity_scoring.np is not None else "pure python"
+    _print_table(
+        f"Entity scoring ({backend}), best of {repeat}, ms",
+        ("candidates", "legacy", "batched", "prenormalized", "speedup"),
+        rows
+    )
+    check_scoring_parity()
+    return results
+
+
+# =============================================================================
+# Delivery Note Serials
+# =============================================================================
+
+class _SimulatedDatabase:
+    """
+    Stand-in for frappe.db serving one synthetic delivery note (Delivery Note, its items,
+    Stock Ledger Entries and Serial and Batch Entries) from memory. Every query costs a
+    fixed round-trip time, so query-count regressions show up as wall time without
+    needing stock data. Only the calls get_delivery_note makes are supported.
+    """
+
+    def __init__(self, delivery_note, items, stock_entries, entries_by_bundle, round_trip_ms):
+        self.delivery_note = delivery_note
+        self.items = items
+        self.stock_entries = stock_entries
+        self.entries_by_bundle = entries_by_bundle
+        self.round_trip = round_trip_ms / 1000
+        self.queries = 0
+
+    def _query(self):
+        self.queries += 1
+        time.sleep(self.round_trip)
+
+    def get_value(self, doctype, filters=None, fieldname=None, as_dict=False, **kwargs):
+        self._query()
+        if doctype == 'Delivery Note' and filters == self.delivery_note['name']:
+            return frappe._dict(self.delivery_note)
+        return None
+
+    def get_all(self, doctype, filters=None, fields=None, order_by=None, **kwargs):
+        self._query()
+        if doctype == 'Delivery Note Item':
+            return [frappe._dict(item) for item in self.items]
+        if doctype == 'Stock Ledger Entry':
+            return [frappe._dict(entry) for entry in self.stock_entries]
+        if doctype == 'Serial and Batch Entry':
+            parent = filters['parent']
+            bundle_names = parent[1] if isinstance(parent, list) else [parent]
+            return [
+                frappe._dict(entry)
+                for name in bundle_names
+                for entry in self.entries_by_bundle.get(name, [])
+            ]
+        raise NotImplementedError(f"_SimulatedDatabase does not serve {doctype}")
+
+
+@contextmanager
+def _patched_database(database):
+    """Make frappe.db point at `database` for the duration of the block."""
+    previous = getattr(frappe.local, 'db', None)
+    frappe.local.db = database
+    try:
+        yield database
+    finally:
+        frappe.local.db = previous
+
+
+def _synthetic_delivery_note(lines, serials_per_line=2, ledger_only_every=25):
+    """
+    Header, line items, Stock Ledger Entries and bundle entries of a serialised delivery note.
+    Every `ledger_only_every`-th line has no bundle of its own and relies on the SLE fallback.
+    """
+    delivery_note = {'name': 'MAT-DN-BENCH-00001', 'customer': 'Benchmark Customer', 'docstatus': 1}
+    items, stock_entries, entries_by_bundle = [], [], {}
+    for line in range(lines):
+        bundle = f"SABB-{line:05d}"
+        item_code = f"ITEM-{line % 50:03d}" if line % ledger_only_every else f"LEDGER-ITEM-{line:05d}"
+        entries_by_bundle[bundle] = [
+            {'parent': bundle, 'serial_no': f"SN-{line:05d}-{n}", 'qty': -1}
+            for n in range(serials_per_line)
+        ]
+        items.append({
+            'parent': delivery_note['name'],
+            'idx': line + 1,
+            'item_code': item_code,
+            'warehouse': 'Stores - X',
+            'serial_and_batch_bundle': bundle if line % ledger_only_every else None
+        })
+        stock_entries.append({
+            'item_code': item_code,
+            'serial_and_batch_bundle': bundle,
+            'actual_qty': -serials_per_line,
+            'warehouse': 'Stores - X'
+        })
+    return delivery_note, items, stock_entries, entries_by_bundle
+
+
+def _legacy_get_delivery_note(delivery_note_number):
+    """get_delivery_note as it was before batching, with one query per bundle (reference only)."""
+    delivery_note = frappe.db.get_value('Delivery Note', delivery_note_number, ['*'], as_dict=True)
+    items = frappe.db.get_all('Delivery Note Item', filters={'parent': delivery_note_number}, fields=['*'])
+
+    serial_numbers_by_item = {}
+    for item in items:
+        if item.get('serial_and_batch_bundle'):
+            serials = frappe.db.get_all(
+                'Serial and Batch Entry',
+                filters={'parent': item['serial_and_batch_bundle']},
+                fields=['serial_no', 'qty']
+            )
+            if serials:
+                serial_numbers_by_item.setdefault(item['item_code'], []).extend(
+                    {'serial_no': s.serial_no, 'qty': abs(s.qty), 'warehouse': item.get('warehouse', '')}
+                    for s in serials
+                )
+
+    stock_entries = frappe.db.get_all(
+        'Stock Ledger Entry',
+        filters={'voucher_no': delivery_note_number, 'voucher_type': 'Delivery Note'},
+        fields=['item_code', 'serial_and_batch_bundle', 'actual_qty', 'warehouse']
+    )
+    for entry in stock_entries:
+        if entry.serial_and_batch_bundle and entry.item_code not in serial_numbers_by_item:
+            serials = frappe.db.get_all(
+                'Serial and Batch Entry',
+                filters={'parent': entry.serial_and_batch_bundle},
+                fields=['serial_no', 'qty']
+            )
+            serial_numbers_by_item.setdefault(entry.item_code, []).extend(
+                {'serial_no': s.serial_no, 'qty': abs(s.qty), 'warehouse': entry.warehouse}
+                for s in serials
+            )
+
+    for item in items:
+        if item['item_code'] in serial_numbers_by_item:
+            item['serial_numbers'] = serial_numbers_by_item[item['item_code']]
+    delivery_note['items'] = items
+    delivery_note['total_serialized_items'] = len(serial_numbers_by_item)
+    delivery_note['all_serial_numbers'] = list({s['serial_no'] for serials in serial_numbers_by_item.values() for s in serials})
+    return json.dumps(delivery_note, default=str)
+
+
+def _serials_summary(delivery_note_json):
+    """What the serial resolution of a get_delivery_note response amounts to, for comparison."""
+    delivery_note = json.loads(delivery_note_json)
+    return {
+        'all_serial_numbers': sorted(delivery_note['all_serial_numbers']),
+        'total_serialized_items': delivery_note['total_serialized_items'],
+        'serials_per_line': [
+            sorted(s['serial_no'] for s in item.get('serial_numbers', []))
+            for item in delivery_note['items']
+        ]
+    }
+
+
+def benchmark_delivery_note_serials(lines=500, round_trip_ms=0.5, repeat=3):
+    """
+    Compare get_delivery_note with its per-bundle predecessor on a synthetic delivery
+    note, counting queries and wall time. Both run unchanged against frappe.db, which is
+    pointed at a _SimulatedDatabase for the benchmark.
+    """
+    from erpnext_chatgpt.erpnext_chatgpt.tools import get_delivery_note
+
+    delivery_note, items, stock_entries, entries_by_bundle = _synthetic_delivery_note(lines)
+    name = delivery_note['name']
+
+    def run(function):
+        database = _SimulatedDatabase(delivery_note, items, stock_entries, entries_by_bundle, round_trip_ms)
+        with _patched_database(database):
+            elapsed_ms = _timed(lambda: function(name), repeat)
+            response = function(name)
+        return elapsed_ms, database.queries // (repeat + 1), response
+
+    legacy_ms, legacy_queries, legacy_response = run(_legacy_get_delivery_note)
+    batched_ms, batched_queries, batched_response = run(get_delivery_note)
+
+    result = {
+        'lines': lines,
+        'legacy_queries': legacy_queries,
+        'batched_queries': batched_queries,
+        'legacy_ms': round(legacy_ms, 2),
+        'batched_ms': round(batched_ms, 2),
+        'same_serials': _serials_summary(legacy_response) == _serials_summary(batched_response)
+    }
+    _print_table(
+        f"get_delivery_note serials, {lines} lines, {round_trip_ms} ms per query, best of {repeat}",
+        ("queries", "legacy ms", "batched", "batched ms", "same serials"),
+        [(legacy_queries, f"{legacy_ms:.1f}", batched_queries, f"{batched_ms:.1f}", str(result['same_serials']))]
+    )
+    return result
+
+
+# =============================================================================
+# Storage Codec
+# =============================================================================
+
+def _exported_payloads(paths):
+    """
+    Values that would go into the compressed columns, from debug logs downloaded in the
+    chat ("Download debug log"): each message's tool usage and content blocks, and the
+    pending confirmation. Directories are searched for *.json files.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")))
+        else:
+            files.append(path)
+
+    payloads = []
+    for file_path in files:
+        with open(file_path) as export_file:
+            export = json.load(export_file)
+        session = export.get("server_session") or {}
+        messages = session.get("messages") or (export.get("conversation") or {}).get("local_cache") or []
+        for message in messages:
+            if message.get("tool_usage"):
+                payloads.append(message["tool_usage"])
+            if isinstance(message.get("content"), list):
+                payloads.append(message["content"])
+        if session.get("pending_confirmation"):
+            payloads.append(session["pending_confirmation"])
+    return payloads
+
+
+def _stored_payloads(limit):
+    """Tool usage and content blocks of the newest stored messages of the current site."""
+    import frappe
+
+    rows = frappe.db.get_all(
+        "AI Conversation Message",
+        or_filters={"tool_usage": ["is", "set"], "content_blocks": ["is", "set"]},
+        fields=["tool_usage", "content_blocks"],
+        order_by="creation desc",
+        limit_page_length=limit
+    )
+    return [
+        storage_codec.decode_json(row[field])
+        for row in rows
+        for field in ("tool_usage", "content_blocks")
+        if row[field]
+    ]
+
+
+def benchmark_storage_codec(paths=(), limit=500, repeat=3):
+    """
+    Compare stored size and encode/decode CPU time of plain JSON, zlib and zstd (if
+    installed) on real conversation payloads: the given debug log exports, or without
+    paths the newest `limit` stored messages of the site.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    payloads = _exported_payloads(paths) if paths else _stored_payloads(limit)
+    if not payloads:
+        print("No conversation payloads found")
+        return []
+
+    codecs = [None, "zlib"] + (["zstd"] if storage_codec.zstandard is not None else [])
+    plain_bytes = sum(len(storage_codec.encode_json(payload, default=str)) for payload in payloads)
+
+    rows = []
+    results = []
+    for codec in codecs:
+        encoded = [storage_codec.encode_json(payload, codec, default=str) for payload in payloads]
+        stored_bytes = sum(len(text) for text in encoded)
+        encode_ms = _timed(lambda: [storage_codec.encode_json(payload, codec, default=str) for payload in payloads], repeat)
+        decode_ms = _timed(lambda: [storage_codec.decode_json(text) for text in encoded], repeat)
+
+        results.append({
+            "codec": codec or "plain",
+            "payloads": len(payloads),
+            "bytes": stored_bytes,
+            "ratio": round(plain_bytes / stored_bytes, 2) if stored_bytes else None,
+            "encode_ms": round(encode_ms, 2),
+            "decode_ms": round(decode_ms, 2)
+        })
+        rows.append((codec or "plain", stored_bytes, f"{plain_bytes / stored_bytes:.2f}x" if stored_bytes else "-",
+                     f"{encode_ms:.1f}", f"{decode_ms:.1f}"))
+
+    _print_table(
+        f"Storage codec, {len(payloads)} payloads ({plain_bytes} bytes as JSON), best of {repeat}, ms",
+        ("codec", "bytes", "ratio", "encode ms", "decode ms"),
+        rows
+    )
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_entity_scoring()
@@ -6,24 +6,18 @@ from frappe.model.document import Document
 
 
 class AIConversation(Document):
-    def before_save(self):
-        # Update message count from messages array
-        if self.messages:
-            import json
-            try:
-                messages = json.loads(self.messages) if isinstance(self.messages, str) else self.messages
-                # Count only user and assistant messages (not system or tool messages)
-                self.message_count = sum(
-                    1 for msg in messages
-                    if isinstance(msg, dict) and msg.get('role') in ['user', 'assistant']
-                )
-            except (json.JSONDecodeError, TypeError):
-                pass
-
-        # Update last_message_at timestamp
-        self.last_message_at = frappe.utils.now()
+    # message_count and last_message_at are counters advanced when messages are
+    # appended to the AI Conversation Message log (api.append_conversation_messages)
 
     def validate(self):
         # Ensure users can only access their own conversations
         if not frappe.has_permission("AI Conversation", "write", doc=self):
             frappe.throw("You don't have permission to modify this conversation")
+
+    def on_trash(self):
+        frappe.db.delete("AI Conversation Message", {"conversation": self.name})
+
+
+def on_doctype_update():
+    # list_conversations filters on owner and status and sorts by modified
+    frappe.db.add_index("AI Conversation", ["owner", "status", "modified"])
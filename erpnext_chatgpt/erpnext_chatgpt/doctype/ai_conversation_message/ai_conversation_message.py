@@ -0,0 +1,21 @@
+# Copyright (c) 2025, William Luke and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class AIConversationMessage(Document):
+    """
+    One stored user or assistant message of an AI Conversation. Rows are only ever
+    appended (see api.append_conversation_messages), so saving a turn does not
+    rewrite earlier history.
+    """
+
+    pass
+
+
+def on_doctype_update():
+    # History is always read by conversation in sequence order; unique so overlapping
+    # requests on one conversation can never store two messages with the same seq
+    frappe.db.add_unique("AI Conversation Message", ["conversation", "seq"], constraint_name="unique_conversation_seq")
@@ -3,4 +3,22 @@ from frappe.model.document import Document
 
 
 class OpenAISettings(Document):
-    pass
+    def validate(self):
+        if self.archive_after_days and self.delete_after_days and self.delete_after_days <= self.archive_after_days:
+            frappe.throw("Delete After (Days) must be longer than Move to Cold Storage After (Days)")
+
+    def on_update(self):
+        from erpnext_chatgpt.erpnext_chatgpt.api import clear_ai_settings_cache, invalidate_client_pool
+
+        # Cached settings snapshot and pooled provider clients hold the old values
+        clear_ai_settings_cache()
+        invalidate_client_pool()
+
+        # Re-encode stored conversations with the new codec
+        if self.has_value_changed("storage_codec"):
+            frappe.enqueue(
+                "erpnext_chatgpt.erpnext_chatgpt.api.migrate_conversation_storage",
+                queue="long",
+                timeout=3600,
+                enqueue_after_commit=True
+            )
@@ -0,0 +1,117 @@
+"""
+Shared cache of lookup_entity results.
+
+The same informal names are resolved again in almost every conversation, so
+results are cached per entity DocType in one Redis hash. Entries are keyed by
+permission scope, the lookup tool (lookup_entity or lookup_entities, which match
+differently), its options and the normalized search term. Entries
+expire after LOOKUP_CACHE_TTL. Past LOOKUP_CACHE_MAX_ENTRIES, the least
+recently used entries are evicted. The entity doc_events (see entity_index)
+drop the whole hash of a DocType when one of its masters changes.
+"""
+import hashlib
+import json
+import logging
+import time
+from functools import partial
+
+import frappe
+
+from erpnext_chatgpt.erpnext_chatgpt.entity_scoring import normalize_entity_text
+
+# Initialize module-level logger with aiassistant namespace
+logger = frappe.logger("aiassistant", allow_site=True)
+logger.setLevel(logging.DEBUG)
+
+
+# One hash per DocType (frappe.cache() already namespaces keys by site)
+LOOKUP_CACHE_KEY = "erpnext_chatgpt:entity_lookup:v2:{doctype}"
+LOOKUP_CACHE_TTL = 24 * 60 * 60
+LOOKUP_CACHE_MAX_ENTRIES = 1000
+# Share of entries kept when the LRU evicts
+LOOKUP_CACHE_EVICT_TO = 0.8
+# Hits only rewrite last_used when it is older than this, to keep hits read-only
+LOOKUP_CACHE_TOUCH_INTERVAL = 300
+
+
+def _cache_key(doctype):
+    return LOOKUP_CACHE_KEY.format(doctype=doctype)
+
+
+def _permission_scope(user=None):
+    """
+    Hash of what decides which entities a user can see: their roles and user
+    permissions. Users with the same scope share cache entries.
+    """
+    from frappe.core.doctype.user_permission.user_permission import get_user_permissions
+
+    user = user or frappe.session.user
+    payload = json.dumps(
+        [sorted(frappe.get_roles(user)), get_user_permissions(user)],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def _entry_field(search_term, limit, fuzzy_rerank, source):
+    normalized = normalize_entity_text(search_term)
+    if not normalized:
+        return None
+    return f"{_permission_scope()}:{source}:{limit}:{int(bool(fuzzy_rerank))}:{normalized}"
+
+
+def get_cached_lookup(doctype, search_term, limit, fuzzy_rerank, source='lookup_entity'):
+    """Return the cached JSON result of `source` for this user's scope, or None on a miss."""
+    field = _entry_field(search_term, limit, fuzzy_rerank, source)
+    if not field:
+        return None
+
+    cache = frappe.cache()
+    entry = cache.hget(_cache_key(doctype), field)
+    if not entry:
+        return None
+
+    now = time.time()
+    if now - entry['stored_at'] > LOOKUP_CACHE_TTL:
+        cache.hdel(_cache_key(doctype), field)
+        return None
+
+    if now - entry['last_used'] > LOOKUP_CACHE_TOUCH_INTERVAL:
+        cache.hset(_cache_key(doctype), field, {**entry, 'last_used': now})
+
+    logger.debug(f"entity_cache: hit for '{search_term}' in {doctype}")
+    return entry['result']
+
+
+def set_cached_lookup(doctype, search_term, limit, fuzzy_rerank, result, source='lookup_entity'):
+    """Store a JSON result of `source`, evicting least recently used entries if full."""
+    field = _entry_field(search_term, limit, fuzzy_rerank, source)
+    if not field:
+        return
+
+    cache = frappe.cache()
+    key = _cache_key(doctype)
+    now = time.time()
+    cache.hset(key, field, {'result': result, 'stored_at': now, 'last_used': now})
+
+    fields = cache.hkeys(key)
+    if len(fields) > LOOKUP_CACHE_MAX_ENTRIES:
+        entries = cache.hgetall(key)
+        by_age = sorted(entries.items(), key=lambda item: item[1]['last_used'])
+        evict = len(by_age) - int(LOOKUP_CACHE_MAX_ENTRIES * LOOKUP_CACHE_EVICT_TO)
+        for entry_field, _ in by_age[:evict]:
+            cache.hdel(key, entry_field.decode() if isinstance(entry_field, bytes) else entry_field)
+        logger.debug(f"entity_cache: evicted {evict} {doctype} entries")
+
+
+def invalidate_lookup_cache(doctype):
+    """
+    Drop every cached lookup for a DocType once the transaction commits. Dropped
+    earlier, a concurrent lookup could still read the old row and cache it again.
+    """
+    frappe.db.after_commit.add(partial(_drop_lookup_cache, doctype))
+
+
+def _drop_lookup_cache(doctype):
+    frappe.cache().delete_value(_cache_key(doctype))
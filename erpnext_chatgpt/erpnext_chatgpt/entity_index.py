@@ -0,0 +1,280 @@
+import frappe
+import logging
+import threading
+from collections import defaultdict
+from functools import partial
+
+from erpnext_chatgpt.erpnext_chatgpt.entity_cache import invalidate_lookup_cache
+from erpnext_chatgpt.erpnext_chatgpt.entity_scoring import normalize_entity_text, trigrams
+
+# Initialize module-level logger with aiassistant namespace
+logger = frappe.logger("aiassistant", allow_site=True)
+logger.setLevel(logging.DEBUG)
+
+
+# Map user-friendly entity types to DocTypes and their display fields
+# Only master data entities - not documents
+ENTITY_CONFIG = {
+    'customer': {
+        'doctype': 'Customer',
+        'display_field': 'customer_name',
+        'filters': {'disabled': 0}
+    },
+    'supplier': {
+        'doctype': 'Supplier',
+        'display_field': 'supplier_name',
+        'filters': {'disabled': 0}
+    },
+    'item': {
+        'doctype': 'Item',
+        'display_field': 'item_name',
+        'filters': {'disabled': 0}
+    },
+    'employee': {
+        'doctype': 'Employee',
+        'display_field': 'employee_name',
+        'filters': {'status': 'Active'}
+    },
+    'lead': {
+        'doctype': 'Lead',
+        'display_field': 'lead_name',
+        'filters': {}
+    },
+    'contact': {
+        'doctype': 'Contact',
+        'display_field': 'name',
+        'filters': {}
+    }
+}
+
+CONFIG_BY_DOCTYPE = {config['doctype']: config for config in ENTITY_CONFIG.values()}
+
+# Changed entity names are appended here by doc_events; every worker replays the
+# entries it has not applied yet. Past this length the log is reset and indexes rebuild.
+CHANGE_LOG_KEY = "erpnext_chatgpt:entity_index:{doctype}:changes"
+# Changes on every reset of the change log
+CHANGE_LOG_GENERATION_KEY = "erpnext_chatgpt:entity_index:{doctype}:generation"
+CHANGE_LOG_MAX_LENGTH = 5000
+
+# Rebuild an index once this share of its rows are stale (updated or deleted)
+TOMBSTONE_REBUILD_RATIO = 0.25
+
+# (site, doctype) -> TrigramIndex, per worker process
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class TrigramIndex:
+    """
+    Character-trigram index over the name and display field of one entity DocType.
+
+    Rows are only ever appended; an update appends a new row and marks the old one
+    stale, a delete only marks it stale. Postings therefore never need to be edited.
+    """
+
+    def __init__(self, doctype, display_field, filters):
+        self.doctype = doctype
+        self.display_field = display_field
+        self.filters = filters
+        self.names = []
+        self.labels = []
+        self.normalized = []
+        self.gram_counts = []
+        self.active = []
+        self.row_by_name = {}
+        self.postings = defaultdict(list)
+        self.stale_rows = 0
+        self.built = False
+        self.generation = None
+        self.applied_changes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.row_by_name)
+
+    def _fields(self):
+        return ['name', self.display_field] if self.display_field != 'name' else ['name']
+
+    def build(self):
+        """Load every matching row of the DocType."""
+        rows = frappe.db.get_all(self.doctype, filters=self.filters, fields=self._fields(), limit_page_length=0)
+        for row in rows:
+            self._add(row['name'], row.get(self.display_field) or row['name'])
+        self.built = True
+        logger.debug(f"entity_index: built {self.doctype} trigram index with {len(rows)} rows")
+
+    def _add(self, name, label):
+        row = len(self.names)
+        normalized_label = normalize_entity_text(label)
+        normalized_name = normalize_entity_text(name)
+        grams = trigrams(normalized_label) | trigrams(normalized_name)
+
+        self.names.append(name)
+        self.labels.append(label)
+        self.normalized.append(normalized_label)
+        self.gram_counts.append(len(grams))
+        self.active.append(True)
+        self.row_by_name[name] = row
+        for gram in grams:
+            self.postings[gram].append(row)
+
+    def _remove(self, name):
+        row = self.row_by_name.pop(name, None)
+        if row is not None:
+            self.active[row] = False
+            self.stale_rows += 1
+
+    def refresh(self, names):
+        """Re-read the given entity names from the database and update the index."""
+        names = list(dict.fromkeys(names))
+        rows = frappe.db.get_all(
+            self.doctype,
+            filters={**self.filters, 'name': ['in', names]},
+            fields=self._fields(),
+            limit_page_length=0
+        ) if names else []
+        found = {row['name']: row.get(self.display_field) or row['name'] for row in rows}
+
+        for name in names:
+            self._remove(name)
+            if name in found:
+                self._add(name, found[name])
+
+    def needs_rebuild(self):
+        return self.stale_rows > max(100, len(self.names) * TOMBSTONE_REBUILD_RATIO)
+
+    def search(self, search_term, limit=50):
+        """
+        Return up to `limit` (name, label, normalized_label, score) candidates over the
+        whole master, ranked by trigram Dice similarity (score 0-100).
+        """
+        query_grams = trigrams(normalize_entity_text(search_term))
+        if not query_grams:
+            return []
+
+        hits = defaultdict(int)
+        for gram in query_grams:
+            for row in self.postings.get(gram, ()):
+                hits[row] += 1
+
+        query_count = len(query_grams)
+        scored = [
+            (2.0 * count / (query_count + self.gram_counts[row]), row)
+            for row, count in hits.items()
+            if self.active[row]
+        ]
+        scored.sort(reverse=True)
+
+        return [
+            (self.names[row], self.labels[row], self.normalized[row], int(score * 100))
+            for score, row in scored[:limit]
+        ]
+
+
+def _change_log_key(doctype):
+    return CHANGE_LOG_KEY.format(doctype=doctype)
+
+
+def _change_log_generation_key(doctype):
+    return CHANGE_LOG_GENERATION_KEY.format(doctype=doctype)
+
+
+def get_entity_index(doctype):
+    """
+    Get the trigram index for an entity DocType on the current site, building it on
+    first use and replaying changes logged by other workers since the last call.
+    """
+    config = CONFIG_BY_DOCTYPE[doctype]
+    key = (frappe.local.site, doctype)
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = TrigramIndex(doctype, config['display_field'], config['filters'])
+            _indexes[key] = index
+
+    cache = frappe.cache()
+    log_key = _change_log_key(doctype)
+
+    with index.lock:
+        generation = cache.get_value(_change_log_generation_key(doctype))
+        log_length = cache.llen(log_key)
+
+        if not index.built or generation != index.generation or index.needs_rebuild():
+            # First use, change log was reset, or too many stale rows
+            fresh = TrigramIndex(doctype, config['display_field'], config['filters'])
+            fresh.build()
+            fresh.generation = generation
+            fresh.applied_changes = log_length
+            with _indexes_lock:
+                _indexes[key] = fresh
+            return fresh
+
+        if log_length > index.applied_changes:
+            changed = [
+                name.decode() if isinstance(name, bytes) else name
+                for name in cache.lrange(log_key, index.applied_changes, log_length - 1)
+            ]
+            index.refresh(changed)
+            index.applied_changes = log_length
+
+    return index
+
+
+def _log_entity_changes(doctype, names):
+    """
+    Append changed names to the change log once the transaction commits. Logged
+    earlier, another worker could replay the entry and re-read the old row before the
+    change is visible, and would never read it again. Nothing is logged on rollback.
+    """
+    if doctype not in CONFIG_BY_DOCTYPE:
+        return
+    frappe.db.after_commit.add(partial(_push_entity_changes, doctype, list(names)))
+
+
+def _push_entity_changes(doctype, names):
+
+    cache = frappe.cache()
+    log_key = _change_log_key(doctype)
+    for name in names:
+        cache.rpush(log_key, name)
+
+    if cache.llen(log_key) > CHANGE_LOG_MAX_LENGTH:
+        # Workers see a new generation and rebuild from the database
+        cache.delete_value(log_key)
+        cache.set_value(_change_log_generation_key(doctype), frappe.generate_hash(length=10))
+
+
+def _affects_lookups(doc, method):
+    """
+    Whether a save can change lookup results: inserts, deletes, and updates of the
+    display field or of a field the entity filters on (e.g. disabled, status).
+    """
+    if method != 'on_update':
+        return True
+
+    config = CONFIG_BY_DOCTYPE[doc.doctype]
+    before = doc.get_doc_before_save()
+    if before is None:
+        return True
+
+    return any(
+        before.get(field) != doc.get(field)
+        for field in [config['display_field'], *config['filters']]
+    )
+
+
+def on_entity_change(doc, method=None):
+    """doc_events hook (on_update, on_trash) for the entity DocTypes."""
+    if doc.doctype not in CONFIG_BY_DOCTYPE or not _affects_lookups(doc, method):
+        return
+    _log_entity_changes(doc.doctype, [doc.name])
+    invalidate_lookup_cache(doc.doctype)
+
+
+def on_entity_rename(doc, method=None, old=None, new=None, merge=False):
+    """doc_events hook (after_rename) for the entity DocTypes."""
+    if doc.doctype not in CONFIG_BY_DOCTYPE:
+        return
+    _log_entity_changes(doc.doctype, [name for name in (old, new or doc.name) if name])
+    invalidate_lookup_cache(doc.doctype)
@@ -0,0 +1,185 @@
+"""
+Batched similarity scoring for lookup_entity.
+
+Kept free of frappe imports so the scorer can be benchmarked outside a site
+(see benchmarks.benchmark_entity_scoring).
+"""
+import difflib
+import math
+import unicodedata
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the pure-Python path computes the same similarity without hashing
+    np = None
+
+
+# Rule scores, highest applicable wins (same scale as the original Stage 2 re-ranking)
+SCORE_EXACT = 100
+SCORE_SEARCH_IN_NAME = 95
+SCORE_NAME_IN_SEARCH = 90
+SCORE_ID_MATCH = 85
+
+# Hashed trigram vector width (2 ** bits) and candidates scored per matrix-vector product
+TRIGRAM_HASH_BITS = 16
+TRIGRAM_DIMENSIONS = 1 << TRIGRAM_HASH_BITS
+SCORING_CHUNK_ROWS = 16384
+
+# Best trigram matches re-scored with SequenceMatcher.ratio(), which tolerates typos
+# like "jonh smith" that break most of the trigrams of a short name
+FUZZY_RERANK_LIMIT = 50
+
+
+def normalize_entity_text(text):
+    """
+    NFKC-normalize, casefold and drop separators, so "Swiss-Ski" and "swiss ski" both
+    become "swissski". Accents on Latin letters are folded ("Müller" becomes "muller");
+    other scripts (Cyrillic, CJK, ...) are kept as they are.
+    """
+    decomposed = unicodedata.normalize('NFKD', unicodedata.normalize('NFKC', text or '').casefold())
+    kept = []
+    for char in decomposed:
+        if unicodedata.category(char).startswith('M'):
+            # Combining mark: drop accents on ASCII letters, keep the vowel signs etc. of other scripts
+            if kept and not kept[-1].isascii():
+                kept.append(char)
+        elif char.isalnum():
+            kept.append(char)
+    return unicodedata.normalize('NFKC', ''.join(kept))
+
+
+def trigrams(normalized):
+    """Character trigrams of a normalized string, padded so short strings still match."""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _rule_score(search, label, entity_id):
+    """Exact / containment / ID rules on normalized strings, 0 if none applies."""
+    if not search or not label:
+        return 0
+    if search == label:
+        return SCORE_EXACT
+    if search in label:
+        return SCORE_SEARCH_IN_NAME
+    if label in search:
+        return SCORE_NAME_IN_SEARCH
+    if entity_id and (search in entity_id or entity_id in search):
+        return SCORE_ID_MATCH
+    return 0
+
+
+def _trigram_buckets(strings):
+    """
+    Hashed trigram buckets for normalized strings, one row per string, built without a
+    Python loop over characters. Returns (buckets, unique) arrays of shape
+    (len(strings), width); each row is sorted and `unique` marks the first occurrence
+    of each bucket, so a repeated trigram counts once (set semantics, as in trigrams()).
+    Padding past the end of a string is sorted to the end as bucket TRIGRAM_DIMENSIONS.
+    """
+    padded = [f"  {s} " for s in strings]
+    width = max(3, max(len(p) for p in padded))
+    buffer = ''.join(p.ljust(width, '\0') for p in padded).encode('utf-32-le')
+    chars = np.frombuffer(buffer, dtype=np.uint32).reshape(len(strings), width).astype(np.uint64)
+
+    # Code points fit in 21 bits, so a trigram fits in one 63-bit code
+    codes = (chars[:, :-2] << np.uint64(42)) | (chars[:, 1:-1] << np.uint64(21)) | chars[:, 2:]
+    # Multiplicative (Fibonacci) hashing: the high bits of the product mix all three characters
+    buckets = (codes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(64 - TRIGRAM_HASH_BITS)
+    buckets = np.where(chars[:, 2:] != 0, buckets.astype(np.intp), TRIGRAM_DIMENSIONS)
+    buckets.sort(axis=1)
+
+    unique = buckets < TRIGRAM_DIMENSIONS
+    unique[:, 1:] &= buckets[:, 1:] != buckets[:, :-1]
+    return buckets, unique
+
+
+def _fuzzy_scores_numpy(search, labels):
+    """
+    Cosine similarity of trigram vectors. The query is a dense binary vector; each
+    chunk of candidates is scored with one sparse matrix-vector product (a gather
+    of query weights at the candidates' trigram buckets, summed per row).
+    """
+    query_buckets, query_unique = _trigram_buckets([search])
+    # One extra slot for the padding bucket, which never matches
+    query = np.zeros(TRIGRAM_DIMENSIONS + 1, dtype=np.float64)
+    query[query_buckets[query_unique]] = 1.0
+    query_norm = math.sqrt(query.sum())
+
+    scores = np.zeros(len(labels), dtype=np.float64)
+    if not query_norm:
+        return scores.astype(np.int32)
+
+    for start in range(0, len(labels), SCORING_CHUNK_ROWS):
+        buckets, unique = _trigram_buckets(labels[start:start + SCORING_CHUNK_ROWS])
+        dots = (query[buckets] * unique).sum(axis=1)
+        norms = np.sqrt(unique.sum(axis=1)) * query_norm
+        scores[start:start + len(buckets)] = np.minimum(dots / np.maximum(norms, 1.0), 1.0)
+
+    return np.rint(scores * 100).astype(np.int32)
+
+
+def _fuzzy_scores_python(search, labels):
+    """Cosine similarity of trigram sets, for installations without numpy."""
+    query = trigrams(search)
+    if not query:
+        return [0] * len(labels)
+
+    scores = []
+    for label in labels:
+        grams = trigrams(label)
+        shared = len(query & grams)
+        scores.append(round(100 * shared / math.sqrt(len(query) * len(grams))) if shared else 0)
+    return scores
+
+
+def _rerank_best(search, labels, fuzzy):
+    """
+    Raise the scores of the FUZZY_RERANK_LIMIT best trigram matches to their
+    SequenceMatcher ratio where that is higher. Modifies `fuzzy` in place.
+    """
+    ranked = sorted((i for i, score in enumerate(fuzzy) if score), key=fuzzy.__getitem__, reverse=True)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    # SequenceMatcher caches details about the second sequence, so that is the search term
+    matcher.set_seq2(search)
+    for i in ranked[:FUZZY_RERANK_LIMIT]:
+        matcher.set_seq1(labels[i])
+        fuzzy[i] = max(fuzzy[i], round(matcher.ratio() * 100))
+
+
+def score_candidates(search_term, labels, ids=None, normalized=False):
+    """
+    Score candidates against a search term on a 0-100 scale in one batched pass.
+
+    Each candidate gets the best of the exact/containment/ID rule scores and the
+    trigram cosine similarity of search term and label; the best trigram matches
+    are re-scored with SequenceMatcher (see _rerank_best). A search term that
+    normalizes to an empty string (e.g. only punctuation) scores 0 everywhere.
+
+    :param labels: Display names of the candidates
+    :param ids: Optional entity IDs (names), matched with SCORE_ID_MATCH
+    :param normalized: True if labels and ids are already normalize_entity_text() output
+    :return: List of int scores in candidate order
+    """
+    if not labels:
+        return []
+
+    search = normalize_entity_text(search_term)
+    if not search:
+        return [0] * len(labels)
+    if not normalized:
+        labels = [normalize_entity_text(label) for label in labels]
+        ids = [normalize_entity_text(entity_id) for entity_id in ids] if ids else None
+    if not ids:
+        ids = [''] * len(labels)
+
+    if np is not None:
+        fuzzy = _fuzzy_scores_numpy(search, labels).tolist()
+    else:
+        fuzzy = _fuzzy_scores_python(search, labels)
+    _rerank_best(search, labels, fuzzy)
+
+    return [
+        max(_rule_score(search, label, entity_id), fuzzy_score)
+        for label, entity_id, fuzzy_score in zip(labels, ids, fuzzy)
+    ]
@@ -0,0 +1,171 @@
+"""
+Retention of AI Conversations.
+
+A daily job (see hooks.scheduler_events) moves conversations without activity for
+`archive_after_days` (OpenAI Settings) to cold storage. Their messages go to a gzipped
+JSON file attached to the conversation, and their AI Conversation Message rows are
+deleted. Raw tool calls and results (Claude tool_use/tool_result messages) are not kept.
+Conversations without activity for `delete_after_days` are deleted with their file.
+
+Conversations are selected in batches of RETENTION_BATCH_SIZE and committed one at a
+time, so a run never holds locks for long. Past RETENTION_MAX_BATCHES batches the rest
+is left for the next run.
+"""
+import gzip
+import json
+import logging
+
+import frappe
+
+# Initialize module-level logger with aiassistant namespace
+logger = frappe.logger("aiassistant", allow_site=True)
+logger.setLevel(logging.DEBUG)
+
+
+RETENTION_BATCH_SIZE = 50
+RETENTION_MAX_BATCHES = 20
+
+# Format of the cold storage files written by archive_conversation_to_file
+ARCHIVE_FORMAT_VERSION = 1
+ARCHIVE_FILE_NAME = "ai-conversation-{name}.json.gz"
+
+
+def _inactive_conversations(days, limit, exclude_archived=False):
+    """Names of conversations without a message (or, if they have none, created) in the last `days` days."""
+    cutoff = frappe.utils.add_days(frappe.utils.now_datetime(), -days)
+    archive_condition = "AND IFNULL(archive_file, '') = ''" if exclude_archived else ""
+    return frappe.db.sql_list(f"""
+        SELECT name FROM `tabAI Conversation`
+        WHERE IFNULL(last_message_at, creation) < %(cutoff)s {archive_condition}
+        ORDER BY IFNULL(last_message_at, creation)
+        LIMIT %(limit)s
+    """, {"cutoff": cutoff, "limit": limit})
+
+
+def _is_raw_tool_message(message):
+    """Claude tool_use/tool_result messages, whose content is a list of blocks."""
+    return not isinstance(message.get("content"), str)
+
+
+def archive_conversation_to_file(name):
+    """
+    Move the messages of one conversation to a private gzipped JSON file attached to it.
+    Messages are renumbered without the dropped raw tool messages, and the compacted
+    summary is moved along, so a restored conversation continues where it stopped.
+    """
+    from erpnext_chatgpt.erpnext_chatgpt.api import MESSAGE_DOCTYPE, load_stored_messages
+
+    doc = frappe.get_doc("AI Conversation", name)
+    stored = load_stored_messages(name)
+
+    compacted = json.loads(doc.compacted_context) if doc.compacted_context else None
+    compacted_count = compacted["message_count"] if compacted else 0
+    messages = []
+    for seq, message in enumerate(stored, start=1):
+        if not _is_raw_tool_message(message):
+            messages.append({**message, "seq": len(messages) + 1})
+        if seq == compacted_count:
+            compacted["message_count"] = len(messages)
+
+    archive = {
+        "version": ARCHIVE_FORMAT_VERSION,
+        "conversation": name,
+        "archived_at": frappe.utils.now(),
+        "messages": messages
+    }
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": ARCHIVE_FILE_NAME.format(name=name),
+        "attached_to_doctype": "AI Conversation",
+        "attached_to_name": name,
+        "attached_to_field": "archive_file",
+        "is_private": 1,
+        "content": gzip.compress(json.dumps(archive, default=str).encode())
+    })
+    file_doc.save(ignore_permissions=True)
+
+    frappe.db.delete(MESSAGE_DOCTYPE, {"conversation": name})
+    # Cold storage is tracked by archive_file alone; the status (and so the chat's
+    # conversation list) is left as the user set it
+    frappe.db.set_value("AI Conversation", name, {
+        "archive_file": file_doc.file_url,
+        "archived_at": archive["archived_at"],
+        "message_count": len(messages),
+        "compacted_context": json.dumps(compacted) if compacted else None,
+        # A paused turn this old is not resumed any more
+        "pending_confirmation": None,
+        "continuation_state": None
+    }, update_modified=False)
+
+
+def load_archived_messages(doc):
+    """Messages (with their seq) of a conversation in cold storage."""
+    file_doc = frappe.get_doc("File", {"file_url": doc.archive_file})
+    archive = json.loads(gzip.decompress(file_doc.get_content()))
+    if archive.get("version") != ARCHIVE_FORMAT_VERSION:
+        frappe.throw(f"Unsupported conversation archive version: {archive.get('version')}")
+    return archive["messages"]
+
+
+def restore_archived_conversation(doc):
+    """Move a conversation from cold storage back to the message log, e.g. when the user writes in it again."""
+    from erpnext_chatgpt.erpnext_chatgpt.api import MESSAGE_DOCTYPE, MESSAGE_ROW_FIELDS, build_message_rows
+
+    messages = load_archived_messages(doc)
+    if messages:
+        frappe.db.bulk_insert(
+            MESSAGE_DOCTYPE,
+            MESSAGE_ROW_FIELDS,
+            build_message_rows(doc.name, doc.owner, messages, 1)
+        )
+
+    file_name = frappe.db.get_value("File", {"file_url": doc.archive_file})
+    doc.archive_file = None
+    doc.archived_at = None
+    doc.message_count = len(messages)
+    doc.save(ignore_permissions=True)
+    if file_name:
+        frappe.delete_doc("File", file_name, ignore_permissions=True)
+    logger.info(f"Restored AI Conversation {doc.name} from cold storage ({len(messages)} messages)")
+
+
+def _run_in_batches(days, action, label, exclude_archived=False):
+    processed = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        names = _inactive_conversations(days, RETENTION_BATCH_SIZE, exclude_archived)
+        if not names:
+            break
+
+        for name in names:
+            try:
+                action(name)
+                frappe.db.commit()
+                processed += 1
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.log_error(f"Could not {label} AI Conversation {name}: {e}", "AI Conversation Retention")
+                # The next batch would select the same conversation again; leave it for the next run
+                return processed
+
+    return processed
+
+
+def apply_conversation_retention():
+    """Scheduled job: delete expired conversations, then move inactive ones to cold storage."""
+    from erpnext_chatgpt.erpnext_chatgpt.api import get_ai_settings
+
+    settings = get_ai_settings()
+    deleted = archived = 0
+
+    if settings.delete_after_days:
+        deleted = _run_in_batches(
+            settings.delete_after_days,
+            lambda name: frappe.delete_doc("AI Conversation", name, ignore_permissions=True),
+            "delete"
+        )
+
+    if settings.archive_after_days:
+        archived = _run_in_batches(settings.archive_after_days, archive_conversation_to_file, "archive", exclude_archived=True)
+
+    logger.info(f"Conversation retention: deleted {deleted}, moved {archived} to cold storage")
+    return {"deleted": deleted, "archived": archived}
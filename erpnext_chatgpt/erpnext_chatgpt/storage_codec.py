@@ -0,0 +1,110 @@
+"""
+Optional compression of the large JSON columns of conversations: the tool usage and
+content blocks of AI Conversation Message rows, and the pending confirmation and
+continuation state of AI Conversation.
+
+A compressed value is stored as a small JSON envelope with the codec, a format version
+and the base64-encoded payload, so it stays valid in a JSON column. Values written as
+plain JSON (before compression was enabled, or below COMPRESS_MIN_BYTES) read unchanged.
+
+Kept free of frappe imports so the codecs can be benchmarked outside a site
+(see benchmarks.benchmark_storage_codec).
+"""
+import base64
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib ships with Python
+    zstandard = None
+
+
+# Envelope marker and the format version written by encode_json
+CODEC_KEY = "_codec"
+CODEC_VERSION = 1
+CODECS = ("zlib", "zstd")
+
+# Smaller values are stored as plain JSON; the envelope would save little or nothing
+COMPRESS_MIN_BYTES = 1024
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def resolve_codec(codec):
+    """The codec encode_json uses for a configured one: zstd falls back to zlib when not installed."""
+    if not codec:
+        return None
+    if codec not in CODECS:
+        raise ValueError(f"Unknown storage codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec
+
+
+def _compress(codec, raw):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Value is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown storage codec: {codec}")
+
+
+def is_encoded(value):
+    """Whether a parsed JSON value is a compression envelope."""
+    return isinstance(value, dict) and CODEC_KEY in value and "data" in value
+
+
+def encode_json(value, codec=None, default=None):
+    """
+    Serialize a value for a JSON column, compressed with `codec` ("zlib", "zstd" or None
+    for plain JSON) when that makes it smaller.
+
+    :param default: json.dumps fallback for values that are not JSON serializable
+    :return: JSON text, or None for None
+    """
+    if value is None:
+        return None
+
+    text = json.dumps(value, default=default)
+    codec = resolve_codec(codec)
+    if not codec or len(text) < COMPRESS_MIN_BYTES:
+        return text
+
+    envelope = json.dumps({
+        CODEC_KEY: codec,
+        "version": CODEC_VERSION,
+        "data": base64.b64encode(_compress(codec, text.encode())).decode()
+    })
+    return envelope if len(envelope) < len(text) else text
+
+
+def decode_json(text):
+    """
+    Parse a JSON column written by encode_json (or as plain JSON), decompressing it
+    if needed. Accepts already parsed values as well. Raises ValueError for bad data.
+    """
+    if text is None or text == "":
+        return None
+
+    value = json.loads(text) if isinstance(text, (str, bytes)) else text
+    if not is_encoded(value):
+        return value
+
+    if value.get("version") != CODEC_VERSION:
+        raise ValueError(f"Unsupported storage codec version: {value.get('version')}")
+    try:
+        raw = _decompress(value[CODEC_KEY], base64.b64decode(value["data"]))
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupt {value[CODEC_KEY]} value: {e}") from e
+    return json.loads(raw)
@@ -1,8 +1,14 @@
 import frappe
 import logging
 import json
+import hashlib
 from datetime import datetime, date, timedelta
 from decimal import Decimal
+from types import MappingProxyType
+
+from erpnext_chatgpt.erpnext_chatgpt.entity_cache import get_cached_lookup, set_cached_lookup
+from erpnext_chatgpt.erpnext_chatgpt.entity_index import ENTITY_CONFIG, get_entity_index
+from erpnext_chatgpt.erpnext_chatgpt.entity_scoring import score_candidates
 
 # Initialize module-level logger with aiassistant namespace
 logger = frappe.logger("aiassistant", allow_site=True)
@@ -147,6 +153,267 @@ def convert_openai_tool_to_claude(openai_tool):
         return openai_tool
 
 
+# =============================================================================
+# List Query Engine
+# =============================================================================
+
+# Aggregates a list tool can request: {summary_key: (function, field)}
+LIST_AGGREGATE_FUNCTIONS = frozenset({'sum', 'avg', 'min', 'max'})
+
+# Functions that report 0 rather than None over an empty set
+_ZERO_DEFAULT_FUNCTIONS = frozenset({'sum', 'avg'})
+
+
+def _aggregate_rows(rows, aggregates):
+    """Aggregates in Python, for a page that already holds every matching row."""
+    summary = {}
+    for key, (function, field) in aggregates.items():
+        values = [row.get(field) for row in rows if row.get(field) is not None]
+        if function == 'sum':
+            summary[key] = sum(values)
+        elif function == 'avg':
+            summary[key] = sum(values) / len(values) if values else 0
+        elif function == 'min':
+            summary[key] = min(values) if values else None
+        else:
+            summary[key] = max(values) if values else None
+    return summary
+
+
+def get_list_aggregates(doctype, filters, aggregates=None):
+    """
+    Exact row count and filter-wide aggregates in one query.
+
+    :param aggregates: {summary_key: (function, field)} with function in LIST_AGGREGATE_FUNCTIONS
+    :return: (total_count, summary dict)
+    """
+    aggregates = aggregates or {}
+    for function, _ in aggregates.values():
+        if function not in LIST_AGGREGATE_FUNCTIONS:
+            frappe.throw(f"Unsupported aggregate function: {function}")
+
+    row = frappe.db.get_all(
+        doctype,
+        filters=filters,
+        fields=['count(name) as total_count'] + [
+            f'{function}({field}) as {key}'
+            for key, (function, field) in aggregates.items()
+        ]
+    )[0]
+
+    summary = {
+        key: row.get(key) if row.get(key) is not None else (0 if function in _ZERO_DEFAULT_FUNCTIONS else None)
+        for key, (function, _) in aggregates.items()
+    }
+    return row.get('total_count') or 0, summary
+
+
+def list_pagination(total_count, limit, offset, returned):
+    """Pagination metadata shared by every list tool."""
+    next_offset = offset + returned
+    has_more = next_offset < total_count
+    return {
+        'offset': offset,
+        'limit': limit,
+        'returned': returned,
+        'total_count': total_count,
+        'has_more': has_more,
+        'next_offset': next_offset if has_more else None
+    }
+
+
+def run_list_query(doctype, filters, fields, order_by, limit, offset=0, aggregates=None):
+    """
+    One page of rows plus the exact count and filter-wide aggregates, in at most two
+    queries. When the first page already holds every matching row, the count and
+    aggregates come from the page itself and the second query is skipped.
+
+    :return: Dict with rows, total_count and summary (aggregates over all matching rows)
+    """
+    limit = int(limit or 0)
+    offset = int(offset or 0)
+    aggregates = aggregates or {}
+
+    rows = frappe.db.get_all(
+        doctype,
+        filters=filters,
+        fields=fields,
+        order_by=order_by,
+        limit_start=offset,
+        limit_page_length=limit
+    )
+
+    page_is_complete = not offset and (not limit or len(rows) < limit)
+    if page_is_complete and all(field in fields for _, field in aggregates.values()):
+        total_count, summary = len(rows), _aggregate_rows(rows, aggregates)
+    else:
+        total_count, summary = get_list_aggregates(doctype, filters, aggregates)
+
+    return {'rows': rows, 'total_count': total_count, 'summary': summary}
+
+
+def list_response(rows_key, rows, total_count, limit, offset, summary=None, count_key=None, **extra):
+    """
+    Response body shared by the list tools. `summary` covers every matching record,
+    not just the returned page, so there is no need to page through results to add them up.
+    """
+    response = {
+        rows_key: rows,
+        'total_count': total_count,
+        'limit': limit,
+        'offset': offset,
+        'pagination': list_pagination(total_count, limit, offset, len(rows)),
+        **extra
+    }
+    if summary is not None or count_key:
+        response['summary'] = {
+            **({count_key: total_count} if count_key else {}),
+            **(summary or {}),
+            'scope': 'all matching records'
+        }
+    return response
+
+
+# =============================================================================
+# Result Shaping
+# =============================================================================
+
+# Default token budget for a single tool result entering the model context.
+# Tools can override it with a "_token_budget" key in their definition.
+TOOL_RESULT_TOKEN_BUDGET = 4000
+
+# JSON is dense; this errs on the side of overestimating tokens
+TOOL_RESULT_CHARS_PER_TOKEN = 3.5
+
+# Full results behind a result_handle stay server-side this long
+RESULT_HANDLE_TTL = 3600
+
+# Bookkeeping columns dropped from rows when a result is over budget and the
+# tool has no "_result_fields" projection
+NOISE_FIELDS = frozenset({
+    'owner', 'modified_by', 'creation', 'modified', 'docstatus', 'idx', 'parent',
+    'parentfield', 'parenttype', 'lft', 'rgt', 'old_parent', 'amended_from',
+    '_user_tags', '_comments', '_assign', '_liked_by', '_seen'
+})
+
+
+def _estimate_json_tokens(text):
+    return int(len(text) / TOOL_RESULT_CHARS_PER_TOKEN) + 1
+
+
+def _result_handle_key(handle):
+    return f"erpnext_chatgpt:tool_result:{frappe.session.user}:{handle}"
+
+
+def _find_row_list(data):
+    """
+    Locate the list of rows in a tool result: the result itself if it is a list,
+    otherwise the longest list of dicts among its top-level values.
+    Returns (key, rows); key is None for a top-level list.
+    """
+    if isinstance(data, list):
+        return None, data
+    if not isinstance(data, dict):
+        return None, None
+
+    best_key, best_rows = None, None
+    for key, value in data.items():
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            if best_rows is None or len(value) > len(best_rows):
+                best_key, best_rows = key, value
+    return best_key, best_rows
+
+
+def _project_rows(rows, result_fields):
+    """Keep only the configured columns, or drop bookkeeping and empty columns."""
+    if result_fields:
+        return [{field: row.get(field) for field in result_fields if field in row} for row in rows]
+    return [
+        {key: value for key, value in row.items() if key not in NOISE_FIELDS and value not in (None, '', [])}
+        for row in rows
+    ]
+
+
+def _take_rows_within(rows, char_budget):
+    """Return how many leading rows fit in char_budget characters of JSON."""
+    used = 0
+    for count, row in enumerate(rows):
+        used += len(json.dumps(row, default=json_serial)) + 1
+        if used > char_budget:
+            return count
+    return len(rows)
+
+
+def _page_rows(rows, offset, token_budget):
+    """Slice rows starting at offset so the page fits the token budget (at least one row)."""
+    char_budget = int(token_budget * TOOL_RESULT_CHARS_PER_TOKEN)
+    remaining = rows[offset:]
+    page_size = max(1, _take_rows_within(remaining, char_budget))
+    return remaining[:page_size]
+
+
+def shape_tool_result(function_name, response):
+    """
+    Bound the size of a tool result before it enters the model context.
+
+    Results within the tool's token budget pass through unchanged. Larger results are
+    projected to the tool's "_result_fields" (or stripped of bookkeeping columns) and,
+    if still too large, cut to the rows that fit. The real total count is kept and the
+    full row set is stored server-side under a result_handle that the model can page
+    through with fetch_more_results.
+    """
+    if not isinstance(response, str):
+        return response
+
+    definition = get_tool_by_name(function_name) or {}
+    token_budget = definition.get('_token_budget', TOOL_RESULT_TOKEN_BUDGET)
+    if _estimate_json_tokens(response) <= token_budget:
+        return response
+
+    try:
+        data = json.loads(response)
+    except (ValueError, TypeError):
+        return response
+
+    key, rows = _find_row_list(data)
+    if not rows:
+        return response
+
+    rows = _project_rows(rows, definition.get('_result_fields'))
+    envelope = dict(data) if key is not None else {}
+    envelope[key or 'data'] = rows
+
+    projected = json.dumps(envelope, default=json_serial)
+    if _estimate_json_tokens(projected) <= token_budget:
+        return projected
+
+    # Budget left for rows after the rest of the envelope
+    rest_tokens = _estimate_json_tokens(json.dumps(dict(envelope, **{key or 'data': []}), default=json_serial))
+    page = _page_rows(rows, 0, max(token_budget - rest_tokens - 100, token_budget // 4))
+
+    handle = frappe.generate_hash(length=12)
+    frappe.cache().set_value(_result_handle_key(handle), rows, expires_in_sec=RESULT_HANDLE_TTL)
+
+    envelope[key or 'data'] = page
+    envelope.setdefault('total_count', len(rows))
+    envelope['returned_count'] = len(page)
+    envelope['truncated'] = True
+    envelope['result_handle'] = handle
+    envelope['next_offset'] = len(page)
+    envelope['truncation_note'] = (
+        f"Showing {len(page)} of {len(rows)} rows to stay within the context budget. "
+        f"Call fetch_more_results with result_handle='{handle}' and offset={len(page)} for more, "
+        f"or narrow the query with filters."
+    )
+    logger.debug(f"Shaped {function_name} result: {len(page)}/{len(rows)} rows, handle {handle}")
+    return json.dumps(envelope, default=json_serial)
+
+
+def call_tool(function_name, function_args):
+    """Execute a registered tool and shape its result for the model context."""
+    return shape_tool_result(function_name, available_functions[function_name](**function_args))
+
+
 def final_answer(message, summary=None):
     """
     Signal that the AI has completed all necessary queries and is ready to respond.
@@ -241,6 +508,61 @@ After thinking, continue with the appropriate action tool.""",
 }
 
 
+def fetch_more_results(result_handle, offset=0):
+    """
+    Page through a tool result that was truncated to fit the context budget.
+    """
+    rows = frappe.cache().get_value(_result_handle_key(result_handle))
+    if rows is None:
+        return json.dumps({
+            'error': f"Result handle '{result_handle}' not found or expired.",
+            'suggestion': 'Run the original query again, with narrower filters if possible.'
+        })
+
+    offset = max(0, int(offset or 0))
+    page = _page_rows(rows, offset, TOOL_RESULT_TOKEN_BUDGET) if offset < len(rows) else []
+    next_offset = offset + len(page)
+
+    return json.dumps({
+        'data': page,
+        'total_count': len(rows),
+        'offset': offset,
+        'returned_count': len(page),
+        'next_offset': next_offset if next_offset < len(rows) else None,
+        'result_handle': result_handle
+    }, default=json_serial)
+
+
+fetch_more_results_tool = {
+    "type": "function",
+    "function": {
+        "name": "fetch_more_results",
+        "description": "Get the next page of a tool result that was truncated to fit the context budget. Use the result_handle and next_offset returned with the truncated result. Prefer narrowing the original query with filters when only specific rows are needed.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "result_handle": {
+                    "type": "string",
+                    "description": "The result_handle from the truncated result",
+                },
+                "offset": {
+                    "type": "integer",
+                    "description": "Row offset to continue from (next_offset of the previous page)",
+                },
+            },
+            "required": ["result_handle"],
+        },
+    },
+}
+
+
+# Trigram candidates re-ranked by lookup_entity when search_link and LIKE miss
+FUZZY_CANDIDATE_POOL = 50
+
+# Minimum score for a trigram-only candidate to count as a match
+FUZZY_MATCH_MIN_SCORE = 60
+
+
 def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
     """
     Look up an entity (customer, supplier, item, etc.) using Frappe's built-in
@@ -254,61 +576,35 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
     Example: User says "swissski" -> lookup finds "Swiss Ski Verband"
     """
     from frappe.desk.search import search_link
-    from difflib import SequenceMatcher
-
-    # Map user-friendly entity types to DocTypes and their display fields
-    # Only master data entities - not documents
-    entity_config = {
-        'customer': {
-            'doctype': 'Customer',
-            'display_field': 'customer_name',
-            'filters': {'disabled': 0}
-        },
-        'supplier': {
-            'doctype': 'Supplier',
-            'display_field': 'supplier_name',
-            'filters': {'disabled': 0}
-        },
-        'item': {
-            'doctype': 'Item',
-            'display_field': 'item_name',
-            'filters': {'disabled': 0}
-        },
-        'employee': {
-            'doctype': 'Employee',
-            'display_field': 'employee_name',
-            'filters': {'status': 'Active'}
-        },
-        'lead': {
-            'doctype': 'Lead',
-            'display_field': 'lead_name',
-            'filters': {}
-        },
-        'contact': {
-            'doctype': 'Contact',
-            'display_field': 'name',
-            'filters': {}
-        }
-    }
 
     # Normalize entity type
     entity_type_lower = entity_type.lower().replace(' ', '_').replace('-', '_')
 
-    if entity_type_lower not in entity_config:
+    if entity_type_lower not in ENTITY_CONFIG:
         # Try to find a close match
-        available_types = list(entity_config.keys())
+        available_types = list(ENTITY_CONFIG.keys())
         return json.dumps({
             'error': f"Unknown entity type: '{entity_type}'",
             'available_types': available_types,
             'hint': 'Use one of the available entity types'
         }, default=json_serial)
 
-    config = entity_config[entity_type_lower]
+    config = ENTITY_CONFIG[entity_type_lower]
     doctype = config['doctype']
     display_field = config['display_field']
     filters = config['filters']
 
     try:
+        # Stage 0: Same normalized term resolved earlier for this permission scope
+        cached = get_cached_lookup(doctype, search_term, limit, fuzzy_rerank)
+        if cached:
+            return json.dumps({
+                **json.loads(cached),
+                'entity_type': entity_type,
+                'search_term': search_term,
+                'cached': True
+            }, default=json_serial)
+
         # Stage 1: Use Frappe's search_link for fast, permission-aware candidate generation
         # search_link returns a list of tuples: [(value, label, description), ...]
         candidates = search_link(
@@ -352,49 +648,30 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
                 ]
 
         # Stage 1b: Broad fuzzy search fallback
-        # If search_link and LIKE both failed, fetch a larger sample and apply fuzzy matching
+        # If search_link and LIKE both failed, search the trigram index and apply fuzzy matching
         # This handles cases like "swissski" → "Swiss-Ski" where the search term doesn't
         # appear as a substring but is phonetically/structurally similar
         if not candidates and fuzzy_rerank:
             logger.debug(f"lookup_entity: No candidates found, trying broad fuzzy search for '{search_term}'")
 
-            # Fetch a sample of entities to fuzzy match against
-            broad_results = frappe.db.get_all(
-                doctype,
-                filters=filters,
-                fields=['name', display_field] if display_field != 'name' else ['name'],
-                limit=200  # Fetch more to find fuzzy matches
-            )
+            # Candidate generation over the whole master via the trigram index
+            index = get_entity_index(doctype)
+            broad_results = index.search(search_term, limit=max(limit * 2, FUZZY_CANDIDATE_POOL))
 
             if broad_results:
-                # Normalize search term for comparison
-                search_normalized = search_term.lower().replace(' ', '').replace('-', '').replace('_', '')
-
-                # Score each result
-                scored_results = []
-                for r in broad_results:
-                    name_value = r.get(display_field, r['name']) or r['name']
-                    name_normalized = name_value.lower().replace(' ', '').replace('-', '').replace('_', '')
-
-                    # Calculate similarity score
-                    score = 0
-
-                    # Exact normalized match (e.g., "swissski" == "swissski" from "Swiss-Ski")
-                    if search_normalized == name_normalized:
-                        score = 100
-                    # Normalized containment
-                    elif search_normalized in name_normalized:
-                        score = 95
-                    elif name_normalized in search_normalized:
-                        score = 90
-                    else:
-                        # Sequence matching
-                        seq_score = int(SequenceMatcher(None, search_normalized, name_normalized).ratio() * 100)
-                        score = seq_score
-
-                    # Only include if score is reasonable (above 60%)
-                    if score >= 60:
-                        scored_results.append((r['name'], name_value, '', score))
+                # Re-rank only the top trigram candidates, using the index's normalized labels
+                scores = score_candidates(
+                    search_term,
+                    [normalized_label for _, _, normalized_label, _ in broad_results],
+                    normalized=True
+                )
+
+                # Only include if score is reasonable (above 60%)
+                scored_results = [
+                    (entity_name, label or entity_name, '', score)
+                    for (entity_name, label, _, _), score in zip(broad_results, scores)
+                    if score >= FUZZY_MATCH_MIN_SCORE
+                ]
 
                 # Sort by score and take top matches
                 scored_results.sort(key=lambda x: x[3], reverse=True)
@@ -403,7 +680,7 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
                 logger.debug(f"lookup_entity: Broad fuzzy search found {len(candidates)} candidates")
 
         if not candidates:
-            return json.dumps({
+            result = json.dumps({
                 'entity_type': entity_type,
                 'doctype': doctype,
                 'search_term': search_term,
@@ -411,6 +688,8 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
                 'best_match': None,
                 'message': f"No {entity_type} found matching '{search_term}'"
             }, default=json_serial)
+            set_cached_lookup(doctype, search_term, limit, fuzzy_rerank, result)
+            return result
 
         # Convert candidates to structured format
         results = []
@@ -432,43 +711,15 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
                 'match_score': 100  # Will be recalculated if fuzzy_rerank
             })
 
-        # Stage 2: Optional fuzzy re-ranking using SequenceMatcher
+        # Stage 2: Optional fuzzy re-ranking, all candidates scored in one batched pass
         if fuzzy_rerank and results:
-            search_lower = search_term.lower().replace(' ', '').replace('-', '')
-
-            for result in results:
-                name_value = (result['name'] or result['id'] or '').lower()
-                name_compact = name_value.replace(' ', '').replace('-', '')
-
-                # Multiple scoring strategies
-                scores = []
-
-                # 1. Exact match
-                if search_term.lower() == name_value:
-                    scores.append(100)
-
-                # 2. Exact containment (search in name or name in search)
-                if search_lower in name_compact:
-                    scores.append(95)
-                elif name_compact in search_lower:
-                    scores.append(90)
-
-                # 3. Word boundary matching
-                # "swissski" should match "Swiss Ski" well
-                if search_lower in name_compact or name_compact.startswith(search_lower):
-                    scores.append(88)
-
-                # 4. Sequence matching (handles typos and partial matches)
-                seq_score = int(SequenceMatcher(None, search_lower, name_compact).ratio() * 100)
-                scores.append(seq_score)
-
-                # 5. Also compare against the ID
-                id_lower = (result['id'] or '').lower().replace(' ', '').replace('-', '')
-                if search_lower in id_lower or id_lower in search_lower:
-                    scores.append(85)
-
-                # Take the best score
-                result['match_score'] = max(scores) if scores else 0
+            scores = score_candidates(
+                search_term,
+                [result['name'] or result['id'] or '' for result in results],
+                ids=[result['id'] or '' for result in results]
+            )
+            for result, score in zip(results, scores):
+                result['match_score'] = score
 
             # Sort by score descending
             results.sort(key=lambda x: x['match_score'], reverse=True)
@@ -476,7 +727,7 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
         # Limit results
         results = results[:limit]
 
-        return json.dumps({
+        result = json.dumps({
             'entity_type': entity_type,
             'doctype': doctype,
             'search_term': search_term,
@@ -484,6 +735,8 @@ def lookup_entity(entity_type, search_term, limit=20, fuzzy_rerank=True):
             'best_match': results[0] if results else None,
             'total_found': len(results)
         }, default=json_serial)
+        set_cached_lookup(doctype, search_term, limit, fuzzy_rerank, result)
+        return result
 
     except Exception as e:
         logger.error(f"Error in lookup_entity: {str(e)}")
@@ -533,6 +786,310 @@ CRITICAL: After calling lookup_entity, you MUST call the appropriate query tool
 }
 
 
+# Transaction list filters on a party match at most this many master records;
+# beyond that the name is too vague and the model is asked to resolve it first
+PARTY_FILTER_MAX_NAMES = 50
+
+
+def resolve_party_names(entity_type, value):
+    """
+    Resolve a user-supplied party (customer, supplier, ...) to exact master IDs, so
+    transaction tables can be filtered with = / IN on their indexed link column
+    instead of a leading-wildcard LIKE scan.
+
+    Tries an exact ID first, then substring matches on the (much smaller) master
+    table, then the trigram index for near-miss spellings. Disabled masters are
+    included for exact and substring matches, since old transactions still point to them.
+
+    :return: Up to PARTY_FILTER_MAX_NAMES + 1 names; more than the maximum means ambiguous
+    """
+    config = ENTITY_CONFIG[entity_type]
+    doctype = config['doctype']
+    display_field = config['display_field']
+
+    if frappe.db.exists(doctype, value):
+        return [value]
+
+    names = frappe.get_all(
+        doctype,
+        or_filters=[
+            [field, 'like', f'%{_escape_like(value)}%']
+            for field in dict.fromkeys(['name', display_field])
+        ],
+        pluck='name',
+        limit_page_length=PARTY_FILTER_MAX_NAMES + 1
+    )
+    if names:
+        return names
+
+    hits = get_entity_index(doctype).search(value, limit=FUZZY_CANDIDATE_POOL)
+    scores = score_candidates(value, [normalized_label for _, _, normalized_label, _ in hits], normalized=True)
+    return [
+        name for (name, _, _, _), score in sorted(zip(hits, scores), key=lambda hit: hit[1], reverse=True)
+        if score >= FUZZY_MATCH_MIN_SCORE
+    ][:PARTY_FILTER_MAX_NAMES]
+
+
+def party_filter(names, value):
+    """Filter value for a link column: = for one ID, IN for several, and the raw value (no match) for none."""
+    if len(names) == 1:
+        return names[0]
+    if names:
+        return ['in', names]
+    return value
+
+
+def ambiguous_party_response(entity_type, value, names):
+    return {
+        'error': f"'{value}' matches more than {PARTY_FILTER_MAX_NAMES} {entity_type} records",
+        'candidates': names[:10],
+        'suggestions': [
+            f"Resolve the {entity_type} with lookup_entity first and pass its exact ID",
+        ]
+    }
+
+
+# Upper bound on lookups resolved by one lookup_entities call
+MAX_BATCH_LOOKUPS = 20
+
+# LIKE rows fetched per search term by lookup_entities
+BATCH_LIKE_ROWS_PER_TERM = 20
+
+
+def _escape_like(value):
+    """Escape LIKE wildcards, so '%' and '_' in a search term match literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _batch_lookup_candidates(config, search_terms):
+    """
+    Candidates for several search terms on one entity DocType with one database query.
+    Trigram index candidates are found in memory first. The query is a UNION ALL of a
+    LIKE query per term, each capped at BATCH_LIKE_ROWS_PER_TERM so a broad term cannot
+    crowd out the others, and a check of the index candidates. Every part is built by
+    frappe.get_list(run=0), so the user's permissions apply to all of them.
+
+    :return: Dict of search_term -> {name: (label, from_like)}
+    """
+    doctype = config['doctype']
+    display_field = config['display_field']
+    fields = ['name', display_field] if display_field != 'name' else ['name']
+    search_fields = list(dict.fromkeys(['name', display_field]))
+
+    index = get_entity_index(doctype)
+    index_hits = {term: index.search(term, limit=FUZZY_CANDIDATE_POOL) for term in search_terms}
+    index_names = sorted({name for hits in index_hits.values() for name, _, _, _ in hits})
+
+    parts = [
+        frappe.get_list(
+            doctype,
+            filters=config['filters'],
+            or_filters=[[field, 'like', f'%{_escape_like(term)}%'] for field in search_fields],
+            fields=fields,
+            limit_page_length=BATCH_LIKE_ROWS_PER_TERM,
+            run=0
+        )
+        for term in search_terms
+    ]
+    if index_names:
+        # The index covers the whole master; keep only what get_list lets this user see
+        parts.append(frappe.get_list(
+            doctype,
+            filters={'name': ['in', index_names]},
+            fields=fields,
+            limit_page_length=0,
+            run=0
+        ))
+
+    # Each row is tagged with its part: the term's position, or len(search_terms) for the check
+    rows = frappe.db.sql(
+        " UNION ALL ".join(
+            f"SELECT {position} AS lookup_part, matches.* FROM ({query}) matches"
+            for position, query in enumerate(parts)
+        ),
+        as_dict=True
+    )
+
+    like_rows = [[] for _ in search_terms]
+    permitted = set()
+    for row in rows:
+        if row['lookup_part'] < len(search_terms):
+            like_rows[row['lookup_part']].append(row)
+        else:
+            permitted.add(row['name'])
+
+    candidates = {}
+    for term, term_rows in zip(search_terms, like_rows):
+        term_candidates = {row['name']: (row.get(display_field) or row['name'], True) for row in term_rows}
+        for name, label, _, _ in index_hits[term]:
+            if name not in term_candidates and name in permitted:
+                term_candidates[name] = (label or name, False)
+        candidates[term] = term_candidates
+
+    return candidates
+
+
+def _score_batch_lookup(result, term_candidates, limit):
+    """Rank one lookup's candidates into result['matches'] and cache them for the permission scope."""
+    names = list(term_candidates)
+    scores = score_candidates(
+        result['search_term'],
+        [term_candidates[name][0] for name in names],
+        ids=names
+    )
+
+    matches = [
+        {
+            'id': name,
+            'name': term_candidates[name][0],
+            'match_score': score
+        }
+        for name, score in zip(names, scores)
+        if term_candidates[name][1] or score >= FUZZY_MATCH_MIN_SCORE
+    ]
+    matches.sort(key=lambda match: match['match_score'], reverse=True)
+
+    result['matches'] = matches[:limit]
+    result['best_match'] = result['matches'][0] if result['matches'] else None
+    set_cached_lookup(
+        result['doctype'], result['search_term'], limit, True,
+        json.dumps({'matches': result['matches'], 'best_match': result['best_match']}, default=json_serial),
+        source='lookup_entities'
+    )
+
+
+def lookup_entities(lookups, limit=5):
+    """
+    Resolve several entity names in one call, e.g. "compare Swiss-Ski, Ski Austria
+    and DSV". Terms already resolved for this permission scope come from the lookup
+    cache; the others are grouped by DocType and each DocType is queried once.
+
+    :param lookups: List of {"entity_type": ..., "search_term": ...}
+    :param limit: Matches returned per lookup
+    :return: JSON with per-lookup results and an entity_type -> search_term -> best match map
+    """
+    if isinstance(lookups, str):
+        try:
+            lookups = json.loads(lookups)
+        except ValueError:
+            lookups = None
+
+    if not lookups or not isinstance(lookups, list):
+        return json.dumps({
+            'error': 'lookups must be a non-empty list of {entity_type, search_term} objects'
+        }, default=json_serial)
+
+    if len(lookups) > MAX_BATCH_LOOKUPS:
+        return json.dumps({
+            'error': f"Too many lookups ({len(lookups)}), at most {MAX_BATCH_LOOKUPS} per call"
+        }, default=json_serial)
+
+    limit = max(1, min(int(limit or 5), 20))
+
+    # Validate and group by entity type, keeping the caller's order for the results
+    results = []
+    terms_by_type = {}
+    for lookup in lookups:
+        lookup = lookup if isinstance(lookup, dict) else {}
+        entity_type = str(lookup.get('entity_type') or '')
+        search_term = str(lookup.get('search_term') or '').strip()
+        entity_type_lower = entity_type.lower().replace(' ', '_').replace('-', '_')
+
+        result = {'entity_type': entity_type, 'search_term': search_term}
+        if entity_type_lower not in ENTITY_CONFIG:
+            result['error'] = f"Unknown entity type: '{entity_type}'"
+            result['available_types'] = list(ENTITY_CONFIG.keys())
+        elif not search_term:
+            result['error'] = 'search_term is required'
+        else:
+            result['doctype'] = ENTITY_CONFIG[entity_type_lower]['doctype']
+            cached = get_cached_lookup(result['doctype'], search_term, limit, True, source='lookup_entities')
+            if cached:
+                result.update(json.loads(cached), cached=True)
+            else:
+                terms_by_type.setdefault(entity_type_lower, []).append(search_term)
+        results.append(result)
+
+    try:
+        candidates_by_type = {
+            entity_type: _batch_lookup_candidates(ENTITY_CONFIG[entity_type], list(dict.fromkeys(terms)))
+            for entity_type, terms in terms_by_type.items()
+        }
+    except Exception as e:
+        logger.error(f"Error in lookup_entities: {str(e)}")
+        frappe.log_error(f"lookup_entities error: {str(e)}", "Entity Lookup Error")
+        return json.dumps({'error': str(e)}, default=json_serial)
+
+    # Keyed by entity type too: the same term may name a customer and a supplier
+    best_matches = {}
+    for result in results:
+        entity_type_lower = result['entity_type'].lower().replace(' ', '_').replace('-', '_')
+        type_matches = best_matches.setdefault(
+            entity_type_lower if entity_type_lower in ENTITY_CONFIG else result['entity_type'], {}
+        )
+        if 'error' in result:
+            type_matches[result['search_term']] = None
+            continue
+        if not result.get('cached'):
+            _score_batch_lookup(result, candidates_by_type[entity_type_lower][result['search_term']], limit)
+        if not result['matches']:
+            result['message'] = f"No {result['entity_type']} found matching '{result['search_term']}'"
+        type_matches[result['search_term']] = result['best_match']['id'] if result['best_match'] else None
+
+    logger.debug(f"lookup_entities: resolved {sum(1 for result in results if result.get('best_match'))}/{len(results)} lookups")
+
+    return json.dumps({
+        'results': results,
+        'best_matches': best_matches,
+        'total_resolved': sum(1 for result in results if result.get('best_match'))
+    }, default=json_serial)
+
+
+lookup_entities_tool = {
+    "type": "function",
+    "function": {
+        "name": "lookup_entities",
+        "description": """PREPARATORY STEP: Resolve SEVERAL master data names in ONE call. Matches by substring and by fuzzy spelling like lookup_entity, but without the search fields of Frappe's link search.
+
+USE THIS instead of repeated lookup_entity calls whenever the user mentions more than one entity:
+- 'Compare Swiss-Ski, Ski Austria and DSV' -> lookup_entities(lookups=[{entity_type:'customer', search_term:'Swiss-Ski'}, {entity_type:'customer', search_term:'Ski Austria'}, {entity_type:'customer', search_term:'DSV'}])
+
+Returns best_matches (entity_type -> search_term -> exact ID, or null if not found) plus ranked matches per lookup.
+After resolving, you MUST continue with the actual query tools using the returned IDs.""",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "lookups": {
+                    "type": "array",
+                    "description": f"Entities to resolve (max {MAX_BATCH_LOOKUPS})",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "entity_type": {
+                                "type": "string",
+                                "enum": ["customer", "supplier", "item", "employee", "lead", "contact"],
+                                "description": "Type of master data entity"
+                            },
+                            "search_term": {
+                                "type": "string",
+                                "description": "The name or partial name to search for"
+                            }
+                        },
+                        "required": ["entity_type", "search_term"]
+                    }
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum matches returned per lookup (default: 5)",
+                    "default": 5
+                }
+            },
+            "required": ["lookups"]
+        }
+    }
+}
+
+
 def global_search(text, doctypes=None, limit=20, start=0):
     """
     Full-text search across multiple doctypes using Frappe's global search index.
@@ -643,6 +1200,10 @@ EXAMPLES:
 }
 
 
+# Detail rows returned by get_sales_invoices; totals always cover every matching invoice
+SALES_INVOICES_PAGE_SIZE = 100
+
+
 def get_sales_invoices(start_date=None, end_date=None, customer=None, status=None):
     try:
         filters = {}
@@ -653,8 +1214,22 @@ def get_sales_invoices(start_date=None, end_date=None, customer=None, status=Non
         if status:
             filters['status'] = status
 
-        # Instead of fetching all fields, only get essential ones for summary
-        # This prevents memory issues with large datasets
+        # Summary over the full filter set in one aggregate query, so totals stay
+        # exact however many invoices the period holds
+        summary = frappe.db.get_all(
+            'Sales Invoice',
+            filters=filters,
+            fields=[
+                'count(name) as total_count',
+                'sum(grand_total) as total_sales',
+                'sum(outstanding_amount) as total_outstanding'
+            ]
+        )[0]
+        total_count = summary.get('total_count') or 0
+        total_sales = summary.get('total_sales') or 0
+        total_outstanding = summary.get('total_outstanding') or 0
+
+        # Detail rows are a separate page; only essential fields are fetched
         invoices = frappe.db.get_all(
             'Sales Invoice',
             filters=filters,
@@ -662,24 +1237,20 @@ def get_sales_invoices(start_date=None, end_date=None, customer=None, status=Non
                 'name', 'customer', 'customer_name', 'posting_date',
                 'grand_total', 'outstanding_amount', 'status', 'currency'
             ],
-            limit=1000  # Add a reasonable limit to prevent huge responses
-        )
-
-        # Calculate total sales for the period
-        total_sales = sum(inv.get('grand_total', 0) for inv in invoices)
-        total_outstanding = sum(inv.get('outstanding_amount', 0) for inv in invoices)
+            limit=SALES_INVOICES_PAGE_SIZE
+        ) if total_count else []
 
         # Log for debugging
-        logger.debug(f"get_sales_invoices: Found {len(invoices)} invoices for period {start_date} to {end_date}, total: {total_sales}")
+        logger.debug(f"get_sales_invoices: Found {total_count} invoices for period {start_date} to {end_date}, total: {total_sales}")
 
         return json.dumps({
-            'invoices': invoices[:100],  # Return max 100 detailed records
-            'total_count': len(invoices),
+            'invoices': invoices,
+            'total_count': total_count,
             'total_sales': total_sales,
             'total_outstanding': total_outstanding,
             'period': {'start': start_date, 'end': end_date},
-            'truncated': len(invoices) > 100,
-            'message': f"Found {len(invoices)} invoices with total sales of {total_sales}"
+            'truncated': total_count > len(invoices),
+            'message': f"Found {total_count} invoices with total sales of {total_sales}"
         }, default=json_serial)
     except Exception as e:
         frappe.log_error(f"Error in get_sales_invoices: {str(e)}", "OpenAI Tool Error")
@@ -747,14 +1318,16 @@ def list_invoices(
         }, default=json_serial)
 
     filters = {}
+    resolved_parties = {}
 
-    # Apply filters based on invoice type
-    if invoice_type == "Sales Invoice":
-        if customer:
-            filters['customer'] = ['like', f'%{customer}%']
-    else:  # Purchase Invoice
-        if supplier:
-            filters['supplier'] = ['like', f'%{supplier}%']
+    # Apply filters based on invoice type, resolving the party to exact IDs first
+    party_type, party = ('customer', customer) if invoice_type == "Sales Invoice" else ('supplier', supplier)
+    if party:
+        names = resolve_party_names(party_type, party)
+        if len(names) > PARTY_FILTER_MAX_NAMES:
+            return json.dumps(ambiguous_party_response(party_type, party, names), default=json_serial)
+        filters[party_type] = party_filter(names, party)
+        resolved_parties[party_type] = names
 
     # Common filters
     if status:
@@ -805,46 +1378,25 @@ def list_invoices(
                  'grand_total', 'outstanding_amount', 'status', 'currency',
                  'is_return', 'creation', 'modified']
 
-    invoices = frappe.db.get_all(
+    result = run_list_query(
         invoice_type,
         filters=filters,
         fields=fields,
         order_by=order_by,
-        limit_start=offset,
-        limit_page_length=limit
-    )
-
-    # Get count for pagination
-    total_count = frappe.db.count(invoice_type, filters=filters)
-
-    # Calculate summary statistics - simplified approach
-    if invoices:
-        total_amount = sum(inv.get('grand_total', 0) for inv in invoices)
-        total_outstanding = sum(inv.get('outstanding_amount', 0) for inv in invoices)
-        average_amount = total_amount / len(invoices) if invoices else 0
-        summary = {
-            'total_invoices': len(invoices),
-            'total_amount': total_amount,
-            'total_outstanding': total_outstanding,
-            'average_amount': average_amount
-        }
-    else:
-        summary = {
-            'total_invoices': 0,
-            'total_amount': 0,
-            'total_outstanding': 0,
-            'average_amount': 0
+        limit=limit,
+        offset=offset,
+        aggregates={
+            'total_amount': ('sum', 'grand_total'),
+            'total_outstanding': ('sum', 'outstanding_amount'),
+            'average_amount': ('avg', 'grand_total')
         }
+    )
 
-    return json.dumps({
-        'invoice_type': invoice_type,
-        'invoices': invoices,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset,
-        'summary': summary
-    }, default=json_serial)
-
+    return json.dumps(list_response(
+        'invoices', result['rows'], result['total_count'], limit, offset,
+        summary=result['summary'], count_key='total_invoices',
+        invoice_type=invoice_type, resolved_parties=resolved_parties
+    ), default=json_serial)
 
 list_invoices_tool = {
     "type": "function",
@@ -861,11 +1413,11 @@ list_invoices_tool = {
                 },
                 "customer": {
                     "type": "string",
-                    "description": "Filter by customer name (for Sales Invoice, partial match)",
+                    "description": "Customer ID or name (for Sales Invoice). Exact IDs are fastest; partial names are resolved to matching customers",
                 },
                 "supplier": {
                     "type": "string",
-                    "description": "Filter by supplier name (for Purchase Invoice, partial match)",
+                    "description": "Supplier ID or name (for Purchase Invoice). Exact IDs are fastest; partial names are resolved to matching suppliers",
                 },
                 "status": {
                     "type": "string",
@@ -982,6 +1534,7 @@ get_employees_tool = {
             "required": [],
         },
     },
+    "_result_fields": ["name", "employee_name", "department", "designation", "status", "company", "branch", "date_of_joining", "reports_to", "user_id"],
 }
 
 
@@ -1024,6 +1577,7 @@ get_purchase_orders_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "supplier", "supplier_name", "transaction_date", "schedule_date", "status", "grand_total", "currency", "per_received", "per_billed"],
 }
 
 
@@ -1057,6 +1611,7 @@ get_customers_tool = {
             "required": [],
         },
     },
+    "_result_fields": ["name", "customer_name", "customer_group", "customer_type", "territory", "default_currency", "disabled"],
 }
 
 
@@ -1096,27 +1651,20 @@ def list_customers(
     # Build order_by clause
     order_by = f'{sort_by} {sort_order}'
 
-    customers = frappe.db.get_all(
+    result = run_list_query(
         'Customer',
         filters=filters,
         fields=['name', 'customer_name', 'customer_group', 'territory',
                 'customer_type', 'disabled', 'creation', 'modified',
                 'customer_primary_contact', 'customer_primary_address'],
         order_by=order_by,
-        limit_start=offset,
-        limit_page_length=limit
+        limit=limit,
+        offset=offset
     )
 
-    # Get count for pagination
-    total_count = frappe.db.count('Customer', filters=filters)
-
-    return json.dumps({
-        'customers': customers,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset
-    }, default=json_serial)
-
+    return json.dumps(list_response(
+        'customers', result['rows'], result['total_count'], limit, offset
+    ), default=json_serial)
 
 list_customers_tool = {
     "type": "function",
@@ -1244,6 +1792,7 @@ get_general_ledger_entries_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "posting_date", "account", "party_type", "party", "debit", "credit", "voucher_type", "voucher_no", "against", "cost_center", "remarks"],
 }
 
 
@@ -1323,6 +1872,7 @@ get_outstanding_invoices_tool = {
             "required": [],
         },
     },
+    "_result_fields": ["name", "customer", "customer_name", "posting_date", "due_date", "grand_total", "outstanding_amount", "status", "currency"],
 }
 
 def get_sales_orders(start_date=None, end_date=None, customer=None):
@@ -1364,6 +1914,7 @@ get_sales_orders_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "customer", "customer_name", "transaction_date", "delivery_date", "status", "grand_total", "currency", "per_delivered", "per_billed"],
 }
 
 
@@ -1433,44 +1984,25 @@ def list_quotations(
     # Build order_by clause
     order_by = f'{sort_by} {sort_order}'
 
-    quotations = frappe.db.get_all(
+    result = run_list_query(
         'Quotation',
         filters=filters,
         fields=['name', 'quotation_to', 'party_name', 'customer_name',
                 'transaction_date', 'valid_till', 'grand_total', 'status',
                 'currency', 'order_type', 'creation', 'modified'],
         order_by=order_by,
-        limit_start=offset,
-        limit_page_length=limit
-    )
-
-    # Get count for pagination
-    total_count = frappe.db.count('Quotation', filters=filters)
-
-    # Calculate summary statistics
-    if quotations:
-        total_amount = sum(q.get('grand_total', 0) for q in quotations)
-        average_amount = total_amount / len(quotations) if quotations else 0
-        summary = {
-            'total_quotations': len(quotations),
-            'total_amount': total_amount,
-            'average_amount': average_amount
-        }
-    else:
-        summary = {
-            'total_quotations': 0,
-            'total_amount': 0,
-            'average_amount': 0
+        limit=limit,
+        offset=offset,
+        aggregates={
+            'total_amount': ('sum', 'grand_total'),
+            'average_amount': ('avg', 'grand_total')
         }
+    )
 
-    return json.dumps({
-        'quotations': quotations,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset,
-        'summary': summary
-    }, default=json_serial)
-
+    return json.dumps(list_response(
+        'quotations', result['rows'], result['total_count'], limit, offset,
+        summary=result['summary'], count_key='total_quotations'
+    ), default=json_serial)
 
 list_quotations_tool = {
     "type": "function",
@@ -1563,10 +2095,15 @@ def list_sales_orders(
     List sales orders with advanced filtering and sorting options
     """
     filters = {}
+    resolved_parties = {}
 
-    # Apply filters
+    # Apply filters, resolving the customer to exact IDs first
     if customer:
-        filters['customer'] = ['like', f'%{customer}%']
+        names = resolve_party_names('customer', customer)
+        if len(names) > PARTY_FILTER_MAX_NAMES:
+            return json.dumps(ambiguous_party_response('customer', customer, names), default=json_serial)
+        filters['customer'] = party_filter(names, customer)
+        resolved_parties['customer'] = names
     if status:
         filters['status'] = status  # Draft, To Deliver and Bill, To Bill, To Deliver, Completed, Cancelled, Closed
     if delivery_status:
@@ -1612,7 +2149,7 @@ def list_sales_orders(
     # Build order_by clause
     order_by = f'{sort_by} {sort_order}'
 
-    sales_orders = frappe.db.get_all(
+    result = run_list_query(
         'Sales Order',
         filters=filters,
         fields=['name', 'customer', 'customer_name', 'transaction_date', 'delivery_date',
@@ -1620,43 +2157,21 @@ def list_sales_orders(
                 'per_delivered', 'per_billed', 'currency', 'order_type',
                 'creation', 'modified'],
         order_by=order_by,
-        limit_start=offset,
-        limit_page_length=limit
-    )
-
-    # Get count for pagination
-    total_count = frappe.db.count('Sales Order', filters=filters)
-
-    # Calculate summary statistics
-    if sales_orders:
-        total_amount = sum(so.get('grand_total', 0) for so in sales_orders)
-        average_amount = total_amount / len(sales_orders) if sales_orders else 0
-        avg_delivery = sum(so.get('per_delivered', 0) for so in sales_orders) / len(sales_orders)
-        avg_billed = sum(so.get('per_billed', 0) for so in sales_orders) / len(sales_orders)
-        summary = {
-            'total_orders': len(sales_orders),
-            'total_amount': total_amount,
-            'average_amount': average_amount,
-            'average_delivery_percentage': avg_delivery,
-            'average_billing_percentage': avg_billed
-        }
-    else:
-        summary = {
-            'total_orders': 0,
-            'total_amount': 0,
-            'average_amount': 0,
-            'average_delivery_percentage': 0,
-            'average_billing_percentage': 0
+        limit=limit,
+        offset=offset,
+        aggregates={
+            'total_amount': ('sum', 'grand_total'),
+            'average_amount': ('avg', 'grand_total'),
+            'average_delivery_percentage': ('avg', 'per_delivered'),
+            'average_billing_percentage': ('avg', 'per_billed')
         }
+    )
 
-    return json.dumps({
-        'sales_orders': sales_orders,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset,
-        'summary': summary
-    }, default=json_serial)
-
+    return json.dumps(list_response(
+        'sales_orders', result['rows'], result['total_count'], limit, offset,
+        summary=result['summary'], count_key='total_orders',
+        resolved_parties=resolved_parties
+    ), default=json_serial)
 
 list_sales_orders_tool = {
     "type": "function",
@@ -1668,7 +2183,7 @@ list_sales_orders_tool = {
             "properties": {
                 "customer": {
                     "type": "string",
-                    "description": "Filter by customer name (partial match)",
+                    "description": "Customer ID or name. Exact IDs are fastest; partial names are resolved to matching customers",
                 },
                 "status": {
                     "type": "string",
@@ -1733,6 +2248,56 @@ list_sales_orders_tool = {
 }
 
 
+def fetch_bundle_entries(bundle_names):
+    """Serial and Batch Entry rows of all given bundles in one IN query, grouped by bundle."""
+    entries_by_bundle = {}
+    if not bundle_names:
+        return entries_by_bundle
+
+    for entry in frappe.db.get_all(
+        'Serial and Batch Entry',
+        filters={'parent': ['in', list(bundle_names)]},
+        fields=['parent', 'serial_no', 'qty'],
+        order_by='parent, idx'
+    ):
+        entries_by_bundle.setdefault(entry['parent'], []).append(entry)
+    return entries_by_bundle
+
+
+def group_serials_by_item(items, stock_entries, entries_by_bundle):
+    """
+    Serial numbers per item_code: from the line items' bundles first, then from the
+    Stock Ledger Entry bundles for item codes whose lines had none.
+    """
+    serial_numbers_by_item = {}
+
+    for item in items:
+        serials = entries_by_bundle.get(item.get('serial_and_batch_bundle')) if item.get('serial_and_batch_bundle') else None
+        if serials:
+            serial_numbers_by_item.setdefault(item['item_code'], []).extend(
+                {
+                    'serial_no': serial['serial_no'],
+                    'qty': abs(serial['qty']),  # Use absolute value since qty might be negative
+                    'warehouse': item.get('warehouse', '')
+                }
+                for serial in serials
+            )
+
+    from_line_items = set(serial_numbers_by_item)
+    for entry in stock_entries:
+        if entry.get('serial_and_batch_bundle') and entry['item_code'] not in from_line_items:
+            serial_numbers_by_item.setdefault(entry['item_code'], []).extend(
+                {
+                    'serial_no': serial['serial_no'],
+                    'qty': abs(serial['qty']),
+                    'warehouse': entry['warehouse']
+                }
+                for serial in entries_by_bundle.get(entry['serial_and_batch_bundle'], [])
+            )
+
+    return serial_numbers_by_item
+
+
 def get_delivery_note(delivery_note_number):
     """
     Get complete details of a specific delivery note including all line items and serial numbers
@@ -1755,31 +2320,7 @@ def get_delivery_note(delivery_note_number):
         fields=['*']
     )
 
-    # Collect all serial numbers
-    serial_numbers_by_item = {}
-
-    # First, check serial_and_batch_bundle from Delivery Note Items
-    for item in items:
-        if item.get('serial_and_batch_bundle'):
-            # Get serial numbers from the bundle
-            serials = frappe.db.get_all(
-                'Serial and Batch Entry',
-                filters={'parent': item['serial_and_batch_bundle']},
-                fields=['serial_no', 'qty']
-            )
-
-            if serials:
-                if item['item_code'] not in serial_numbers_by_item:
-                    serial_numbers_by_item[item['item_code']] = []
-
-                for serial in serials:
-                    serial_numbers_by_item[item['item_code']].append({
-                        'serial_no': serial.serial_no,
-                        'qty': abs(serial.qty),  # Use absolute value since qty might be negative
-                        'warehouse': item.get('warehouse', '')
-                    })
-
-    # Also check Stock Ledger Entry as fallback
+    # Stock Ledger Entry bundles are the fallback for lines that carry none themselves
     stock_entries = frappe.db.get_all(
         'Stock Ledger Entry',
         filters={
@@ -1789,24 +2330,13 @@ def get_delivery_note(delivery_note_number):
         fields=['item_code', 'serial_and_batch_bundle', 'actual_qty', 'warehouse']
     )
 
-    for entry in stock_entries:
-        if entry.serial_and_batch_bundle and entry.item_code not in serial_numbers_by_item:
-            # Get serial numbers from the bundle
-            serials = frappe.db.get_all(
-                'Serial and Batch Entry',
-                filters={'parent': entry.serial_and_batch_bundle},
-                fields=['serial_no', 'qty']
-            )
-
-            if entry.item_code not in serial_numbers_by_item:
-                serial_numbers_by_item[entry.item_code] = []
-
-            for serial in serials:
-                serial_numbers_by_item[entry.item_code].append({
-                    'serial_no': serial.serial_no,
-                    'qty': abs(serial.qty),  # Use absolute value since qty might be negative
-                    'warehouse': entry.warehouse
-                })
+    # Entries of every bundle (line items and ledger) in one query, grouped in memory
+    bundle_names = {
+        row['serial_and_batch_bundle']
+        for row in items + stock_entries
+        if row.get('serial_and_batch_bundle')
+    }
+    serial_numbers_by_item = group_serials_by_item(items, stock_entries, fetch_bundle_entries(bundle_names))
 
     # Add serial numbers to items
     for item in items:
@@ -1845,6 +2375,27 @@ get_delivery_note_tool = {
 }
 
 
+DELIVERY_NOTE_LIST_FIELDS = [
+    'name', 'customer', 'customer_name', 'posting_date',
+    'grand_total', 'status', 'per_billed', 'currency',
+    'lr_no', 'lr_date', 'transporter', 'vehicle_no',
+    'is_return', 'creation', 'modified'
+]
+
+DELIVERY_NOTE_LIST_AGGREGATES = {
+    'total_amount': ('sum', 'grand_total'),
+    'average_amount': ('avg', 'grand_total'),
+    'average_billing_percentage': ('avg', 'per_billed')
+}
+
+
+def _empty_delivery_note_list(limit, offset):
+    return list_response(
+        'delivery_notes', [], 0, limit, offset,
+        summary=_aggregate_rows([], DELIVERY_NOTE_LIST_AGGREGATES), count_key='total_notes'
+    )
+
+
 def list_delivery_notes(
     customer=None,
     status=None,
@@ -1909,40 +2460,26 @@ def list_delivery_notes(
                 logger.debug(f"Delivery notes with serial {serial_number}: {note_names}")
             else:
                 # No delivery notes found with this serial number
-                return json.dumps({
-                    'delivery_notes': [],
-                    'total_count': 0,
-                    'limit': limit,
-                    'offset': offset,
-                    'summary': {
-                        'total_notes': 0,
-                        'total_amount': 0,
-                        'average_amount': 0
-                    }
-                }, default=json_serial)
+                return json.dumps(_empty_delivery_note_list(limit, offset), default=json_serial)
         else:
             # No serial bundles found with this serial number
-            return json.dumps({
-                'delivery_notes': [],
-                'total_count': 0,
-                'limit': limit,
-                'offset': offset,
-                'summary': {
-                    'total_notes': 0,
-                    'total_amount': 0,
-                    'average_amount': 0
-                }
-            }, default=json_serial)
-
-    # Apply other filters
-    if customer:
-        filters['customer'] = ['like', f'%{customer}%']
+            return json.dumps(_empty_delivery_note_list(limit, offset), default=json_serial)
+
+    # Apply other filters; customer and transporter (a Supplier link) resolve to exact IDs first
+    resolved_parties = {}
+    for field, party_type, party in (('customer', 'customer', customer), ('transporter', 'supplier', transporter)):
+        if not party:
+            continue
+        names = resolve_party_names(party_type, party)
+        if len(names) > PARTY_FILTER_MAX_NAMES:
+            return json.dumps(ambiguous_party_response(party_type, party, names), default=json_serial)
+        filters[field] = party_filter(names, party)
+        resolved_parties[field] = names
     if status:
         filters['status'] = status  # Draft, To Bill, Completed, Cancelled, Closed
     if lr_no:
-        filters['lr_no'] = ['like', f'%{lr_no}%']
-    if transporter:
-        filters['transporter'] = ['like', f'%{transporter}%']
+        # Exact tracking number only; a substring match would scan every delivery note
+        filters['lr_no'] = lr_no
 
     # Date filters - only apply if no serial number search OR if explicitly requested
     # When searching by serial number, we want ALL matching delivery notes regardless of date
@@ -1979,17 +2516,7 @@ def list_delivery_notes(
                 filters['name'] = ['in', item_note_names]
         else:
             # No delivery notes found with this item
-            return json.dumps({
-                'delivery_notes': [],
-                'total_count': 0,
-                'limit': limit,
-                'offset': offset,
-                'summary': {
-                    'total_notes': 0,
-                    'total_amount': 0,
-                    'average_amount': 0
-                }
-            }, default=json_serial)
+            return json.dumps(_empty_delivery_note_list(limit, offset), default=json_serial)
 
     # Validate sort_by field
     valid_sort_fields = ['name', 'posting_date', 'customer', 'grand_total',
@@ -2012,10 +2539,7 @@ def list_delivery_notes(
         all_matching_notes = frappe.db.get_all(
             'Delivery Note',
             filters=filters,
-            fields=['name', 'customer', 'customer_name', 'posting_date',
-                    'grand_total', 'status', 'per_billed', 'currency',
-                    'lr_no', 'lr_date', 'transporter', 'vehicle_no',
-                    'is_return', 'creation', 'modified'],
+            fields=DELIVERY_NOTE_LIST_FIELDS,
             order_by=order_by
         )
 
@@ -2023,20 +2547,22 @@ def list_delivery_notes(
         for note in all_matching_notes[:3]:  # Log first 3 for debugging
             logger.debug(f"  - {note['name']}: {note['posting_date']}")
 
-        # Apply offset and limit manually
+        # Apply offset and limit manually; every match is in hand, so aggregate here too
         delivery_notes = all_matching_notes[offset:offset + limit]
+        total_count = len(all_matching_notes)
+        summary = _aggregate_rows(all_matching_notes, DELIVERY_NOTE_LIST_AGGREGATES)
     else:
-        delivery_notes = frappe.db.get_all(
+        result = run_list_query(
             'Delivery Note',
             filters=filters,
-            fields=['name', 'customer', 'customer_name', 'posting_date',
-                    'grand_total', 'status', 'per_billed', 'currency',
-                    'lr_no', 'lr_date', 'transporter', 'vehicle_no',
-                    'is_return', 'creation', 'modified'],
+            fields=DELIVERY_NOTE_LIST_FIELDS,
             order_by=order_by,
-            limit_start=offset,
-            limit_page_length=limit
+            limit=limit,
+            offset=offset,
+            aggregates=DELIVERY_NOTE_LIST_AGGREGATES
         )
+        delivery_notes = result['rows']
+        total_count, summary = result['total_count'], result['summary']
 
     logger.debug(f"Query returned {len(delivery_notes) if delivery_notes else 0} delivery notes")
     if delivery_notes and serial_number:
@@ -2076,35 +2602,11 @@ def list_delivery_notes(
 
             note['matched_serial_items'] = matched_items
 
-    # Get count for pagination
-    total_count = frappe.db.count('Delivery Note', filters=filters)
-
-    # Calculate summary statistics
-    if delivery_notes:
-        total_amount = sum(dn.get('grand_total', 0) for dn in delivery_notes)
-        average_amount = total_amount / len(delivery_notes) if delivery_notes else 0
-        avg_billed = sum(dn.get('per_billed', 0) for dn in delivery_notes) / len(delivery_notes)
-        summary = {
-            'total_notes': len(delivery_notes),
-            'total_amount': total_amount,
-            'average_amount': average_amount,
-            'average_billing_percentage': avg_billed
-        }
-    else:
-        summary = {
-            'total_notes': 0,
-            'total_amount': 0,
-            'average_amount': 0,
-            'average_billing_percentage': 0
-        }
-
-    return json.dumps({
-        'delivery_notes': delivery_notes,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset,
-        'summary': summary
-    }, default=json_serial)
+    return json.dumps(list_response(
+        'delivery_notes', delivery_notes, total_count, limit, offset,
+        summary=summary, count_key='total_notes',
+        resolved_parties=resolved_parties
+    ), default=json_serial)
 
 
 list_delivery_notes_tool = {
@@ -2117,7 +2619,7 @@ list_delivery_notes_tool = {
             "properties": {
                 "customer": {
                     "type": "string",
-                    "description": "Filter by customer name (partial match)",
+                    "description": "Customer ID or name. Exact IDs are fastest; partial names are resolved to matching customers",
                 },
                 "status": {
                     "type": "string",
@@ -2141,11 +2643,11 @@ list_delivery_notes_tool = {
                 },
                 "lr_no": {
                     "type": "string",
-                    "description": "Filter by Lorry Receipt Number / Tracking Number (partial match)",
+                    "description": "Filter by exact Lorry Receipt Number / Tracking Number",
                 },
                 "transporter": {
                     "type": "string",
-                    "description": "Filter by transporter name (partial match)",
+                    "description": "Transporter (supplier) ID or name; partial names are resolved to matching suppliers",
                 },
                 "sort_by": {
                     "type": "string",
@@ -2214,6 +2716,7 @@ get_purchase_invoices_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "supplier", "supplier_name", "posting_date", "due_date", "grand_total", "outstanding_amount", "status", "currency"],
 }
 
 
@@ -2250,6 +2753,7 @@ get_journal_entries_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "posting_date", "voucher_type", "total_debit", "total_credit", "cheque_no", "user_remark"],
 }
 
 
@@ -2292,6 +2796,7 @@ get_payments_tool = {
             "required": ["start_date", "end_date"],
         },
     },
+    "_result_fields": ["name", "payment_type", "posting_date", "party_type", "party", "paid_amount", "received_amount", "mode_of_payment", "reference_no", "status"],
 }
 
 
@@ -2309,80 +2814,91 @@ def list_service_protocols(
     """
     List Service Protocols with filtering, sorting, and pagination.
     Can filter by customer, status, date range, or serial number in devices.
+
+    The page, customer names, device counts, total count and date range come from
+    one query (window functions over the filtered set); a second query is only
+    needed when the offset is past the last row.
     """
-    import frappe
-    import json
-    from datetime import datetime
+    limit = int(limit or 10)
+    offset = int(offset or 0)
 
-    filters = {}
+    conditions = []
+    params = {'limit': limit, 'offset': offset}
 
     # Add basic filters
     if customer:
-        filters['customer'] = customer
+        conditions.append("sp.customer = %(customer)s")
+        params['customer'] = customer
 
     if status:
-        filters['docstatus'] = {
+        conditions.append("sp.docstatus = %(docstatus)s")
+        params['docstatus'] = {
             'Draft': 0,
             'Submitted': 1,
             'Cancelled': 2
         }.get(status, 0)
 
     # Date range filter
-    if date_from and date_to:
-        filters['date_of_service'] = ['between', [date_from, date_to]]
-    elif date_from:
-        filters['date_of_service'] = ['>=', date_from]
-    elif date_to:
-        filters['date_of_service'] = ['<=', date_to]
-
-    # Handle serial number search in child table
+    if date_from:
+        conditions.append("sp.date_of_service >= %(date_from)s")
+        params['date_from'] = date_from
+    if date_to:
+        conditions.append("sp.date_of_service <= %(date_to)s")
+        params['date_to'] = date_to
+
+    # Serial number search in the child table, folded into the same query
     if serial_number:
-        # Find service protocols containing this serial number
-        protocol_items = frappe.db.get_all(
-            'Service Protocol Item',
-            filters={'serial_number': serial_number},
-            fields=['parent'],
-            distinct=True
-        )
+        conditions.append("""sp.name IN (
+            SELECT spi.parent FROM `tabService Protocol Item` spi
+            WHERE spi.serial_number = %(serial_number)s AND spi.parenttype = 'Service Protocol'
+        )""")
+        params['serial_number'] = serial_number
 
-        if protocol_items:
-            protocol_names = [item.parent for item in protocol_items]
-            filters['name'] = ['in', protocol_names]
-        else:
-            # No protocols found with this serial number
-            return json.dumps({
-                'service_protocols': [],
-                'total_count': 0,
-                'limit': limit,
-                'offset': offset,
-                'summary': {}
-            }, default=json_serial)
+    where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
 
     # Validate sort_by field
     valid_sort_fields = ['name', 'customer', 'date_of_service', 'creation', 'modified']
     if sort_by not in valid_sort_fields:
         sort_by = 'date_of_service'
+    sort_order = 'asc' if str(sort_order).lower() == 'asc' else 'desc'
 
-    # Build order by clause
-    order_by = f'{sort_by} {sort_order}'
+    service_protocols = frappe.db.sql(f"""
+        SELECT
+            sp.name, sp.customer, c.customer_name, sp.date_of_service, sp.notes,
+            sp.docstatus, sp.creation, sp.modified, sp.owner,
+            (
+                SELECT COUNT(*) FROM `tabService Protocol Item` spi
+                WHERE spi.parent = sp.name AND spi.parenttype = 'Service Protocol'
+            ) AS device_count,
+            COUNT(*) OVER () AS total_count,
+            MIN(sp.date_of_service) OVER () AS earliest,
+            MAX(sp.date_of_service) OVER () AS latest
+        FROM `tabService Protocol` sp
+        LEFT JOIN `tabCustomer` c ON c.name = sp.customer
+        {where_sql}
+        ORDER BY sp.`{sort_by}` {sort_order}
+        LIMIT %(limit)s OFFSET %(offset)s
+    """, params, as_dict=True)
 
-    # Get service protocols
-    service_protocols = frappe.db.get_all(
-        'Service Protocol',
-        filters=filters,
-        fields=['name', 'customer', 'date_of_service', 'notes', 'docstatus',
-                'creation', 'modified', 'owner'],
-        order_by=order_by,
-        limit=limit,
-        start=offset
-    )
+    if service_protocols:
+        first = service_protocols[0]
+        total_count = first['total_count']
+        date_range = {'earliest': first['earliest'], 'latest': first['latest']}
+    else:
+        # Empty page: the window columns are unavailable, so count the filtered set directly
+        totals = frappe.db.sql(f"""
+            SELECT COUNT(*) AS total_count,
+                MIN(sp.date_of_service) AS earliest,
+                MAX(sp.date_of_service) AS latest
+            FROM `tabService Protocol` sp
+            {where_sql}
+        """, params, as_dict=True)[0] if offset else {'total_count': 0, 'earliest': None, 'latest': None}
+        total_count = totals['total_count']
+        date_range = {'earliest': totals['earliest'], 'latest': totals['latest']}
 
-    # Add customer name and status for each protocol
     for protocol in service_protocols:
-        # Get customer name
-        if protocol.get('customer'):
-            customer_name = frappe.db.get_value('Customer', protocol['customer'], 'customer_name')
-            protocol['customer_name'] = customer_name
+        for column in ('total_count', 'earliest', 'latest'):
+            protocol.pop(column, None)
 
         # Add human-readable status
         protocol['status'] = {
@@ -2391,32 +2907,15 @@ def list_service_protocols(
             2: 'Cancelled'
         }.get(protocol.get('docstatus', 0), 'Draft')
 
-        # Get device count
-        device_count = frappe.db.count('Service Protocol Item', {'parent': protocol['name']})
-        protocol['device_count'] = device_count
+    summary = {
+        'date_range': date_range if date_range['earliest'] else None,
+        'devices_on_page': sum(p.get('device_count', 0) for p in service_protocols)
+    }
 
-    # Get total count for pagination
-    total_count = frappe.db.count('Service Protocol', filters=filters)
-
-    # Calculate summary statistics
-    summary = {}
-    if service_protocols:
-        summary = {
-            'total_protocols': len(service_protocols),
-            'total_devices_serviced': sum(p.get('device_count', 0) for p in service_protocols),
-            'date_range': {
-                'earliest': min(p['date_of_service'] for p in service_protocols if p.get('date_of_service')),
-                'latest': max(p['date_of_service'] for p in service_protocols if p.get('date_of_service'))
-            } if any(p.get('date_of_service') for p in service_protocols) else None
-        }
-
-    return json.dumps({
-        'service_protocols': service_protocols,
-        'total_count': total_count,
-        'limit': limit,
-        'offset': offset,
-        'summary': summary
-    }, default=json_serial)
+    return json.dumps(list_response(
+        'service_protocols', service_protocols, total_count, limit, offset,
+        summary=summary, count_key='total_protocols'
+    ), default=json_serial)
 
 
 def create_lead(
@@ -2644,6 +3143,10 @@ create_lead_tool = {
 }
 
 
+# Longest amended_from chain get_service_protocol follows
+MAX_AMENDMENT_CHAIN_DEPTH = 100
+
+
 def get_service_protocol(protocol_name):
     """
     Get detailed information about a specific Service Protocol including all devices.
@@ -2688,37 +3191,43 @@ def get_service_protocol(protocol_name):
         order_by='idx'
     )
 
-    # Enrich device information with serial number details
+    # Enrich device information with serial number details, all serials in one query
+    serial_numbers = list({device['serial_number'] for device in devices if device.get('serial_number')})
+    serial_info_by_name = {
+        row.pop('name'): row
+        for row in frappe.db.get_all(
+            'Serial No',
+            filters={'name': ['in', serial_numbers]},
+            fields=['name', 'item_code', 'item_name', 'warehouse', 'status']
+        )
+    } if serial_numbers else {}
+
     for device in devices:
-        if device.get('serial_number'):
-            serial_info = frappe.db.get_value(
-                'Serial No',
-                device['serial_number'],
-                ['item_code', 'item_name', 'warehouse', 'status'],
-                as_dict=True
-            )
-            if serial_info:
-                device['serial_info'] = serial_info
+        serial_info = serial_info_by_name.get(device.get('serial_number'))
+        if serial_info:
+            device['serial_info'] = serial_info
 
     protocol['devices'] = devices
     protocol['total_devices'] = len(devices)
 
-    # Get amendment history if this is an amended document
+    # Get amendment history if this is an amended document: the whole amended_from
+    # chain in one recursive query, bounded so a cycle cannot loop forever
     if protocol.get('amended_from'):
-        protocol['amendment_history'] = []
-        current = protocol.get('amended_from')
-        while current:
-            amendment = frappe.db.get_value(
-                'Service Protocol',
-                current,
-                ['name', 'date_of_service', 'modified'],
-                as_dict=True
+        protocol['amendment_history'] = frappe.db.sql("""
+            WITH RECURSIVE chain AS (
+                SELECT name, date_of_service, modified, amended_from, 1 AS depth
+                FROM `tabService Protocol`
+                WHERE name = %(start)s
+                UNION ALL
+                SELECT sp.name, sp.date_of_service, sp.modified, sp.amended_from, chain.depth + 1
+                FROM `tabService Protocol` sp
+                JOIN chain ON sp.name = chain.amended_from
+                WHERE chain.depth < %(max_depth)s
             )
-            if amendment:
-                protocol['amendment_history'].append(amendment)
-                current = frappe.db.get_value('Service Protocol', current, 'amended_from')
-            else:
-                break
+            SELECT name, date_of_service, modified
+            FROM chain
+            ORDER BY depth
+        """, {'start': protocol['amended_from'], 'max_depth': MAX_AMENDMENT_CHAIN_DEPTH}, as_dict=True)
 
     return json.dumps(protocol, default=json_serial)
 
@@ -3369,43 +3878,148 @@ Use this for quick customer overview. For FULL record lists, use specific tools:
 WRITE_TOOLS = {'create_lead'}
 
 
+# =============================================================================
+# Tool Registry
+# =============================================================================
+
+# Single source of truth for the tools offered to the model, in presentation order:
+# (tool definition, implementation). Keys starting with "_" in a definition are
+# internal metadata and are never sent to a provider.
+TOOL_DEFINITIONS = (
+    # Final answer tool - MUST be called to respond to user
+    (final_answer_tool, final_answer),
+    # Think tool - for AI reasoning
+    (think_tool, think),
+    # Entity lookup tool - should be used first to resolve informal names
+    (lookup_entity_tool, lookup_entity),
+    (lookup_entities_tool, lookup_entities),
+    # Global search tool - cross-doctype full-text search
+    (global_search_tool, global_search),
+    # Paging through results truncated to the context budget
+    (fetch_more_results_tool, fetch_more_results),
+    # Document query tools
+    (get_sales_invoices_tool, get_sales_invoices),
+    (get_sales_invoice_tool, get_sales_invoice),
+    (list_invoices_tool, list_invoices),
+    (get_employees_tool, get_employees),
+    (get_purchase_orders_tool, get_purchase_orders),
+    (get_customers_tool, get_customers),
+    (list_customers_tool, list_customers),
+    (get_stock_levels_tool, get_stock_levels),
+    (get_general_ledger_entries_tool, get_general_ledger_entries),
+    (get_profit_and_loss_statement_tool, get_profit_and_loss_statement),
+    (get_outstanding_invoices_tool, get_outstanding_invoices),
+    (get_sales_orders_tool, get_sales_orders),
+    (list_quotations_tool, list_quotations),
+    (list_sales_orders_tool, list_sales_orders),
+    (list_delivery_notes_tool, list_delivery_notes),
+    (get_delivery_note_tool, get_delivery_note),
+    (get_purchase_invoices_tool, get_purchase_invoices),
+    (get_journal_entries_tool, get_journal_entries),
+    (get_payments_tool, get_payments),
+    (list_service_protocols_tool, list_service_protocols),
+    (get_service_protocol_tool, get_service_protocol),
+    (create_lead_tool, create_lead),
+    (get_top_customers_by_sales_tool, get_top_customers_by_sales),
+    (aggregate_data_tool, aggregate_data),
+    (get_customer_summary_tool, get_customer_summary),
+)
+
+# Tools that are always offered, whatever the role filters decide
+REQUIRED_TOOLS = frozenset({'final_answer', 'think'})
+
+
+def _freeze(value):
+    """Recursively convert a JSON-like structure to read-only mappings and tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class ToolRegistry:
+    """
+    Immutable view of a set of tools, precomputed once per worker process.
+
+    Holds the provider payloads (OpenAI and Claude format) ready to hand to the SDKs,
+    their pre-serialized JSON, and a stable hash of the tool set that changes only when
+    a tool definition changes. The payload dicts are shared: callers must copy before
+    modifying them.
+    """
+
+    __slots__ = ('names', 'definitions', 'functions', 'openai_tools', 'claude_tools',
+                 'openai_json', 'claude_json', 'hash', '_sources', '_role_views')
+
+    def __init__(self, definitions):
+        openai_tools = []
+        by_name = {}
+        functions = {}
+
+        for definition, function in definitions:
+            name = definition['function']['name']
+            by_name[name] = _freeze(definition)
+            functions[name] = function
+            openai_tools.append({key: value for key, value in definition.items() if not key.startswith('_')})
+
+        claude_tools = [convert_openai_tool_to_claude(tool) for tool in openai_tools]
+
+        self.names = tuple(by_name)
+        self.definitions = MappingProxyType(by_name)
+        self.functions = MappingProxyType(functions)
+        self.openai_tools = tuple(openai_tools)
+        self.claude_tools = tuple(claude_tools)
+        self.openai_json = json.dumps(openai_tools, sort_keys=True, separators=(',', ':'))
+        self.claude_json = json.dumps(claude_tools, sort_keys=True, separators=(',', ':'))
+        self.hash = hashlib.sha256(self.openai_json.encode()).hexdigest()[:16]
+        self._sources = tuple(definitions)
+        self._role_views = {}
+
+    def for_roles(self, roles):
+        """
+        Get the registry restricted to the tools allowed for a set of roles.
+
+        Each function registered under the `ai_assistant_tool_filters` hook is called as
+        `filter(tool_name, roles)` and must return True to keep a tool. Views are cached
+        per role set; without any hooks the full registry is returned.
+        """
+        filters = frappe.get_hooks("ai_assistant_tool_filters") or []
+        if not filters:
+            return self
+
+        key = frozenset(roles or ())
+        view = self._role_views.get(key)
+        if view is None:
+            filter_functions = [frappe.get_attr(path) for path in filters]
+            allowed = [
+                (definition, function)
+                for definition, function in self._sources
+                if definition['function']['name'] in REQUIRED_TOOLS
+                or all(f(definition['function']['name'], key) for f in filter_functions)
+            ]
+            view = ToolRegistry(allowed)
+            self._role_views[key] = view
+        return view
+
+
+TOOL_REGISTRY = ToolRegistry(TOOL_DEFINITIONS)
+
+
+def get_tool_registry(roles=None):
+    """
+    Get the tool registry for the given roles (defaults to the current user's roles).
+    """
+    if roles is None:
+        roles = frappe.get_roles()
+    return TOOL_REGISTRY.for_roles(roles)
+
+
 def get_tool_by_name(tool_name):
     """
     Get the tool definition dict by name.
     Used to check metadata like _is_write_operation.
     """
-    tool_map = {
-        'final_answer': final_answer_tool,
-        'think': think_tool,
-        'lookup_entity': lookup_entity_tool,
-        'global_search': global_search_tool,
-        'get_sales_invoices': get_sales_invoices_tool,
-        'get_sales_invoice': get_sales_invoice_tool,
-        'list_invoices': list_invoices_tool,
-        'get_employees': get_employees_tool,
-        'get_purchase_orders': get_purchase_orders_tool,
-        'get_customers': get_customers_tool,
-        'list_customers': list_customers_tool,
-        'get_stock_levels': get_stock_levels_tool,
-        'get_general_ledger_entries': get_general_ledger_entries_tool,
-        'get_profit_and_loss_statement': get_profit_and_loss_statement_tool,
-        'get_outstanding_invoices': get_outstanding_invoices_tool,
-        'get_sales_orders': get_sales_orders_tool,
-        'list_quotations': list_quotations_tool,
-        'list_sales_orders': list_sales_orders_tool,
-        'list_delivery_notes': list_delivery_notes_tool,
-        'get_delivery_note': get_delivery_note_tool,
-        'get_purchase_invoices': get_purchase_invoices_tool,
-        'get_journal_entries': get_journal_entries_tool,
-        'get_payments': get_payments_tool,
-        'list_service_protocols': list_service_protocols_tool,
-        'get_service_protocol': get_service_protocol_tool,
-        'create_lead': create_lead_tool,
-        'get_top_customers_by_sales': get_top_customers_by_sales_tool,
-        'aggregate_data': aggregate_data_tool,
-        'get_customer_summary': get_customer_summary_tool,
-    }
-    return tool_map.get(tool_name)
+    return TOOL_REGISTRY.definitions.get(tool_name)
 
 
 def is_write_operation(tool_name):
@@ -3433,83 +4047,18 @@ def get_write_tool_metadata(tool_name):
     }
 
 
-def get_tools():
+def get_tools(roles=None):
     """Get tools in OpenAI format (for backwards compatibility)."""
-    return [
-        # Final answer tool - MUST be called to respond to user
-        final_answer_tool,
-        # Think tool - for AI reasoning
-        think_tool,
-        # Entity lookup tool - should be used first to resolve informal names
-        lookup_entity_tool,
-        # Global search tool - cross-doctype full-text search
-        global_search_tool,
-        # Document query tools
-        get_sales_invoices_tool,
-        get_sales_invoice_tool,
-        list_invoices_tool,
-        get_employees_tool,
-        get_purchase_orders_tool,
-        get_customers_tool,
-        list_customers_tool,
-        get_stock_levels_tool,
-        get_general_ledger_entries_tool,
-        get_profit_and_loss_statement_tool,
-        get_outstanding_invoices_tool,
-        get_sales_orders_tool,
-        list_quotations_tool,
-        list_sales_orders_tool,
-        list_delivery_notes_tool,
-        get_delivery_note_tool,
-        get_purchase_invoices_tool,
-        get_journal_entries_tool,
-        get_payments_tool,
-        list_service_protocols_tool,
-        get_service_protocol_tool,
-        create_lead_tool,
-        get_top_customers_by_sales_tool,
-        aggregate_data_tool,
-        get_customer_summary_tool,
-    ]
+    return list(get_tool_registry(roles).openai_tools)
 
 
-def get_claude_tools():
+def get_claude_tools(roles=None):
     """
     Get tools in Claude/Anthropic format.
-    Converts OpenAI-format tool definitions to Claude format.
-    """
-    openai_tools = get_tools()
-    return [convert_openai_tool_to_claude(tool) for tool in openai_tools]
-
-
-available_functions = {
-    "final_answer": final_answer,
-    "think": think,
-    "lookup_entity": lookup_entity,
-    "global_search": global_search,
-    "get_sales_invoices": get_sales_invoices,
-    "get_sales_invoice": get_sales_invoice,
-    "list_invoices": list_invoices,
-    "get_employees": get_employees,
-    "get_purchase_orders": get_purchase_orders,
-    "get_customers": get_customers,
-    "list_customers": list_customers,
-    "get_stock_levels": get_stock_levels,
-    "get_general_ledger_entries": get_general_ledger_entries,
-    "get_profit_and_loss_statement": get_profit_and_loss_statement,
-    "get_outstanding_invoices": get_outstanding_invoices,
-    "get_sales_orders": get_sales_orders,
-    "list_quotations": list_quotations,
-    "list_sales_orders": list_sales_orders,
-    "list_delivery_notes": list_delivery_notes,
-    "get_delivery_note": get_delivery_note,
-    "get_purchase_invoices": get_purchase_invoices,
-    "get_journal_entries": get_journal_entries,
-    "get_payments": get_payments,
-    "list_service_protocols": list_service_protocols,
-    "get_service_protocol": get_service_protocol,
-    "create_lead": create_lead,
-    "get_top_customers_by_sales": get_top_customers_by_sales,
-    "aggregate_data": aggregate_data,
-    "get_customer_summary": get_customer_summary,
-}
+    Conversion from the OpenAI-format definitions happens once, in the registry.
+    """
+    return list(get_tool_registry(roles).claude_tools)
+
+
+# Name -> implementation for every registered tool (read-only)
+available_functions = TOOL_REGISTRY.functions
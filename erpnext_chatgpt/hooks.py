@@ -9,7 +9,7 @@ app_license = "MIT"
 
 # Include JS and CSS files in header of desk.html
 app_include_js = [
-    "/assets/erpnext_chatgpt/js/frontend.js?v=10",
+    "/assets/erpnext_chatgpt/js/frontend.js?v=12",
     "/assets/erpnext_chatgpt/js/openai_settings.js?v=1"
 ]
 
@@ -18,4 +18,46 @@ doctype_js = {
     "OpenAI Settings": "public/js/openai_settings.js"
 }
 
-fixtures = [{"dt": "DocType", "filters": [["name", "in", ["OpenAI Settings", "AI Conversation"]]]}]
+# Document Events
+# Keep the lookup_entity trigram index and result cache in sync with the entity masters
+doc_events = {
+    "Customer": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    },
+    "Supplier": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    },
+    "Item": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    },
+    "Employee": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    },
+    "Lead": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    },
+    "Contact": {
+        "on_update": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "on_trash": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_change",
+        "after_rename": "erpnext_chatgpt.erpnext_chatgpt.entity_index.on_entity_rename"
+    }
+}
+
+# Move inactive conversations to cold storage and delete expired ones (see retention.py)
+scheduler_events = {
+    "daily_long": [
+        "erpnext_chatgpt.erpnext_chatgpt.retention.apply_conversation_retention"
+    ]
+}
+
+fixtures = [{"dt": "DocType", "filters": [["name", "in", ["OpenAI Settings", "AI Conversation", "AI Conversation Message"]]]}]
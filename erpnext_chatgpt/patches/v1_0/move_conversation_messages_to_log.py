@@ -0,0 +1,50 @@
+import json
+
+import frappe
+
+from erpnext_chatgpt.erpnext_chatgpt.api import MESSAGE_DOCTYPE, MESSAGE_ROW_FIELDS, build_message_rows
+
+
+def execute():
+    """
+    Move the AI Conversation.messages JSON blobs into AI Conversation Message rows,
+    one row per message, and set message_count to match. Conversations that already
+    have rows are skipped, so the patch can be re-run safely.
+    """
+    if not frappe.db.has_column("AI Conversation", "messages"):
+        return
+
+    names = frappe.db.sql_list("""
+        SELECT name FROM `tabAI Conversation`
+        WHERE messages IS NOT NULL AND messages NOT IN ('', '[]')
+    """)
+
+    for name in names:
+        if frappe.db.exists(MESSAGE_DOCTYPE, {"conversation": name}):
+            continue
+
+        owner, blob, modified = frappe.db.get_value("AI Conversation", name, ["owner", "messages", "modified"])
+        try:
+            messages = json.loads(blob)
+        except (TypeError, ValueError):
+            frappe.log_error(f"Could not parse messages of AI Conversation {name}", "AI Conversation Message Migration")
+            continue
+
+        messages = [
+            message for message in messages
+            if isinstance(message, dict) and message.get("role") in ("user", "assistant")
+        ]
+        if messages:
+            frappe.db.bulk_insert(
+                MESSAGE_DOCTYPE,
+                MESSAGE_ROW_FIELDS,
+                build_message_rows(name, owner, messages, 1, modified)
+            )
+
+        frappe.db.set_value(
+            "AI Conversation",
+            name,
+            {"message_count": len(messages), "messages": None},
+            update_modified=False
+        )
+        frappe.db.commit()
@@ -0,0 +1,33 @@
+import frappe
+
+
+def execute():
+    """
+    Renumber the messages of conversations where overlapping requests appended rows
+    with the same seq, so the unique (conversation, seq) index added by
+    AI Conversation Message's on_doctype_update can be created. Rows keep their order
+    (seq, then creation). Runs before the model sync; safe to re-run.
+    """
+    if not frappe.db.table_exists("AI Conversation Message"):
+        return
+
+    conversations = frappe.db.sql_list("""
+        SELECT DISTINCT conversation FROM `tabAI Conversation Message`
+        GROUP BY conversation, seq
+        HAVING COUNT(*) > 1
+    """)
+
+    for conversation in conversations:
+        names = frappe.db.sql_list("""
+            SELECT name FROM `tabAI Conversation Message`
+            WHERE conversation = %s
+            ORDER BY seq, creation, name
+        """, conversation)
+        for seq, name in enumerate(names, start=1):
+            frappe.db.sql("UPDATE `tabAI Conversation Message` SET seq = %s WHERE name = %s", (seq, name))
+        frappe.db.set_value("AI Conversation", conversation, "message_count", len(names), update_modified=False)
+        frappe.db.commit()
+
+    # Replaced by the unique index
+    if frappe.db.has_index("tabAI Conversation Message", "conversation_seq_index"):
+        frappe.db.sql_ddl("ALTER TABLE `tabAI Conversation Message` DROP INDEX conversation_seq_index")
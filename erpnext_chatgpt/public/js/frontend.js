@@ -7,6 +7,7 @@ console.log("ERPNext ChatGPT Frontend loaded - v2.2 with SSE streaming support")
 // Session-based conversation state
 let currentSessionId = null;
 let conversation = []; // Local display cache
+let historyCursor = null; // Cursor of the history page before the oldest loaded message
 let pendingConfirmation = null; // Stores pending write operation confirmation
 let currentAbortController = null; // For canceling in-flight requests
 let currentEventSource = null; // For SSE streaming
@@ -88,6 +89,7 @@ async function loadConversation() {
   } else {
     // No existing conversation, show welcome prompts
     conversation = [];
+    historyCursor = null;
     showSuggestionPrompts();
   }
 }
@@ -102,6 +104,7 @@ async function loadSession(sessionId) {
     if (response?.message?.success) {
       currentSessionId = sessionId;
       conversation = response.message.messages || [];
+      historyCursor = response.message.next_cursor || null;
       updateConversationTitle(response.message.title);
 
       if (conversation.length === 0) {
@@ -188,6 +191,7 @@ async function createNewConversation() {
       currentSessionId = response.message.session_id;
       localStorage.setItem("lastAISessionId", currentSessionId);
       conversation = [];
+      historyCursor = null;
       updateConversationTitle("New Conversation");
       showSuggestionPrompts();
       console.log("Created new conversation:", currentSessionId);
@@ -768,6 +772,11 @@ async function askQuestionStreaming(question) {
       });
     });
 
+    currentEventSource.addEventListener('answer_delta', (event) => {
+      const data = JSON.parse(event.data);
+      appendStreamingAnswer(data.text || '');
+    });
+
     currentEventSource.addEventListener('thinking', (event) => {
       const data = JSON.parse(event.data);
       console.log("Thinking:", data);
@@ -983,6 +992,23 @@ function updateToolInProgressList(toolName, status, summary = null) {
   }
 }
 
+/**
+ * Append streamed answer text to the live answer bubble
+ */
+function appendStreamingAnswer(text) {
+  let answerEl = document.getElementById('streaming-answer');
+  if (!answerEl) {
+    answerEl = document.createElement('div');
+    answerEl.id = 'streaming-answer';
+    answerEl.className = 'alert alert-light';
+    answerEl.style.cssText = 'white-space: pre-wrap;';
+    document.getElementById("answer").appendChild(answerEl);
+    updateStreamingProgress('Writing answer...', null);
+  }
+  answerEl.textContent += text;
+  scrollToBottom();
+}
+
 /**
  * Remove the streaming progress panel
  */
@@ -991,6 +1017,10 @@ function removeStreamingProgressPanel() {
   if (panel) {
     panel.remove();
   }
+  const streamingAnswer = document.getElementById('streaming-answer');
+  if (streamingAnswer) {
+    streamingAnswer.remove();
+  }
 }
 
 /**
@@ -1100,10 +1130,62 @@ function parseResponseMessage(response) {
   return { content: stringified, content_display: stringified, tool_usage: tool_usage };
 }
 
-function displayConversation(conversation) {
+// Prepend the history page before the oldest loaded message
+window.loadEarlierMessages = async function() {
+  if (!historyCursor || !currentSessionId) return;
+
+  const button = document.getElementById("load-earlier-messages");
+  if (button) {
+    button.disabled = true;
+    button.textContent = "Loading...";
+  }
+
+  try {
+    const response = await frappe.call({
+      method: "erpnext_chatgpt.erpnext_chatgpt.api.get_conversation",
+      args: { session_id: currentSessionId, cursor: historyCursor }
+    });
+
+    if (response?.message?.success) {
+      conversation = (response.message.messages || []).concat(conversation);
+      historyCursor = response.message.next_cursor || null;
+      displayConversation(conversation, { keepScroll: true });
+    } else {
+      console.error("Failed to load earlier messages:", response?.message?.error);
+      if (button) {
+        button.disabled = false;
+        button.textContent = "Load earlier messages";
+      }
+    }
+  } catch (error) {
+    console.error("Error loading earlier messages:", error);
+    if (button) {
+      button.disabled = false;
+      button.textContent = "Load earlier messages";
+    }
+  }
+}
+
+function displayConversation(conversation, options = {}) {
   const conversationContainer = document.getElementById("answer");
+  // Distance from the bottom, so prepending earlier messages keeps the view in place
+  const offsetFromBottom = conversationContainer.scrollHeight - conversationContainer.scrollTop;
   conversationContainer.innerHTML = "";
 
+  if (historyCursor) {
+    const loadEarlier = document.createElement("div");
+    loadEarlier.className = "text-center mb-2";
+    loadEarlier.innerHTML = `
+      <button
+        id="load-earlier-messages"
+        class="btn btn-sm btn-outline-secondary"
+        onclick="loadEarlierMessages()"
+        style="font-size: 12px; padding: 4px 10px; border-radius: 4px;"
+      >Load earlier messages</button>
+    `;
+    conversationContainer.appendChild(loadEarlier);
+  }
+
   let displayIndex = 0;
   conversation.forEach((message) => {
     // Only display user and assistant messages with actual content
@@ -1150,6 +1232,10 @@ function displayConversation(conversation) {
       console.log("Message has tool usage:", message.tool_usage);
       const messageId = `msg-${displayIndex}`;
       content += renderToolUsageToggle(message.tool_usage, messageId);
+    } else if (role === "assistant" && message.tool_summary) {
+      // Loaded history only carries a summary; details are fetched on first expand
+      const messageId = `msg-${displayIndex}`;
+      content += renderToolSummaryToggle(message.tool_summary, messageId, message.seq);
     }
 
     messageElement.innerHTML = content;
@@ -1157,8 +1243,12 @@ function displayConversation(conversation) {
     displayIndex++;
   });
 
-  // Scroll to bottom of conversation
-  scrollToBottom();
+  if (options.keepScroll) {
+    conversationContainer.scrollTop = conversationContainer.scrollHeight - offsetFromBottom;
+  } else {
+    // Scroll to bottom of conversation
+    scrollToBottom();
+  }
 }
 
 function scrollToBottom() {
@@ -1196,37 +1286,61 @@ function renderToolUsageToggle(toolUsage, messageId) {
   });
   console.log("All entities for chips:", allEntities);
 
-  let html = `<div class="mt-2">`;
+  return renderToolUsageButtons(messageId, {
+    toolCount: regularTools.length,
+    thinkingCount: thinkingEntries.length,
+    entities: allEntities,
+    detailsHtml: regularTools.length > 0 ? renderToolUsageDetails(regularTools) : "",
+    thinkingHtml: thinkingEntries.length > 0 ? renderThinkingDetails(thinkingEntries) : ""
+  });
+}
+
+function renderToolSummaryToggle(toolSummary, messageId, seq) {
+  if (!toolSummary.tool_count && !toolSummary.thinking_count) return "";
+
+  return renderToolUsageButtons(messageId, {
+    toolCount: toolSummary.tool_count || 0,
+    thinkingCount: toolSummary.thinking_count || 0,
+    entities: toolSummary.fetched_entities || [],
+    seq: seq
+  });
+}
+
+function renderToolUsageButtons(messageId, { toolCount, thinkingCount, entities, detailsHtml = "", thinkingHtml = "", seq = null }) {
+  // A seq marks details that still have to be fetched (see ensureToolUsageLoaded)
+  let html = seq !== null
+    ? `<div class="mt-2" id="${messageId}-tool-usage" data-seq="${seq}">`
+    : `<div class="mt-2">`;
 
   // Regular tools section
-  if (regularTools.length > 0) {
+  if (toolCount > 0) {
     html += `
       <button
         class="btn btn-sm btn-outline-secondary"
         onclick="toggleToolUsage('${messageId}')"
         style="font-size: 12px; padding: 4px 10px; border-radius: 4px;"
       >
-        ℹ️ <span id="${messageId}-toggle-text">Show</span> data access info (${regularTools.length} ${regularTools.length === 1 ? 'query' : 'queries'})
+        ℹ️ <span id="${messageId}-toggle-text">Show</span> data access info (${toolCount} ${toolCount === 1 ? 'query' : 'queries'})
       </button>
-      ${renderEntityChips(allEntities, messageId)}
+      ${renderEntityChips(entities, messageId)}
       <div id="${messageId}-details" style="display: none;" class="mt-2">
-        ${renderToolUsageDetails(regularTools)}
+        ${detailsHtml}
       </div>
     `;
   }
 
   // Thinking section (collapsible)
-  if (thinkingEntries.length > 0) {
+  if (thinkingCount > 0) {
     html += `
       <button
         class="btn btn-sm btn-outline-info ml-2"
         onclick="toggleThinking('${messageId}')"
         style="font-size: 12px; padding: 4px 10px; border-radius: 4px;"
       >
-        🧠 <span id="${messageId}-thinking-toggle-text">Show</span> AI reasoning (${thinkingEntries.length})
+        🧠 <span id="${messageId}-thinking-toggle-text">Show</span> AI reasoning (${thinkingCount})
       </button>
       <div id="${messageId}-thinking-details" style="display: none;" class="mt-2">
-        ${renderThinkingDetails(thinkingEntries)}
+        ${thinkingHtml}
       </div>
     `;
   }
@@ -1308,12 +1422,51 @@ function getEntityIcon(doctype) {
   return icons[doctype] || '📄';
 }
 
+// Fetch the tool usage log of a history message the first time its details are expanded
+async function ensureToolUsageLoaded(messageId) {
+  const container = document.getElementById(`${messageId}-tool-usage`);
+  if (!container || container.dataset.loaded) return;
+
+  const seq = parseInt(container.dataset.seq, 10);
+  const details = document.getElementById(`${messageId}-details`);
+  const thinkingDetails = document.getElementById(`${messageId}-thinking-details`);
+  const loading = `<div class="text-muted" style="font-size: 12px;">Loading...</div>`;
+  if (details) details.innerHTML = loading;
+  if (thinkingDetails) thinkingDetails.innerHTML = loading;
+
+  try {
+    const response = await frappe.call({
+      method: "erpnext_chatgpt.erpnext_chatgpt.api.get_message_tool_usage",
+      args: { session_id: currentSessionId, seq: seq }
+    });
+
+    if (!response?.message?.success) {
+      throw new Error(response?.message?.error || "Unknown error");
+    }
+
+    const toolUsage = response.message.tool_usage || [];
+    if (details) details.innerHTML = renderToolUsageDetails(toolUsage.filter(t => !t.is_thinking));
+    if (thinkingDetails) thinkingDetails.innerHTML = renderThinkingDetails(toolUsage.filter(t => t.is_thinking));
+    container.dataset.loaded = "1";
+
+    // Keep it with the message, so re-renders and the debug export have the full log
+    const message = conversation.find(m => m.seq === seq);
+    if (message) message.tool_usage = toolUsage;
+  } catch (error) {
+    console.error("Error loading tool usage:", error);
+    const failed = `<div class="text-danger" style="font-size: 12px;">Could not load details: ${error.message}</div>`;
+    if (details) details.innerHTML = failed;
+    if (thinkingDetails) thinkingDetails.innerHTML = failed;
+  }
+}
+
 // Make toggleToolUsage globally available for onclick events
-window.toggleToolUsage = function(messageId) {
+window.toggleToolUsage = async function(messageId) {
   const details = document.getElementById(`${messageId}-details`);
   const toggleText = document.getElementById(`${messageId}-toggle-text`);
 
   if (details.style.display === "none") {
+    await ensureToolUsageLoaded(messageId);
     details.style.display = "block";
     toggleText.textContent = "Hide";
   } else {
@@ -1323,12 +1476,13 @@ window.toggleToolUsage = function(messageId) {
 }
 
 // Make toggleThinking globally available for onclick events
-window.toggleThinking = function(messageId) {
+window.toggleThinking = async function(messageId) {
   const details = document.getElementById(`${messageId}-thinking-details`);
   const toggleText = document.getElementById(`${messageId}-thinking-toggle-text`);
 
   if (details && toggleText) {
     if (details.style.display === "none") {
+      await ensureToolUsageLoaded(messageId);
       details.style.display = "block";
       toggleText.textContent = "Hide";
     } else {